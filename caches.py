@@ -0,0 +1,573 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+from aiograpi.exceptions import (
+    HashtagNotFound,
+    HighlightNotFound,
+    LocationNotFound,
+    MediaNotFound,
+    UserNotFound,
+)
+from aiograpi.types import User, UserShort
+from pydantic import BaseModel
+
+from storages import REDIS_SCHEMES, normalize_sessionid
+
+# Seconds each cached lookup route stays fresh; AIOGRAPI_REST_RESPONSE_CACHE_TTLS overrides them
+ROUTE_TTLS = {
+    "user_info": 300.0,
+    "user_info_by_username": 300.0,
+    "media_info": 120.0,
+    "hashtag_info": 600.0,
+    "location_info": 3600.0,
+    "highlight_info": 300.0,
+}
+# Seconds past its TTL an entry may still be served while one background refresh
+# replaces it (stale-while-revalidate); AIOGRAPI_REST_RESPONSE_CACHE_STALE overrides them
+ROUTE_STALE = {
+    "user_info": 600.0,
+    "user_info_by_username": 600.0,
+    "media_info": 300.0,
+}
+# Seconds a definitive not-found answer is remembered per route;
+# AIOGRAPI_REST_NOT_FOUND_TTLS overrides them
+ROUTE_NOT_FOUND_TTLS = {
+    "user_info_by_username": 60.0,
+    "user_id_from_username": 60.0,
+    "media_info": 300.0,
+    "hashtag_info": 300.0,
+}
+# Upstream errors that mean the object does not exist, as opposed to a failed call
+NOT_FOUND_ERRORS = (UserNotFound, MediaNotFound, HashtagNotFound, LocationNotFound, HighlightNotFound)
+SESSION_SCOPE = "session"
+SHARED_SCOPE = "shared"
+
+
+def parse_route_settings(spec: str) -> dict[str, float]:
+    """Parse `user_info=300,media_info=60` into {route: seconds}
+    """
+    settings = {}
+    for item in spec.split(","):
+        route, _, value = item.partition("=")
+        if route.strip() and value.strip():
+            settings[route.strip()] = float(value)
+    return settings
+
+
+def response_size(value: Any) -> int:
+    """Approximate memory held by a cached response, measured as its JSON size
+    """
+    if hasattr(value, "model_dump_json"):
+        return len(value.model_dump_json())
+    return len(json.dumps(value, default=str))
+
+
+@dataclass
+class CachedResponse:
+    value: Any
+    size: int
+    expires_at: float
+    stale_until: float
+
+
+class NotFound(Exception):
+    """A lookup whose object does not exist upstream, answered with 404
+    """
+
+    def __init__(self, detail: str, exc_type: str, cached: bool = False):
+        super().__init__(detail)
+        self.exc_type = exc_type
+        self.cached = cached
+
+
+@dataclass
+class CachedNotFound:
+    detail: str
+    exc_type: str
+    expires_at: float
+
+
+class NotFoundCache:
+    """Short-lived LRU memory of lookups that came back not found
+
+    Deleted posts and renamed or banned accounts fail the same way on every
+    retry, so they are answered locally for a per-route TTL. The cache holds
+    at most `max_entries` answers; `0` disables it.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttls: Optional[dict[str, float]] = None,
+                 clock=time.monotonic):
+        if max_entries is None:
+            max_entries = int(os.getenv("AIOGRAPI_REST_NOT_FOUND_MAX_ENTRIES", "10000"))
+        if ttls is None:
+            ttls = ROUTE_NOT_FOUND_TTLS | parse_route_settings(os.getenv("AIOGRAPI_REST_NOT_FOUND_TTLS", ""))
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self.clock = clock
+        self._entries: "OrderedDict[tuple, CachedNotFound]" = OrderedDict()
+        self.hits = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def check(self, key: tuple) -> None:
+        """Raise NotFound when the lookup is remembered as missing
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        if entry.expires_at <= self.clock():
+            del self._entries[key]
+            return
+        self._entries.move_to_end(key)
+        self.hits += 1
+        raise NotFound(entry.detail, entry.exc_type, cached=True)
+
+    def put(self, route: str, key: tuple, exc: Exception) -> None:
+        ttl = self.ttls.get(route, 0)
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = CachedNotFound(
+            detail=str(exc), exc_type=type(exc).__name__, expires_at=self.clock() + ttl)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "evictions": self.evictions,
+        }
+
+
+class ResponseCache:
+    """Read-through LRU cache for idempotent lookup routes
+
+    Entries are keyed by route, normalized query parameters and a scope: with
+    the default `session` scope every session has its own entries, because
+    Instagram answers differ by viewer (private profiles, friendship state);
+    `shared` lets all sessions reuse each other's lookups. Each route has its
+    own TTL and a TTL of 0 leaves the route uncached. Least recently used
+    entries are evicted once the cached responses exceed `max_bytes`.
+
+    Routes with a stale window keep serving an expired entry for that long
+    while a single background refresh per key reloads it; at most
+    `max_refreshes` refreshes run at once.
+
+    Not-found answers are remembered separately in `not_found` and raised as
+    NotFound without another upstream call.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, ttls: Optional[dict[str, float]] = None,
+                 scope: Optional[str] = None, clock=time.monotonic, stale: Optional[dict[str, float]] = None,
+                 max_refreshes: Optional[int] = None, not_found: Optional[NotFoundCache] = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("AIOGRAPI_REST_RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        if ttls is None:
+            ttls = ROUTE_TTLS | parse_route_settings(os.getenv("AIOGRAPI_REST_RESPONSE_CACHE_TTLS", ""))
+        if scope is None:
+            scope = os.getenv("AIOGRAPI_REST_RESPONSE_CACHE_SCOPE", SESSION_SCOPE)
+        if stale is None:
+            stale = ROUTE_STALE | parse_route_settings(os.getenv("AIOGRAPI_REST_RESPONSE_CACHE_STALE", ""))
+        if max_refreshes is None:
+            max_refreshes = int(os.getenv("AIOGRAPI_REST_RESPONSE_CACHE_REFRESHES", "8"))
+        if not_found is None:
+            not_found = NotFoundCache(clock=clock)
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.scope = scope
+        self.clock = clock
+        self.stale = stale
+        self.max_refreshes = max_refreshes
+        self.not_found = not_found
+        self._entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        # key -> background refresh in flight
+        self._refreshing: dict[tuple, asyncio.Task] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, route: str, params: dict[str, Any], sessionid: str) -> tuple:
+        # Usernames, hashtags and ids compare case- and whitespace-insensitively
+        normalized = tuple(sorted((name, str(value).strip().lower()) for name, value in params.items()))
+        owner = normalize_sessionid(sessionid) if self.scope != SHARED_SCOPE else ""
+        return route, normalized, owner
+
+    async def fetch(self, route: str, params: dict[str, Any], sessionid: str,
+                    loader: Callable[[], Awaitable[Any]], refresh: bool = False) -> Any:
+        """Return the cached response for the lookup or load and cache it
+
+        With `refresh` the cached entry is skipped and replaced. Objects
+        that do not exist upstream raise NotFound.
+        """
+        key = self.key(route, params, sessionid)
+        if refresh:
+            self.not_found.discard(key)
+        else:
+            self.not_found.check(key)
+        try:
+            return await self._fetch(route, key, loader, refresh)
+        except NOT_FOUND_ERRORS as exc:
+            self.not_found.put(route, key, exc)
+            raise NotFound(str(exc), type(exc).__name__) from exc
+
+    async def _fetch(self, route: str, key: tuple, loader: Callable[[], Awaitable[Any]], refresh: bool) -> Any:
+        ttl = self.ttls.get(route, 0)
+        if self.max_bytes <= 0 or ttl <= 0:
+            return await loader()
+        entry = self._entries.get(key)
+        now = self.clock()
+        if entry is not None and not refresh:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            if entry.stale_until > now:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                self._revalidate(route, key, loader)
+                return entry.value
+        self.misses += 1
+        value = await loader()
+        self.put(key, value, ttl, self.stale.get(route, 0))
+        return value
+
+    def _revalidate(self, route: str, key: tuple, loader: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._refreshing or len(self._refreshing) >= self.max_refreshes:
+            return
+        self._refreshing[key] = asyncio.create_task(self._refresh(route, key, loader))
+
+    async def _refresh(self, route: str, key: tuple, loader: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            value = await loader()
+        except NOT_FOUND_ERRORS as exc:
+            self.discard(key)
+            self.not_found.put(route, key, exc)
+        except Exception:
+            # The stale entry keeps being served until its window closes
+            self.refresh_errors += 1
+        else:
+            self.refreshes += 1
+            self.put(key, value, self.ttls.get(route, 0), self.stale.get(route, 0))
+        finally:
+            self._refreshing.pop(key, None)
+
+    def put(self, key: tuple, value: Any, ttl: float, stale: float = 0) -> None:
+        size = response_size(value)
+        self.discard(key)
+        if size > self.max_bytes:
+            return
+        expires_at = self.clock() + ttl
+        self._entries[key] = CachedResponse(
+            value=value, size=size, expires_at=expires_at, stale_until=expires_at + stale)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+
+    def discard(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    async def close(self) -> None:
+        """Cancel background refreshes still in flight
+        """
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._refreshing.clear()
+
+    def stats(self) -> dict[str, Any]:
+        served = self.hits + self.stale_hits
+        lookups = served + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": served / lookups if lookups else 0.0,
+            "refreshing": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+# Stand-in used when no app lifespan owns a cache, e.g. in tests that skip it
+NO_RESPONSE_CACHE = ResponseCache(max_bytes=0, not_found=NotFoundCache(max_entries=0))
+
+
+# Observations of an unchanged mapping are written back at most this often
+USER_INDEX_TOUCH_INTERVAL = 300.0
+# Response nesting walked when collecting users (e.g. list -> Media -> usertags -> UserShort)
+USER_SEARCH_DEPTH = 6
+
+
+def user_index_path() -> str:
+    """SQLite file of the username index, next to the session database by default
+    """
+    path = os.getenv("AIOGRAPI_REST_USER_INDEX_PATH")
+    if path is not None:
+        return path
+    db_path = os.getenv("AIOGRAPI_REST_DB_PATH", "./db.json")
+    if db_path.startswith(REDIS_SCHEMES):
+        db_path = "./db.json"
+    return os.path.join(os.path.dirname(db_path) or ".", "users.db")
+
+
+def iter_users(value: Any, depth: int = USER_SEARCH_DEPTH) -> Iterator[User | UserShort]:
+    """Yield every User and UserShort nested in a route's return value
+    """
+    if isinstance(value, (User, UserShort)):
+        yield value
+    elif depth <= 0 or isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return
+    elif isinstance(value, BaseModel):
+        for item in value.__dict__.values():
+            yield from iter_users(item, depth - 1)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_users(item, depth - 1)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from iter_users(item, depth - 1)
+
+
+@dataclass
+class IndexedUser:
+    pk: str
+    username: str
+    seen_at: float
+
+
+class UserIndexStore:
+    """username <-> user_id rows in SQLite, shared across workers through WAL
+
+    Queries run on one dedicated thread, so the event loop never waits on the disk.
+    """
+
+    def __init__(self, path: str):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aiograpi-rest-users")
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "pk TEXT PRIMARY KEY, username TEXT NOT NULL UNIQUE, seen_at REAL NOT NULL)"
+        )
+
+    async def by_pk(self, pk: str) -> Optional[IndexedUser]:
+        return await self._run(self._find, "pk", pk)
+
+    async def by_username(self, username: str) -> Optional[IndexedUser]:
+        return await self._run(self._find, "username", username)
+
+    async def save(self, users: list[IndexedUser]) -> None:
+        await self._run(self._save, users)
+
+    async def close(self) -> None:
+        await self._run(self.conn.close)
+        self._executor.shutdown(wait=False)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _find(self, column: str, value: str) -> Optional[IndexedUser]:
+        row = self.conn.execute(f"SELECT pk, username, seen_at FROM users WHERE {column} = ?", (value,)).fetchone()
+        return IndexedUser(*row) if row else None
+
+    def _save(self, users: list[IndexedUser]) -> None:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for user in users:
+                # A username passed on to another account belongs to whoever was seen last
+                self.conn.execute(
+                    "DELETE FROM users WHERE username = ? AND pk != ? AND seen_at <= ?",
+                    (user.username, user.pk, user.seen_at),
+                )
+                try:
+                    self.conn.execute(
+                        "INSERT INTO users (pk, username, seen_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(pk) DO UPDATE SET username = excluded.username, seen_at = excluded.seen_at "
+                        "WHERE excluded.seen_at >= users.seen_at",
+                        (user.pk, user.username, user.seen_at),
+                    )
+                except sqlite3.IntegrityError:
+                    # Another worker saw the username on a different account more recently
+                    continue
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+
+class UserIndex:
+    """Bidirectional username <-> user_id index fed by every user a route returns
+
+    Recent mappings live in an LRU hot tier of `max_entries`; everything is
+    persisted to SQLite in the background, so lookups survive restarts and are
+    shared by workers. Entries older than `max_age` seconds are not answered
+    from the index. `max_entries=0` disables the index.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None,
+                 max_age: Optional[float] = None, clock=time.time):
+        if path is None:
+            path = user_index_path()
+        if max_entries is None:
+            max_entries = int(os.getenv("AIOGRAPI_REST_USER_INDEX_HOT_ENTRIES", "100000"))
+        if max_age is None:
+            max_age = float(os.getenv("AIOGRAPI_REST_USER_INDEX_MAX_AGE", str(7 * 24 * 3600)))
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        self.store = UserIndexStore(path) if path and max_entries > 0 else None
+        self._by_pk: "OrderedDict[str, IndexedUser]" = OrderedDict()
+        self._by_username: dict[str, str] = {}
+        self._pending: dict[str, IndexedUser] = {}
+        self._flush: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.write_errors = 0
+
+    def __len__(self) -> int:
+        return len(self._by_pk)
+
+    def observe(self, value: Any) -> None:
+        """Record every User and UserShort found in a route's return value
+        """
+        if self.max_entries <= 0:
+            return
+        for user in iter_users(value):
+            if user.pk and user.username:
+                self.record(user.pk, user.username)
+
+    def record(self, pk: Any, username: str) -> None:
+        if self.max_entries <= 0:
+            return
+        pk, username = str(pk), username.strip().lower()
+        now = self.clock()
+        current = self._by_pk.get(pk)
+        if current and current.username == username and now - current.seen_at < USER_INDEX_TOUCH_INTERVAL:
+            self._by_pk.move_to_end(pk)
+            return
+        user = IndexedUser(pk=pk, username=username, seen_at=now)
+        self._remember(user)
+        if self.store is not None:
+            self._pending[pk] = user
+            if self._flush is None or self._flush.done():
+                self._flush = asyncio.create_task(self._write())
+
+    async def user_id(self, username: str, max_age: Optional[float] = None) -> Optional[str]:
+        """Indexed user id for a username, or None when unknown or older than max_age
+        """
+        username = username.strip().lower()
+        pk = self._by_username.get(username)
+        user = self._by_pk.get(pk) if pk else None
+        if user is None and self.store is not None:
+            user = await self.store.by_username(username)
+        user = self._fresh(user, max_age)
+        return user.pk if user else None
+
+    async def username(self, pk: Any, max_age: Optional[float] = None) -> Optional[str]:
+        """Indexed username for a user id, or None when unknown or older than max_age
+        """
+        user = self._by_pk.get(str(pk))
+        if user is None and self.store is not None:
+            user = await self.store.by_pk(str(pk))
+        user = self._fresh(user, max_age)
+        return user.username if user else None
+
+    def _fresh(self, user: Optional[IndexedUser], max_age: Optional[float]) -> Optional[IndexedUser]:
+        if max_age is None:
+            max_age = self.max_age
+        if user is None or self.clock() - user.seen_at > max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if user.pk not in self._by_pk and user.username not in self._by_username:
+            # Promote a mapping read from disk into the hot tier
+            self._remember(user)
+        return user
+
+    def _remember(self, user: IndexedUser) -> None:
+        previous = self._by_pk.pop(user.pk, None)
+        if previous is not None and self._by_username.get(previous.username) == user.pk:
+            del self._by_username[previous.username]
+        holder = self._by_username.get(user.username)
+        if holder is not None and holder != user.pk:
+            self._by_pk.pop(holder, None)
+        self._by_pk[user.pk] = user
+        self._by_username[user.username] = user.pk
+        while len(self._by_pk) > self.max_entries:
+            _, evicted = self._by_pk.popitem(last=False)
+            if self._by_username.get(evicted.username) == evicted.pk:
+                del self._by_username[evicted.username]
+
+    async def _write(self) -> None:
+        while self._pending:
+            batch, self._pending = list(self._pending.values()), {}
+            try:
+                await self.store.save(batch)
+            except Exception:
+                self.write_errors += 1
+
+    async def close(self) -> None:
+        """Write pending mappings and close the store
+        """
+        if self.store is None:
+            return
+        if self._flush is not None:
+            await self._flush
+        await self._write()
+        await self.store.close()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._by_pk),
+            "max_entries": self.max_entries,
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "write_errors": self.write_errors,
+        }
+
+
+# Stand-in used when no app lifespan owns an index, e.g. in tests that skip it
+NO_USER_INDEX = UserIndex(path="", max_entries=0)
@@ -1,8 +1,14 @@
-from typing import Generator, Optional
+import functools
+import inspect
+from typing import Optional
 
-from fastapi import HTTPException, Request, Security
+from fastapi import Depends, HTTPException, Request, Security
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
 from fastapi.security import APIKeyHeader
 
+from caches import NO_RESPONSE_CACHE, NO_USER_INDEX, ResponseCache, UserIndex
+from helpers import UrlFetcher
 from storages import ClientStorage
 
 sessionid_header = APIKeyHeader(
@@ -16,12 +22,54 @@ sessionid_header = APIKeyHeader(
 )
 
 
-def get_clients() -> Generator:
-    try:
-        clients = ClientStorage()
-        yield clients
-    finally:
-        clients.close()
+def get_clients(request: Request) -> ClientStorage:
+    return request.app.state.clients
+
+
+def get_fetcher(request: Request) -> UrlFetcher:
+    return request.app.state.fetcher
+
+
+def get_responses(request: Request) -> ResponseCache:
+    return getattr(request.app.state, "responses", None) or NO_RESPONSE_CACHE
+
+
+def get_user_index(request: Request) -> UserIndex:
+    return getattr(request.app.state, "users", None) or NO_USER_INDEX
+
+
+def _indexed(endpoint):
+    """Wrap a route endpoint so its return value feeds the username index
+    """
+    if getattr(endpoint, "feeds_user_index", False):
+        # Already wrapped, e.g. when an included router re-creates its routes
+        return endpoint
+    signature = inspect.signature(endpoint)
+
+    @functools.wraps(endpoint)
+    async def indexed(*args, user_index: UserIndex, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            result = await endpoint(*args, **kwargs)
+        else:
+            result = await run_in_threadpool(endpoint, *args, **kwargs)
+        user_index.observe(result)
+        return result
+
+    indexed.__signature__ = signature.replace(parameters=[
+        *signature.parameters.values(),
+        inspect.Parameter("user_index", inspect.Parameter.KEYWORD_ONLY,
+                          default=Depends(get_user_index), annotation=UserIndex),
+    ])
+    indexed.feeds_user_index = True
+    return indexed
+
+
+class IndexedRoute(APIRoute):
+    """Route whose returned User and UserShort objects are recorded in the username index
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _indexed(endpoint), **kwargs)
 
 
 def _clean_sessionid(value: object) -> Optional[str]:
@@ -1,7 +1,150 @@
+import asyncio
 import os
 import tempfile
+from contextlib import asynccontextmanager
+from typing import Optional
 
+import aiofiles
+import httpx
 from aiograpi.story import StoryBuilder
+from aiograpi.utils import InstagramIdCodec
+from fastapi import HTTPException
+
+
+def shortcode_to_pk(code: str) -> str:
+    """Decode a media shortcode into its pk, like `Client.media_pk_from_code`
+    """
+    if not code or not isinstance(code, str):
+        raise ValueError("code is required and must be a non-empty string (got %r)" % (code,))
+    # Longer codes (private posts) carry extra characters after the 11-char pk
+    return str(InstagramIdCodec.decode(code[:11]))
+
+
+def pk_to_shortcode(media_pk: str) -> str:
+    """Encode a media pk as its shortcode, like `Client.media_code_from_pk`
+    """
+    if not str(media_pk).isdigit():
+        raise ValueError("media_pk must be digits (got %r)" % (media_pk,))
+    return InstagramIdCodec.encode(media_pk)
+
+
+def media_id_to_pk(media_id: str) -> str:
+    """Strip the owner from a full media id, like `Client.media_pk`
+    """
+    media_pk, _, user_id = str(media_id).partition("_")
+    if not media_pk.isdigit() or not (user_id or "0").isdigit():
+        raise ValueError("media_id must look like '<media_pk>' or '<media_pk>_<user_id>' (got %r)" % (media_id,))
+    return media_pk
+
+
+def _convert_all(convert, values: list[str]) -> list[Optional[str]]:
+    converted = []
+    for value in values:
+        try:
+            converted.append(convert(value))
+        except ValueError:
+            converted.append(None)
+    return converted
+
+
+def convert_media_ids(codes: list[str], media_ids: list[str], pks: list[str]) -> dict[str, list[Optional[str]]]:
+    """Convert shortcodes and media ids to pks and pks to shortcodes in one pass
+
+    Results come back in input order, one per value (repeats included);
+    values that cannot be converted become None instead of failing the batch.
+    """
+    return {
+        "codes": _convert_all(shortcode_to_pk, codes),
+        "media_ids": _convert_all(media_id_to_pk, media_ids),
+        "pks": _convert_all(pk_to_shortcode, pks),
+    }
+
+
+class UrlFetcher:
+    """Download remote media for the upload-by-URL routes
+
+    Bodies are streamed in chunks into a spool file written through aiofiles,
+    so neither the network nor the disk blocks the event loop and the file
+    never sits in memory. One pooled `httpx.AsyncClient` is shared by every
+    request to reuse keep-alive connections. Responses over `max_bytes` fail
+    with 413, slow servers with 504 and unreachable or failing ones with 502.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, timeout: Optional[float] = None,
+                 max_connections: Optional[int] = None, chunk_size: int = 64 * 1024,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("AIOGRAPI_REST_UPLOAD_MAX_BYTES", str(512 * 1024 * 1024)))
+        if timeout is None:
+            timeout = float(os.getenv("AIOGRAPI_REST_UPLOAD_FETCH_TIMEOUT", "120"))
+        if max_connections is None:
+            max_connections = int(os.getenv("AIOGRAPI_REST_UPLOAD_FETCH_CONNECTIONS", "20"))
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(min(timeout, 30.0)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True,
+            transport=transport,
+        )
+        self.fetches = 0
+        self.fetched_bytes = 0
+        self.rejected = 0
+        self.errors = 0
+
+    @asynccontextmanager
+    async def fetch(self, url, suffix: str = ""):
+        """Yield the path of a spool file holding the body of `url`; it is removed on exit
+        """
+        with tempfile.TemporaryDirectory() as td:
+            path = os.path.join(td, "upload" + suffix)
+            await self._download(str(url), path)
+            yield path
+
+    async def _download(self, url: str, path: str) -> None:
+        size = 0
+        try:
+            # The total deadline also covers servers that trickle bytes forever
+            async with asyncio.timeout(self.timeout):
+                async with self._client.stream("GET", url) as response:
+                    if response.status_code >= 400:
+                        self.errors += 1
+                        raise HTTPException(
+                            status_code=502, detail=f"Fetching {url} failed with HTTP {response.status_code}")
+                    length = response.headers.get("content-length", "")
+                    if length.isdigit() and int(length) > self.max_bytes:
+                        self._reject()
+                    async with aiofiles.open(path, "wb") as fp:
+                        async for chunk in response.aiter_bytes(self.chunk_size):
+                            size += len(chunk)
+                            if size > self.max_bytes:
+                                self._reject()
+                            await fp.write(chunk)
+        except (TimeoutError, httpx.TimeoutException):
+            self.errors += 1
+            raise HTTPException(status_code=504, detail=f"Fetching {url} timed out")
+        except httpx.HTTPError as exc:
+            self.errors += 1
+            raise HTTPException(status_code=502, detail=f"Fetching {url} failed: {exc}")
+        finally:
+            self.fetched_bytes += size
+        self.fetches += 1
+
+    def _reject(self):
+        self.rejected += 1
+        raise HTTPException(status_code=413, detail=f"Remote file is larger than {self.max_bytes} bytes")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "fetches": self.fetches,
+            "fetched_bytes": self.fetched_bytes,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+    async def close(self) -> None:
+        await self._client.aclose()
 
 
 def _write_temp_file(directory, content, suffix):
@@ -13,6 +156,13 @@ def _write_temp_file(directory, content, suffix):
         fp.close()
 
 
+def _source_path(directory, content, suffix):
+    # Content is either uploaded bytes or a file already spooled by UrlFetcher
+    if isinstance(content, (str, os.PathLike)):
+        return os.fspath(content)
+    return _write_temp_file(directory, content, suffix)
+
+
 def _normalize_thumbnail(kwargs, directory):
     kwargs = dict(kwargs)
     thumbnail = kwargs.get('thumbnail')
@@ -22,38 +172,36 @@ def _normalize_thumbnail(kwargs, directory):
 
 
 async def photo_upload_story_as_video(cl, content, **kwargs):
-    with tempfile.NamedTemporaryFile(suffix='.jpg') as fp:
-        fp.write(content)
+    with tempfile.TemporaryDirectory() as td:
+        path = _source_path(td, content, '.jpg')
         mentions = kwargs.get('mentions') or []
         caption = kwargs.get('caption') or ''
-        video = StoryBuilder(fp.name, caption, mentions).photo(15)
+        video = StoryBuilder(path, caption, mentions).photo(15)
         return await cl.video_upload_to_story(video.path, **kwargs)
 
 
 async def photo_upload_story_as_photo(cl, content, **kwargs):
-    with tempfile.NamedTemporaryFile(suffix='.jpg') as fp:
-        fp.write(content)
-        return await cl.photo_upload_to_story(fp.name, **kwargs)
+    with tempfile.TemporaryDirectory() as td:
+        return await cl.photo_upload_to_story(_source_path(td, content, '.jpg'), **kwargs)
 
 
 async def video_upload_story(cl, content, **kwargs):
-    with tempfile.NamedTemporaryFile(suffix='.mp4') as fp:
-        fp.write(content)
+    with tempfile.TemporaryDirectory() as td:
+        path = _source_path(td, content, '.mp4')
         mentions = kwargs.get('mentions') or []
         caption = kwargs.get('caption') or ''
-        video = StoryBuilder(fp.name, caption, mentions).video(15)
+        video = StoryBuilder(path, caption, mentions).video(15)
         return await cl.video_upload_to_story(video.path, **kwargs)
 
 
 async def photo_upload_post(cl, content, **kwargs):
-    with tempfile.NamedTemporaryFile(suffix='.jpg') as fp:
-        fp.write(content)
-        return await cl.photo_upload(fp.name, **kwargs)
+    with tempfile.TemporaryDirectory() as td:
+        return await cl.photo_upload(_source_path(td, content, '.jpg'), **kwargs)
 
 
 async def video_upload_post(cl, content, **kwargs):
     with tempfile.TemporaryDirectory() as td:
-        path = _write_temp_file(td, content, '.mp4')
+        path = _source_path(td, content, '.mp4')
         return await cl.video_upload(path, **_normalize_thumbnail(kwargs, td))
 
 
@@ -71,11 +219,11 @@ async def album_upload_post(cl, files, **kwargs):
 
 async def igtv_upload_post(cl, content, **kwargs):
     with tempfile.TemporaryDirectory() as td:
-        path = _write_temp_file(td, content, '.mp4')
+        path = _source_path(td, content, '.mp4')
         return await cl.igtv_upload(path, **_normalize_thumbnail(kwargs, td))
 
 
 async def clip_upload_post(cl, content, **kwargs):
     with tempfile.TemporaryDirectory() as td:
-        path = _write_temp_file(td, content, '.mp4')
+        path = _source_path(td, content, '.mp4')
         return await cl.clip_upload(path, **_normalize_thumbnail(kwargs, td))
@@ -1,19 +1,27 @@
+import asyncio
+import hmac
+import logging
+import math
 import os
 import platform
 import re
 import subprocess
 import time
 import tomllib
+from contextlib import asynccontextmanager, suppress
 from importlib.metadata import PackageNotFoundError
 from importlib.metadata import version as package_version
 from pathlib import Path
 from typing import Any
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.openapi.utils import get_openapi
 from fastapi.routing import APIRoute
+from starlette.datastructures import Headers
 from starlette.responses import JSONResponse, RedirectResponse, Response
 
+from caches import NotFound, ResponseCache, UserIndex
+from helpers import UrlFetcher
 from routers import (
     account,
     album,
@@ -33,9 +41,12 @@ from routers import (
     user,
     video,
 )
-from storages import ClientStorage
+from storages import CircuitOpen, ClientStorage, RateLimited
 
 APP_PACKAGE_NAME = "aiograpi-rest"
+ADMIN_TOKEN_HEADER = "x-admin-token"
+
+logger = logging.getLogger("aiograpi_rest")
 
 
 def _project_version(pyproject_path: Path | None = None) -> str | None:
@@ -73,7 +84,7 @@ DEPENDENCY_PACKAGES = (
     "starlette",
     "uvicorn",
     "tinydb",
-    "requests",
+    "httpx",
     "aiofiles",
     "python-multipart",
 )
@@ -109,6 +120,7 @@ OPERATION_SUMMARIES = {
     "patchAuthRelogin": "Refresh the current login session",
     "getAuthSettings": "Get saved auth settings",
     "patchAuthSettings": "Save auth settings",
+    "getAuthSession": "Get session validation state",
     "getAuthTimelineFeed": "Get authenticated timeline feed",
     "postAuthTotpEnable": "Enable TOTP two-factor authentication",
     "deleteAuthTotp": "Disable TOTP two-factor authentication",
@@ -120,6 +132,7 @@ OPERATION_SUMMARIES = {
     "getMediaId": "Build a media ID from media PK",
     "getMediaPk": "Extract media PK from media ID",
     "getMediaPkFromCode": "Get media PK from shortcode",
+    "postMediaPkBatch": "Convert media shortcodes, IDs and PKs in bulk",
     "getMediaPkFromUrl": "Get media PK from URL",
     "getMediaInfo": "Get media details",
     "getMediaUserMedias": "List user media",
@@ -231,6 +244,8 @@ OPERATION_SUMMARIES = {
     "getDeps": "Get dependency versions",
     "getHealth": "Check liveness",
     "getMetrics": "Get Prometheus metrics",
+    "postMaintenanceCompact": "Compact session storage",
+    "postMaintenanceGc": "Collect idle and dead sessions",
     "getReady": "Check readiness",
 }
 
@@ -307,10 +322,166 @@ def _polish_operation_summaries(openapi_schema: dict[str, Any]) -> None:
                 operation["summary"] = summary
 
 
+# Paths answered locally, without a session or upstream call, run without a deadline
+UNTIMED_PATHS = frozenset({
+    "/", "/health", "/ready", "/metrics", "/build", "/deps", "/version",
+    "/docs", "/docs/oauth2-redirect", "/redoc", "/openapi.json",
+})
+LOGIN_PATHS = frozenset({
+    "/auth/login", "/auth/login/by/sessionid", "/auth/relogin", "/auth/settings", "/auth/challenge/resolve",
+})
+# Paginated routes: a large (or 0 = everything) `amount` means many upstream pages,
+# each also queued in the rate limiter, so they get a budget of their own
+LIST_PATHS = frozenset({
+    "/direct/inbox", "/direct/thread",
+    "/hashtag/medias/top", "/hashtag/medias/recent",
+    "/location/medias/top", "/location/medias/recent",
+    "/media/user/medias", "/media/usertag/medias", "/media/comments", "/media/comment/replies", "/media/liked",
+    "/story/user/stories", "/story/viewers", "/story/archive",
+    "/user/followers", "/user/following", "/user/follow/requests", "/user/highlights",
+})
+DEADLINE_HEADER = "x-request-timeout"
+
+
+def route_class(path: str) -> str | None:
+    """Name the time budget a request path runs under, or None for local endpoints
+    """
+    if path in UNTIMED_PATHS or path.startswith("/maintenance/"):
+        return None
+    if path in LOGIN_PATHS:
+        return "login"
+    if "/upload" in path or "/download" in path:
+        return "upload"
+    if path in LIST_PATHS:
+        return "list"
+    return "lookup"
+
+
+class RequestDeadlines:
+    """Time budgets per route class
+
+    A caller can shorten, never extend, the budget with an `X-Request-Timeout`
+    header in seconds. A budget of 0 means no limit.
+    """
+
+    def __init__(self, budgets: dict[str, float] | None = None):
+        if budgets is None:
+            budgets = {
+                "lookup": float(os.getenv("AIOGRAPI_REST_LOOKUP_TIMEOUT", "30")),
+                "list": float(os.getenv("AIOGRAPI_REST_LIST_TIMEOUT", "300")),
+                "upload": float(os.getenv("AIOGRAPI_REST_UPLOAD_TIMEOUT", "300")),
+                "login": float(os.getenv("AIOGRAPI_REST_LOGIN_TIMEOUT", "60")),
+            }
+        self.budgets = budgets
+        self.exceeded = dict.fromkeys(budgets, 0)
+
+    def budget(self, route: str, headers: Headers) -> float | None:
+        budget = self.budgets.get(route) or None
+        try:
+            requested = float(headers.get(DEADLINE_HEADER, ""))
+        except ValueError:
+            return budget
+        if requested > 0:
+            budget = min(budget, requested) if budget else requested
+        return budget
+
+
+class DeadlineMiddleware:
+    """Cancel a request that outlives its budget and answer 504
+
+    Cancelling the endpoint also cancels the upstream call it awaits, so a
+    stuck Instagram request does not keep holding a worker slot.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        deadlines = getattr(scope["app"].state, "deadlines", None) if scope["type"] == "http" else None
+        route = route_class(scope["path"]) if deadlines is not None else None
+        budget = deadlines.budget(route, Headers(scope=scope)) if route is not None else None
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+        started = False
+
+        async def send_tracked(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        timeout = asyncio.timeout(budget)
+        try:
+            async with timeout:
+                await self.app(scope, receive, send_tracked)
+        except TimeoutError:
+            # A TimeoutError raised by the endpoint itself is not ours to translate
+            if started or not timeout.expired():
+                raise
+            deadlines.exceeded[route] += 1
+            response = JSONResponse({
+                "detail": f"Request exceeded its {budget:g}s {route} deadline",
+                "exc_type": "DeadlineExceeded",
+            }, status_code=504)
+            await response(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.clients = ClientStorage()
+    app.state.fetcher = UrlFetcher()
+    app.state.deadlines = RequestDeadlines()
+    app.state.responses = ResponseCache()
+    app.state.users = UserIndex()
+    if os.getenv("AIOGRAPI_REST_COMPACT_ON_STARTUP", "0") == "1":
+        # Compaction is housekeeping; a locked or busy store must not stop the worker
+        try:
+            await app.state.clients.compact()
+        except Exception:
+            logger.warning("Session storage compaction on startup failed", exc_info=True)
+    tasks = []
+    if app.state.clients.flush_interval > 0:
+        tasks.append(asyncio.create_task(app.state.clients.run_flusher()))
+    if app.state.clients.invalidation_interval > 0:
+        await app.state.clients.sync_changes()
+        tasks.append(asyncio.create_task(app.state.clients.run_invalidation_watcher()))
+    if app.state.clients.health.enabled:
+        tasks.append(asyncio.create_task(app.state.clients.health.run()))
+    if app.state.clients.gc_enabled:
+        tasks.append(asyncio.create_task(app.state.clients.run_gc()))
+    # Warm-up runs in the background so /health answers while /ready waits for it
+    app.state.warmup = None
+    warmup_sessions = int(os.getenv("AIOGRAPI_REST_WARMUP_SESSIONS", "0"))
+    if warmup_sessions > 0:
+        app.state.warmup = asyncio.create_task(app.state.clients.warm_up(
+            warmup_sessions, concurrency=int(os.getenv("AIOGRAPI_REST_WARMUP_CONCURRENCY", "8")),
+        ))
+        tasks.append(app.state.warmup)
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+            with suppress(Exception, asyncio.CancelledError):
+                await task
+        await app.state.responses.close()
+        await app.state.users.close()
+        await app.state.fetcher.close()
+        await app.state.clients.close()
+        app.state.clients = None
+        app.state.fetcher = None
+        app.state.deadlines = None
+        app.state.responses = None
+        app.state.users = None
+        app.state.warmup = None
+
+
 app = FastAPI(
     generate_unique_id_function=generate_operation_id,
     openapi_tags=OPENAPI_TAGS,
+    lifespan=lifespan,
 )
+app.add_middleware(DeadlineMiddleware)
 app.include_router(auth.router)
 app.include_router(account.router)
 app.include_router(media.router)
@@ -347,16 +518,27 @@ def _dependency_versions() -> dict[str, str | None]:
     return versions
 
 
-def _storage_readiness() -> dict[str, str]:
-    clients = None
+def _storage() -> ClientStorage | None:
+    return getattr(app.state, "clients", None)
+
+
+async def _storage_readiness() -> dict[str, str]:
+    clients = _storage()
+    if clients is None:
+        return {"status": "error", "detail": "storage is not initialized"}
     try:
-        clients = ClientStorage()
+        await clients.ping()
         return {"status": "ok"}
     except Exception as exc:
         return {"status": "error", "detail": str(exc)}
-    finally:
-        if clients is not None:
-            clients.close()
+
+
+def _warmup_readiness() -> dict[str, Any]:
+    warmup = getattr(app.state, "warmup", None)
+    if warmup is not None and not warmup.done():
+        return {"status": "error", "detail": "warming up sessions"}
+    clients = _storage()
+    return {"status": "ok", **(clients.warmup_stats if clients is not None else {})}
 
 
 def _dependency_readiness() -> dict[str, Any]:
@@ -426,6 +608,198 @@ def _metrics_text() -> str:
         installed = "1" if version else "0"
         labels = f'name="{_metric_label_value(name)}",version="{_metric_label_value(version)}"'
         lines.append(f"aiograpi_rest_dependency_info{{{labels}}} {installed}")
+    fetcher = getattr(app.state, "fetcher", None)
+    if fetcher is not None:
+        fetches = fetcher.stats()
+        lines.extend([
+            "# HELP aiograpi_rest_upload_fetches_total Remote files downloaded for upload-by-URL routes.",
+            "# TYPE aiograpi_rest_upload_fetches_total counter",
+            f"aiograpi_rest_upload_fetches_total {fetches['fetches']}",
+            "# HELP aiograpi_rest_upload_fetched_bytes_total Bytes streamed from remote upload URLs.",
+            "# TYPE aiograpi_rest_upload_fetched_bytes_total counter",
+            f"aiograpi_rest_upload_fetched_bytes_total {fetches['fetched_bytes']}",
+            "# HELP aiograpi_rest_upload_fetch_rejected_total Remote files refused for exceeding the size limit.",
+            "# TYPE aiograpi_rest_upload_fetch_rejected_total counter",
+            f"aiograpi_rest_upload_fetch_rejected_total {fetches['rejected']}",
+            "# HELP aiograpi_rest_upload_fetch_errors_total Remote file downloads that failed or timed out.",
+            "# TYPE aiograpi_rest_upload_fetch_errors_total counter",
+            f"aiograpi_rest_upload_fetch_errors_total {fetches['errors']}",
+        ])
+    deadlines = getattr(app.state, "deadlines", None)
+    if deadlines is not None:
+        lines.extend([
+            "# HELP aiograpi_rest_deadline_exceeded_total Requests cancelled with 504 after their time budget ran out.",
+            "# TYPE aiograpi_rest_deadline_exceeded_total counter",
+        ])
+        for route, count in deadlines.exceeded.items():
+            lines.append(f'aiograpi_rest_deadline_exceeded_total{{route_class="{route}"}} {count}')
+    responses = getattr(app.state, "responses", None)
+    if responses is not None:
+        cached = responses.stats()
+        missing = responses.not_found.stats()
+        lines.extend([
+            "# HELP aiograpi_rest_response_cache_hits_total Lookups answered from the response cache.",
+            "# TYPE aiograpi_rest_response_cache_hits_total counter",
+            f"aiograpi_rest_response_cache_hits_total {cached['hits']}",
+            "# HELP aiograpi_rest_response_cache_misses_total Cacheable lookups sent upstream.",
+            "# TYPE aiograpi_rest_response_cache_misses_total counter",
+            f"aiograpi_rest_response_cache_misses_total {cached['misses']}",
+            "# HELP aiograpi_rest_response_cache_hit_ratio Share of cacheable lookups answered from the cache.",
+            "# TYPE aiograpi_rest_response_cache_hit_ratio gauge",
+            f"aiograpi_rest_response_cache_hit_ratio {cached['hit_ratio']:.4f}",
+            "# HELP aiograpi_rest_response_cache_bytes Approximate size of the cached responses.",
+            "# TYPE aiograpi_rest_response_cache_bytes gauge",
+            f"aiograpi_rest_response_cache_bytes {cached['bytes']}",
+            "# HELP aiograpi_rest_response_cache_entries Responses held in the cache.",
+            "# TYPE aiograpi_rest_response_cache_entries gauge",
+            f"aiograpi_rest_response_cache_entries {cached['entries']}",
+            "# HELP aiograpi_rest_response_cache_evictions_total Cached responses evicted by the memory cap.",
+            "# TYPE aiograpi_rest_response_cache_evictions_total counter",
+            f"aiograpi_rest_response_cache_evictions_total {cached['evictions']}",
+            "# HELP aiograpi_rest_not_found_cache_hits_total Lookups answered 404 from the not-found cache.",
+            "# TYPE aiograpi_rest_not_found_cache_hits_total counter",
+            f"aiograpi_rest_not_found_cache_hits_total {missing['hits']}",
+            "# HELP aiograpi_rest_not_found_cache_entries Not-found answers held in the cache.",
+            "# TYPE aiograpi_rest_not_found_cache_entries gauge",
+            f"aiograpi_rest_not_found_cache_entries {missing['entries']}",
+            "# HELP aiograpi_rest_response_cache_stale_hits_total Expired responses served while being refreshed.",
+            "# TYPE aiograpi_rest_response_cache_stale_hits_total counter",
+            f"aiograpi_rest_response_cache_stale_hits_total {cached['stale_hits']}",
+            "# HELP aiograpi_rest_response_cache_refreshing Background refreshes of cached responses in flight.",
+            "# TYPE aiograpi_rest_response_cache_refreshing gauge",
+            f"aiograpi_rest_response_cache_refreshing {cached['refreshing']}",
+            "# HELP aiograpi_rest_response_cache_refresh_errors_total Background refreshes that failed.",
+            "# TYPE aiograpi_rest_response_cache_refresh_errors_total counter",
+            f"aiograpi_rest_response_cache_refresh_errors_total {cached['refresh_errors']}",
+        ])
+    users = getattr(app.state, "users", None)
+    if users is not None:
+        indexed = users.stats()
+        lines.extend([
+            "# HELP aiograpi_rest_user_index_hits_total Username and user id lookups answered from the index.",
+            "# TYPE aiograpi_rest_user_index_hits_total counter",
+            f"aiograpi_rest_user_index_hits_total {indexed['hits']}",
+            "# HELP aiograpi_rest_user_index_misses_total Username and user id lookups sent upstream.",
+            "# TYPE aiograpi_rest_user_index_misses_total counter",
+            f"aiograpi_rest_user_index_misses_total {indexed['misses']}",
+            "# HELP aiograpi_rest_user_index_entries Mappings held in the in-memory hot tier.",
+            "# TYPE aiograpi_rest_user_index_entries gauge",
+            f"aiograpi_rest_user_index_entries {indexed['entries']}",
+            "# HELP aiograpi_rest_user_index_pending_writes Mappings waiting to be written to disk.",
+            "# TYPE aiograpi_rest_user_index_pending_writes gauge",
+            f"aiograpi_rest_user_index_pending_writes {indexed['pending']}",
+            "# HELP aiograpi_rest_user_index_write_errors_total Failed writes of the username index.",
+            "# TYPE aiograpi_rest_user_index_write_errors_total counter",
+            f"aiograpi_rest_user_index_write_errors_total {indexed['write_errors']}",
+        ])
+    clients = _storage()
+    if clients is None:
+        return "\n".join(lines) + "\n"
+    cache = clients.cache.stats()
+    storage = clients.stats()
+    health = clients.health.stats()
+    logins = clients.logins.stats()
+    upstream = clients.transports.stats()
+    limiter = clients.limiter.stats()
+    breakers = clients.breakers.stats()
+    lines.extend([
+        "# HELP aiograpi_rest_client_cache_size Hydrated clients held in the in-process cache.",
+        "# TYPE aiograpi_rest_client_cache_size gauge",
+        f"aiograpi_rest_client_cache_size {cache['size']}",
+        "# HELP aiograpi_rest_client_cache_hits_total Session lookups served by a cached client.",
+        "# TYPE aiograpi_rest_client_cache_hits_total counter",
+        f"aiograpi_rest_client_cache_hits_total {cache['hits']}",
+        "# HELP aiograpi_rest_client_cache_misses_total Session lookups that hydrated a new client.",
+        "# TYPE aiograpi_rest_client_cache_misses_total counter",
+        f"aiograpi_rest_client_cache_misses_total {cache['misses']}",
+        "# HELP aiograpi_rest_client_cache_evictions_total Cached clients evicted by size or idle TTL.",
+        "# TYPE aiograpi_rest_client_cache_evictions_total counter",
+        f"aiograpi_rest_client_cache_evictions_total {cache['evictions']}",
+        "# HELP aiograpi_rest_session_lookups_inflight Session hydrations or validations in progress.",
+        "# TYPE aiograpi_rest_session_lookups_inflight gauge",
+        f"aiograpi_rest_session_lookups_inflight {storage['inflight']}",
+        "# HELP aiograpi_rest_session_coalesced_waits_total Session lookups that joined an in-flight hydration.",
+        "# TYPE aiograpi_rest_session_coalesced_waits_total counter",
+        f"aiograpi_rest_session_coalesced_waits_total {storage['coalesced_waits']}",
+        "# HELP aiograpi_rest_session_dirty Sessions used since the last write-behind flush.",
+        "# TYPE aiograpi_rest_session_dirty gauge",
+        f"aiograpi_rest_session_dirty {storage['dirty']}",
+        "# HELP aiograpi_rest_session_flush_writes_total Session settings written by the write-behind flusher.",
+        "# TYPE aiograpi_rest_session_flush_writes_total counter",
+        f"aiograpi_rest_session_flush_writes_total {storage['flush_writes']}",
+        "# HELP aiograpi_rest_session_flush_errors_total Write-behind flushes that failed and will be retried.",
+        "# TYPE aiograpi_rest_session_flush_errors_total counter",
+        f"aiograpi_rest_session_flush_errors_total {storage['flush_errors']}",
+        "# HELP aiograpi_rest_session_flush_conflicts_total Write-backs skipped because another worker saved first.",
+        "# TYPE aiograpi_rest_session_flush_conflicts_total counter",
+        f"aiograpi_rest_session_flush_conflicts_total {storage['flush_conflicts']}",
+        "# HELP aiograpi_rest_session_invalidations_total Cached clients evicted after another worker changed them.",
+        "# TYPE aiograpi_rest_session_invalidations_total counter",
+        f"aiograpi_rest_session_invalidations_total {storage['invalidations']}",
+        "# HELP aiograpi_rest_session_health_probes_total Background session health probes sent upstream.",
+        "# TYPE aiograpi_rest_session_health_probes_total counter",
+        f"aiograpi_rest_session_health_probes_total {health['probes']}",
+        "# HELP aiograpi_rest_session_health_probe_errors_total Health probes that failed for reasons other "
+        "than the session.",
+        "# TYPE aiograpi_rest_session_health_probe_errors_total counter",
+        f"aiograpi_rest_session_health_probe_errors_total {health['probe_errors']}",
+        "# HELP aiograpi_rest_sessions_unhealthy Sessions known to be dead, by status.",
+        "# TYPE aiograpi_rest_sessions_unhealthy gauge",
+        f'aiograpi_rest_sessions_unhealthy{{status="expired"}} {health["expired"]}',
+        f'aiograpi_rest_sessions_unhealthy{{status="challenged"}} {health["challenged"]}',
+        "# HELP aiograpi_rest_login_coalesced_total Logins that waited for an identical login in flight.",
+        "# TYPE aiograpi_rest_login_coalesced_total counter",
+        f"aiograpi_rest_login_coalesced_total {logins['coalesced']}",
+        "# HELP aiograpi_rest_login_reused_total Logins answered with a session established moments before.",
+        "# TYPE aiograpi_rest_login_reused_total counter",
+        f"aiograpi_rest_login_reused_total {logins['reused']}",
+        "# HELP aiograpi_rest_session_gc_reclaimed_total Stored sessions deleted as idle or dead.",
+        "# TYPE aiograpi_rest_session_gc_reclaimed_total counter",
+        f"aiograpi_rest_session_gc_reclaimed_total {storage['gc_reclaimed']}",
+        "# HELP aiograpi_rest_upstream_pools Shared upstream connection pools, one per proxy.",
+        "# TYPE aiograpi_rest_upstream_pools gauge",
+        f"aiograpi_rest_upstream_pools {upstream['pools']}",
+        "# HELP aiograpi_rest_upstream_connections Open upstream connections in the shared pools, by state.",
+        "# TYPE aiograpi_rest_upstream_connections gauge",
+        f'aiograpi_rest_upstream_connections{{state="active"}} {upstream["connections"] - upstream["idle"]}',
+        f'aiograpi_rest_upstream_connections{{state="idle"}} {upstream["idle"]}',
+        "# HELP aiograpi_rest_upstream_connections_max Connection limit summed over the shared pools.",
+        "# TYPE aiograpi_rest_upstream_connections_max gauge",
+        f"aiograpi_rest_upstream_connections_max {upstream['max_connections']}",
+        "# HELP aiograpi_rest_upstream_requests_total Instagram requests sent through the shared pools.",
+        "# TYPE aiograpi_rest_upstream_requests_total counter",
+        f"aiograpi_rest_upstream_requests_total {upstream['requests']}",
+        "# HELP aiograpi_rest_upstream_connections_opened_total New upstream connections opened.",
+        "# TYPE aiograpi_rest_upstream_connections_opened_total counter",
+        f"aiograpi_rest_upstream_connections_opened_total {upstream['connections_opened']}",
+        "# HELP aiograpi_rest_upstream_connection_reuse_ratio Share of upstream requests sent on an existing "
+        "connection.",
+        "# TYPE aiograpi_rest_upstream_connection_reuse_ratio gauge",
+        f"aiograpi_rest_upstream_connection_reuse_ratio {upstream['reuse_ratio']:.4f}",
+    ])
+    lines.extend([
+        "# HELP aiograpi_rest_circuits_open Circuit breakers currently open, by scope.",
+        "# TYPE aiograpi_rest_circuits_open gauge",
+        f'aiograpi_rest_circuits_open{{scope="session"}} {breakers["open_sessions"]}',
+        f'aiograpi_rest_circuits_open{{scope="proxy"}} {breakers["open_proxies"]}',
+        "# HELP aiograpi_rest_circuits_opened_total Times a circuit breaker opened after upstream failures.",
+        "# TYPE aiograpi_rest_circuits_opened_total counter",
+        f"aiograpi_rest_circuits_opened_total {breakers['opened']}",
+        "# HELP aiograpi_rest_circuit_rejected_total Upstream calls refused while their circuit was open.",
+        "# TYPE aiograpi_rest_circuit_rejected_total counter",
+        f"aiograpi_rest_circuit_rejected_total {breakers['rejected']}",
+    ])
+    for name, metric, kind, help_text in (
+        ("waiting", "aiograpi_rest_rate_limit_queue_depth", "gauge",
+         "Upstream requests queued by the rate limiter right now, by action class."),
+        ("queued", "aiograpi_rest_rate_limit_queued_total", "counter",
+         "Upstream requests delayed by the rate limiter, by action class."),
+        ("rejected", "aiograpi_rest_rate_limit_rejected_total", "counter",
+         "Requests answered with 429 by the rate limiter, by action class."),
+    ):
+        lines.extend([f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"])
+        for action, count in limiter[name].items():
+            lines.append(f'{metric}{{action="{action}"}} {count}')
     return "\n".join(lines) + "\n"
 
 
@@ -441,7 +815,8 @@ async def ready():
     """Check readiness
     """
     checks = {
-        "storage": _storage_readiness(),
+        "storage": await _storage_readiness(),
+        "warmup": _warmup_readiness(),
         "dependencies": _dependency_readiness(),
     }
     status = "ok" if all(check["status"] == "ok" for check in checks.values()) else "error"
@@ -455,6 +830,44 @@ async def metrics():
     return Response(_metrics_text(), media_type="text/plain; version=0.0.4")
 
 
+def _maintenance_denied(request: Request) -> JSONResponse | None:
+    """Refuse maintenance calls unless AIOGRAPI_REST_ADMIN_TOKEN is set and presented
+    """
+    token = os.getenv("AIOGRAPI_REST_ADMIN_TOKEN", "")
+    if not token:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    presented = request.headers.get(ADMIN_TOKEN_HEADER, "")
+    if not hmac.compare_digest(presented.encode(), token.encode()):
+        return JSONResponse({"detail": "Admin token required"}, status_code=403)
+    return None
+
+
+@app.post("/maintenance/compact", tags=["System"], summary="Compact session storage")
+async def maintenance_compact(request: Request):
+    """Compact session storage
+    """
+    denied = _maintenance_denied(request)
+    if denied is not None:
+        return denied
+    clients = _storage()
+    if clients is None:
+        return JSONResponse({"detail": "storage is not initialized"}, status_code=503)
+    return await clients.compact()
+
+
+@app.post("/maintenance/gc", tags=["System"], summary="Collect idle and dead sessions")
+async def maintenance_gc(request: Request):
+    """Collect idle and dead sessions
+    """
+    denied = _maintenance_denied(request)
+    if denied is not None:
+        return denied
+    clients = _storage()
+    if clients is None:
+        return JSONResponse({"detail": "storage is not initialized"}, status_code=503)
+    return await clients.collect_garbage()
+
+
 @app.get("/build", tags=["System"], summary="Get build metadata")
 async def build():
     """Get build metadata
@@ -476,6 +889,33 @@ async def version():
     return _dependency_versions()
 
 
+@app.exception_handler(RateLimited)
+async def handle_rate_limited(request, exc: RateLimited):
+    return JSONResponse({
+        "detail": str(exc),
+        "exc_type": "RateLimited",
+        "action": exc.action,
+    }, status_code=429, headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
+
+@app.exception_handler(CircuitOpen)
+async def handle_circuit_open(request, exc: CircuitOpen):
+    return JSONResponse({
+        "detail": str(exc),
+        "exc_type": "CircuitOpen",
+        "scope": exc.scope,
+    }, status_code=503, headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
+
+@app.exception_handler(NotFound)
+async def handle_not_found(request, exc: NotFound):
+    return JSONResponse({
+        "detail": str(exc),
+        "exc_type": exc.exc_type,
+        "cached": exc.cached,
+    }, status_code=404)
+
+
 @app.exception_handler(Exception)
 async def handle_exception(request, exc: Exception):
     return JSONResponse({
@@ -5,13 +5,14 @@ from typing import List, Optional
 from aiograpi.types import Location, Media, Usertag
 from fastapi import APIRouter, Depends, File, Form, Query, UploadFile
 
-from dependencies import ClientStorage, get_clients, get_sessionid
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_sessionid
 from helpers import album_upload_post
 
 router = APIRouter(
     prefix="/album",
     tags=["Album (Carousel)"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
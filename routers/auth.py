@@ -23,32 +23,37 @@ async def auth_login(username: str = Form(...),
                      clients: ClientStorage = Depends(get_clients)) -> Union[str, bool]:
     """Login by username and password with 2FA
     """
-    cl = clients.client()
-    if proxy != "":
-        cl.set_proxy(proxy)
-
-    if locale != "":
-        cl.set_locale(locale)
-
-    if timezone != "":
-        cl.set_timezone_offset(timezone)
-
-    # Handle 2FA if verification code is provided
-    if verification_code:
-        # Try login with 2FA code directly
-        try:
-            result = await cl.login(username, password, verification_code=verification_code)
-        except TypeError:
-            # Fallback to mocking input if the direct parameter doesn't work
-            with patch('builtins.input', return_value=verification_code):
-                result = await cl.login(username, password)
-    else:
-        # Regular login without 2FA
-        result = await cl.login(username, password)
-
-    if result:
-        clients.set(cl)
-        return cl.sessionid
+    # Retries and double submits share one upstream login per account and proxy
+    async with clients.logins.coalesce(clients.logins.key(username, password, proxy)) as flight:
+        if flight.done:
+            return flight.result
+        cl = clients.client()
+        if proxy != "":
+            cl.set_proxy(proxy)
+
+        if locale != "":
+            cl.set_locale(locale)
+
+        if timezone != "":
+            cl.set_timezone_offset(timezone)
+
+        # Handle 2FA if verification code is provided
+        if verification_code:
+            # Try login with 2FA code directly
+            try:
+                result = await cl.login(username, password, verification_code=verification_code)
+            except TypeError:
+                # Fallback to mocking input if the direct parameter doesn't work
+                with patch('builtins.input', return_value=verification_code):
+                    result = await cl.login(username, password)
+        else:
+            # Regular login without 2FA
+            result = await cl.login(username, password)
+
+        if result:
+            await clients.set(cl)
+            result = cl.sessionid
+        flight.result = result
     return result
 
 
@@ -60,7 +65,7 @@ async def auth_login_by_sessionid(sessionid: str = Form(...),
     cl = clients.client()
     result = await cl.login_by_sessionid(sessionid)
     if result:
-        clients.set(cl)
+        await clients.set(cl)
         return cl.sessionid
     return result
 
@@ -70,8 +75,11 @@ async def auth_relogin(sessionid: str = Depends(get_sessionid),
                        clients: ClientStorage = Depends(get_clients)) -> bool:
     """Relogin by username and password (with clean cookies)
     """
-    cl = await clients.get(sessionid)
-    return await cl.relogin()
+    cl = await clients.get(sessionid, fail_fast=False)
+    result = await cl.relogin()
+    if result:
+        await clients.set(cl)
+    return result
 
 
 @router.get("/settings")
@@ -95,10 +103,18 @@ async def settings_set(settings: str = Form(...),
         cl = clients.client()
     cl.set_settings(json.loads(settings))
     await cl.expose()
-    clients.set(cl)
+    await clients.set(cl)
     return cl.sessionid
 
 
+@router.get("/session")
+async def session_state(sessionid: str = Depends(get_sessionid),
+                        clients: ClientStorage = Depends(get_clients)) -> Dict:
+    """Get session validation state
+    """
+    return await clients.session_state(sessionid)
+
+
 @router.get("/timeline/feed")
 async def timeline_feed(sessionid: str = Depends(get_sessionid),
                         clients: ClientStorage = Depends(get_clients)) -> Dict:
@@ -137,5 +153,8 @@ async def challenge_resolve(last_json: str = Form(...),
         payload = json.loads(last_json)
     except json.JSONDecodeError:
         raise HTTPException(status_code=422, detail="last_json must be valid JSON")
-    cl = await clients.get(sessionid)
-    return await cl.challenge_resolve(payload)
+    cl = await clients.get(sessionid, fail_fast=False)
+    result = await cl.challenge_resolve(payload)
+    if result:
+        await clients.set(cl)
+    return result
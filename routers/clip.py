@@ -2,18 +2,18 @@ import json
 from pathlib import Path
 from typing import List, Optional
 
-import requests
 from aiograpi.types import Location, Media, Usertag
 from fastapi import APIRouter, Depends, File, Form, Query, UploadFile
 from fastapi.responses import FileResponse
 
-from dependencies import ClientStorage, get_clients, get_sessionid
-from helpers import clip_upload_post
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_fetcher, get_sessionid
+from helpers import UrlFetcher, clip_upload_post
 
 router = APIRouter(
     prefix="/clip",
     tags=["Clip (Reels)"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -88,7 +88,8 @@ async def clip_upload(sessionid: str = Depends(get_sessionid),
                        thumbnail: Optional[UploadFile] = File(None),
                        usertags: Optional[List[str]] = Form([]),
                        location: Optional[Location] = Form(None),
-                       clients: ClientStorage = Depends(get_clients)
+                       clients: ClientStorage = Depends(get_clients),
+                       fetcher: UrlFetcher = Depends(get_fetcher)
                        ) -> Media:
     """Upload photo by URL and configure to feed
     """
@@ -98,15 +99,15 @@ async def clip_upload(sessionid: str = Depends(get_sessionid),
         usertag_json = json.loads(usertag)
         usernames_tags.append(Usertag(user=usertag_json['user'], x=usertag_json['x'], y=usertag_json['y']))
 
-    content = requests.get(url).content
-    if thumbnail is not None:
-        thumb = await thumbnail.read()
+    async with fetcher.fetch(url, suffix='.mp4') as content:
+        if thumbnail is not None:
+            thumb = await thumbnail.read()
+            return await clip_upload_post(
+                cl, content, caption=caption,
+                thumbnail=thumb,
+                usertags=usernames_tags,
+                location=location)
         return await clip_upload_post(
-            cl, content, caption=caption,
-            thumbnail=thumb,
-            usertags=usernames_tags,
-            location=location)
-    return await clip_upload_post(
             cl, content, caption=caption,
             usertags=usernames_tags,
             location=location)
@@ -3,12 +3,13 @@ from typing import List, Optional
 from aiograpi.types import DirectMessage, DirectThread
 from fastapi import APIRouter, Depends, Form, HTTPException, Query
 
-from dependencies import ClientStorage, get_clients, get_sessionid
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_sessionid
 
 router = APIRouter(
     prefix="/direct",
     tags=["Direct"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
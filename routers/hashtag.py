@@ -3,12 +3,14 @@ from typing import List
 from aiograpi.types import Hashtag, Media
 from fastapi import APIRouter, Depends, Form, Query
 
-from dependencies import ClientStorage, get_clients, get_sessionid
+from caches import ResponseCache
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_responses, get_sessionid
 
 router = APIRouter(
     prefix="/hashtag",
     tags=["Hashtag"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -17,11 +19,12 @@ async def hashtag_info(
     sessionid: str = Depends(get_sessionid),
     name: str = Query(...),
     clients: ClientStorage = Depends(get_clients),
+    responses: ResponseCache = Depends(get_responses),
 ) -> Hashtag:
     """Get hashtag info
     """
     cl = await clients.get(sessionid)
-    return await cl.hashtag_info(name)
+    return await responses.fetch("hashtag_info", {"name": name}, sessionid, lambda: cl.hashtag_info(name))
 
 
 @router.get("/medias/top", response_model=List[Media])
@@ -4,12 +4,14 @@ from typing import List, Optional
 from aiograpi.types import Highlight
 from fastapi import APIRouter, Depends, Form, HTTPException, Query
 
-from dependencies import ClientStorage, get_clients, get_sessionid
+from caches import ResponseCache
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_responses, get_sessionid
 
 router = APIRouter(
     prefix="/highlight",
     tags=["Highlight"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -18,11 +20,13 @@ async def highlight_info(
     sessionid: str = Depends(get_sessionid),
     highlight_pk: str = Query(...),
     clients: ClientStorage = Depends(get_clients),
+    responses: ResponseCache = Depends(get_responses),
 ) -> Highlight:
     """Get highlight info
     """
     cl = await clients.get(sessionid)
-    return await cl.highlight_info(highlight_pk)
+    return await responses.fetch(
+        "highlight_info", {"highlight_pk": highlight_pk}, sessionid, lambda: cl.highlight_info(highlight_pk))
 
 
 @router.post("", response_model=Highlight)
@@ -2,18 +2,18 @@ import json
 from pathlib import Path
 from typing import List, Optional
 
-import requests
 from aiograpi.types import Location, Media, Usertag
 from fastapi import APIRouter, Depends, File, Form, Query, UploadFile
 from fastapi.responses import FileResponse
 
-from dependencies import ClientStorage, get_clients, get_sessionid
-from helpers import igtv_upload_post
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_fetcher, get_sessionid
+from helpers import UrlFetcher, igtv_upload_post
 
 router = APIRouter(
     prefix="/igtv",
     tags=["IGTV (Legacy)"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -92,7 +92,8 @@ async def igtv_upload(sessionid: str = Depends(get_sessionid),
                        thumbnail: Optional[UploadFile] = File(None),
                        usertags: Optional[List[str]] = Form([]),
                        location: Optional[Location] = Form(None),
-                       clients: ClientStorage = Depends(get_clients)
+                       clients: ClientStorage = Depends(get_clients),
+                       fetcher: UrlFetcher = Depends(get_fetcher)
                        ) -> Media:
     """Upload photo by URL and configure to feed
     """
@@ -103,17 +104,17 @@ async def igtv_upload(sessionid: str = Depends(get_sessionid),
         usertag_json = json.loads(usertag)
         usernames_tags.append(Usertag(user=usertag_json['user'], x=usertag_json['x'], y=usertag_json['y']))
 
-    content = requests.get(url).content
-    if thumbnail is not None:
-        thumb = await thumbnail.read()
+    async with fetcher.fetch(url, suffix='.mp4') as content:
+        if thumbnail is not None:
+            thumb = await thumbnail.read()
+            return await igtv_upload_post(
+                cl, content, title=title,
+                caption=caption,
+                thumbnail=thumb,
+                usertags=usernames_tags,
+                location=location)
         return await igtv_upload_post(
             cl, content, title=title,
             caption=caption,
-            thumbnail=thumb,
             usertags=usernames_tags,
             location=location)
-    return await igtv_upload_post(
-        cl, content, title=title,
-        caption=caption,
-        usertags=usernames_tags,
-        location=location)
@@ -3,12 +3,14 @@ from typing import List, Optional
 from aiograpi.types import Location, Media
 from fastapi import APIRouter, Depends, HTTPException, Query
 
-from dependencies import ClientStorage, get_clients, get_sessionid
+from caches import ResponseCache
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_responses, get_sessionid
 
 router = APIRouter(
     prefix="/location",
     tags=["Location"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -35,11 +37,13 @@ async def location_info(
     sessionid: str = Depends(get_sessionid),
     location_pk: int = Query(...),
     clients: ClientStorage = Depends(get_clients),
+    responses: ResponseCache = Depends(get_responses),
 ) -> Location:
     """Get location info
     """
     cl = await clients.get(sessionid)
-    return await cl.location_info(location_pk)
+    return await responses.fetch(
+        "location_info", {"location_pk": location_pk}, sessionid, lambda: cl.location_info(location_pk))
 
 
 @router.get("/medias/top", response_model=List[Media])
@@ -1,15 +1,32 @@
+import os
 from typing import Dict, List, Optional
 
 from aiograpi import Client
 from aiograpi.types import Comment, Location, Media, UserShort, Usertag
-from fastapi import APIRouter, Depends, Form, Query
+from fastapi import APIRouter, Depends, Form, HTTPException, Query
+from pydantic import BaseModel
+
+from caches import ResponseCache
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_responses, get_sessionid
+from helpers import convert_media_ids, media_id_to_pk, shortcode_to_pk
+
+# Values accepted by one POST /media/pk/batch request
+MEDIA_BATCH_MAX_ITEMS = int(os.getenv("AIOGRAPI_REST_MEDIA_BATCH_MAX_ITEMS", "10000"))
+
+
+class MediaPkBatch(BaseModel):
+    """Values to convert in one POST /media/pk/batch request
+    """
+    codes: List[str] = []
+    media_ids: List[str] = []
+    pks: List[str] = []
 
-from dependencies import ClientStorage, get_clients, get_sessionid
 
 router = APIRouter(
     prefix="/media",
     tags=["Media"],
-    responses={404: {"description": "Not found"}}
+    responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -24,14 +41,29 @@ async def media_id(media_pk: int) -> str:
 async def media_pk(media_id: str) -> str:
     """Get short media id
     """
-    return str(Client().media_pk(media_id))
+    try:
+        return media_id_to_pk(media_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
 
 
 @router.get("/pk/from/code")
 async def media_pk_from_code(code: str) -> str:
     """Get media pk from code
     """
-    return str(Client().media_pk_from_code(code))
+    try:
+        return shortcode_to_pk(code)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+
+@router.post("/pk/batch", response_model=Dict[str, List[Optional[str]]])
+async def media_pk_batch(batch: MediaPkBatch) -> Dict[str, List[Optional[str]]]:
+    """Convert shortcodes and media ids to pks, and pks to shortcodes, in bulk
+    """
+    if len(batch.codes) + len(batch.media_ids) + len(batch.pks) > MEDIA_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MEDIA_BATCH_MAX_ITEMS} values per batch")
+    return convert_media_ids(batch.codes, batch.media_ids, batch.pks)
 
 
 @router.get("/pk/from/url")
@@ -45,11 +77,13 @@ async def media_pk_from_url(url: str) -> str:
 async def media_info(sessionid: str = Depends(get_sessionid),
                      pk: int = Query(...),
                      use_cache: Optional[bool] = Query(True),
-                     clients: ClientStorage = Depends(get_clients)) -> Media:
+                     clients: ClientStorage = Depends(get_clients),
+                     responses: ResponseCache = Depends(get_responses)) -> Media:
     """Get media info by pk
     """
     cl = await clients.get(sessionid)
-    return await cl.media_info(pk, use_cache)
+    return await responses.fetch(
+        "media_info", {"pk": pk}, sessionid, lambda: cl.media_info(pk, use_cache), refresh=not use_cache)
 
 
 @router.get("/user/medias", response_model=List[Media])
@@ -3,11 +3,12 @@ from typing import List
 from aiograpi.types import Note
 from fastapi import APIRouter, Depends, Form, Query
 
-from dependencies import ClientStorage, get_clients, get_sessionid
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_sessionid
 
 router = APIRouter(
     tags=["Note"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
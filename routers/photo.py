@@ -2,7 +2,6 @@ import json
 from pathlib import Path
 from typing import List, Optional
 
-import requests
 from aiograpi.types import (
     Location,
     Media,
@@ -12,13 +11,14 @@ from fastapi import APIRouter, Depends, File, Form, Query, UploadFile
 from fastapi.responses import FileResponse
 from pydantic import AnyHttpUrl
 
-from dependencies import ClientStorage, get_clients, get_sessionid
-from helpers import photo_upload_post
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_fetcher, get_sessionid
+from helpers import UrlFetcher, photo_upload_post
 
 router = APIRouter(
     prefix="/photo",
     tags=["Photo"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -87,7 +87,8 @@ async def photo_upload(sessionid: str = Depends(get_sessionid),
                        upload_id: Optional[str] = Form(""),
                        usertags: Optional[List[str]] = Form([]),
                        location: Optional[Location] = Form(None),
-                       clients: ClientStorage = Depends(get_clients)
+                       clients: ClientStorage = Depends(get_clients),
+                       fetcher: UrlFetcher = Depends(get_fetcher)
                        ) -> Media:
     """Upload photo and configure to feed
     """
@@ -98,9 +99,9 @@ async def photo_upload(sessionid: str = Depends(get_sessionid),
         usertag_json = json.loads(usertag)
         usernames_tags.append(Usertag(user=usertag_json['user'], x=usertag_json['x'], y=usertag_json['y']))
 
-    content = requests.get(url).content
-    return await photo_upload_post(
-        cl, content, caption=caption,
-        upload_id=upload_id,
-        usertags=usernames_tags,
-        location=location)
+    async with fetcher.fetch(url, suffix='.jpg') as content:
+        return await photo_upload_post(
+            cl, content, caption=caption,
+            upload_id=upload_id,
+            usertags=usernames_tags,
+            location=location)
@@ -1,7 +1,6 @@
 from pathlib import Path
 from typing import List, Optional
 
-import requests
 from aiograpi import Client
 from aiograpi.types import (
     Story,
@@ -17,13 +16,14 @@ from fastapi import APIRouter, Depends, File, Form, Query, UploadFile
 from fastapi.responses import FileResponse
 from pydantic import AnyHttpUrl
 
-from dependencies import ClientStorage, get_clients, get_sessionid
-from helpers import photo_upload_story_as_photo, photo_upload_story_as_video, video_upload_story
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_fetcher, get_sessionid
+from helpers import UrlFetcher, photo_upload_story_as_photo, photo_upload_story_as_video, video_upload_story
 
 router = APIRouter(
     prefix="/story",
     tags=["Story"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -77,21 +77,23 @@ async def story_upload_by_url(sessionid: str = Depends(get_sessionid),
                               links: Optional[List[StoryLink]] = Form([]),
                               hashtags: Optional[List[StoryHashtag]] = Form([]),
                               stickers: Optional[List[StorySticker]] = Form([]),
-                              clients: ClientStorage = Depends(get_clients)) -> Story:
+                              clients: ClientStorage = Depends(get_clients),
+                              fetcher: UrlFetcher = Depends(get_fetcher)) -> Story:
     """Upload photo or video to story by URL
     """
     cl = await clients.get(sessionid)
-    content = requests.get(url).content
-    return await _upload_story_content(
-        cl, content,
-        is_video=_url_points_to_video(url),
-        as_video=as_video,
-        caption=caption,
-        mentions=mentions,
-        links=links,
-        hashtags=hashtags,
-        locations=locations,
-        stickers=stickers)
+    is_video = _url_points_to_video(url)
+    async with fetcher.fetch(url, suffix='.mp4' if is_video else '.jpg') as content:
+        return await _upload_story_content(
+            cl, content,
+            is_video=is_video,
+            as_video=as_video,
+            caption=caption,
+            mentions=mentions,
+            links=links,
+            hashtags=hashtags,
+            locations=locations,
+            stickers=stickers)
 
 
 @router.get("/user/stories", response_model=List[Story])
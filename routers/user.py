@@ -6,12 +6,14 @@ from aiograpi.types import About, Highlight, Relationship, User, UserShort
 from fastapi import APIRouter, Depends, Form, Query
 from pydantic import ValidationError
 
-from dependencies import ClientStorage, get_clients, get_sessionid
+from caches import ResponseCache, UserIndex
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_responses, get_sessionid, get_user_index
 
 router = APIRouter(
     prefix="/user",
     tags=["User"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -80,22 +82,27 @@ async def user_following(sessionid: str = Depends(get_sessionid),
 async def user_info(sessionid: str = Depends(get_sessionid),
                     user_id: str = Query(...),
                     use_cache: Optional[bool] = Query(True),
-                    clients: ClientStorage = Depends(get_clients)) -> User:
+                    clients: ClientStorage = Depends(get_clients),
+                    responses: ResponseCache = Depends(get_responses)) -> User:
     """Get user object from user id
     """
     cl = await clients.get(sessionid)
-    return await cl.user_info(user_id)
+    return await responses.fetch(
+        "user_info", {"user_id": user_id}, sessionid, lambda: cl.user_info(user_id), refresh=not use_cache)
 
 
 @router.get("/info/by/username", response_model=User)
 async def user_info_by_username(sessionid: str = Depends(get_sessionid),
                                 username: str = Query(...),
                                 use_cache: Optional[bool] = Query(True),
-                                clients: ClientStorage = Depends(get_clients)) -> User:
+                                clients: ClientStorage = Depends(get_clients),
+                                responses: ResponseCache = Depends(get_responses)) -> User:
     """Get user object from username
     """
     cl = await clients.get(sessionid)
-    return await cl.user_info_by_username(username)
+    return await responses.fetch(
+        "user_info_by_username", {"username": username}, sessionid,
+        lambda: cl.user_info_by_username(username), refresh=not use_cache)
 
 
 @router.get("/about", response_model=About)
@@ -138,21 +145,48 @@ async def user_unfollow(sessionid: str = Depends(get_sessionid),
 @router.get("/id/from/username", response_model=int)
 async def user_id_from_username(sessionid: str = Depends(get_sessionid),
                                 username: str = Query(...),
-                                clients: ClientStorage = Depends(get_clients)) -> int:
+                                use_cache: Optional[bool] = Query(True),
+                                max_age: Optional[float] = Query(None),
+                                clients: ClientStorage = Depends(get_clients),
+                                responses: ResponseCache = Depends(get_responses),
+                                users: UserIndex = Depends(get_user_index)) -> int:
     """Get user id from username
+
+    Answered from the username index when the mapping is known and younger
+    than `max_age` seconds.
     """
     cl = await clients.get(sessionid)
-    return await cl.user_id_from_username(username)
+    if use_cache:
+        user_id = await users.user_id(username, max_age)
+        if user_id is not None:
+            return int(user_id)
+    user_id = await responses.fetch(
+        "user_id_from_username", {"username": username}, sessionid,
+        lambda: cl.user_id_from_username(username), refresh=not use_cache)
+    users.record(user_id, username)
+    return user_id
 
 
 @router.get("/username/from/id", response_model=str)
 async def username_from_user_id(sessionid: str = Depends(get_sessionid),
                                 user_id: int = Query(...),
-                                clients: ClientStorage = Depends(get_clients)) -> str:
+                                use_cache: Optional[bool] = Query(True),
+                                max_age: Optional[float] = Query(None),
+                                clients: ClientStorage = Depends(get_clients),
+                                users: UserIndex = Depends(get_user_index)) -> str:
     """Get username from user id
+
+    Answered from the username index when the mapping is known and younger
+    than `max_age` seconds.
     """
     cl = await clients.get(sessionid)
-    return await cl.username_from_user_id(user_id)
+    if use_cache:
+        username = await users.username(user_id, max_age)
+        if username is not None:
+            return username
+    username = await cl.username_from_user_id(user_id)
+    users.record(user_id, username)
+    return username
 
 
 @router.delete("/follower", response_model=bool)
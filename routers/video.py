@@ -2,7 +2,6 @@ import json
 from pathlib import Path
 from typing import List, Optional
 
-import requests
 from aiograpi.types import (
     Location,
     Media,
@@ -11,13 +10,14 @@ from aiograpi.types import (
 from fastapi import APIRouter, Depends, File, Form, Query, UploadFile
 from fastapi.responses import FileResponse
 
-from dependencies import ClientStorage, get_clients, get_sessionid
-from helpers import video_upload_post
+from dependencies import ClientStorage, IndexedRoute, get_clients, get_fetcher, get_sessionid
+from helpers import UrlFetcher, video_upload_post
 
 router = APIRouter(
     prefix="/video",
     tags=["Video"],
     responses={404: {"description": "Not found"}},
+    route_class=IndexedRoute,
 )
 
 
@@ -92,7 +92,8 @@ async def video_upload(sessionid: str = Depends(get_sessionid),
                        thumbnail: Optional[UploadFile] = File(None),
                        usertags: Optional[List[str]] = Form([]),
                        location: Optional[Location] = Form(None),
-                       clients: ClientStorage = Depends(get_clients)
+                       clients: ClientStorage = Depends(get_clients),
+                       fetcher: UrlFetcher = Depends(get_fetcher)
                        ) -> Media:
     """Upload photo by URL and configure to feed
     """
@@ -103,15 +104,15 @@ async def video_upload(sessionid: str = Depends(get_sessionid),
         usertag_json = json.loads(usertag)
         usernames_tags.append(Usertag(user=usertag_json['user'], x=usertag_json['x'], y=usertag_json['y']))
 
-    content = requests.get(url).content
-    if thumbnail is not None:
-        thumb = await thumbnail.read()
+    async with fetcher.fetch(url, suffix='.mp4') as content:
+        if thumbnail is not None:
+            thumb = await thumbnail.read()
+            return await video_upload_post(
+                cl, content, caption=caption,
+                thumbnail=thumb,
+                usertags=usernames_tags,
+                location=location)
         return await video_upload_post(
             cl, content, caption=caption,
-            thumbnail=thumb,
             usertags=usernames_tags,
             location=location)
-    return await video_upload_post(
-        cl, content, caption=caption,
-        usertags=usernames_tags,
-        location=location)
@@ -0,0 +1,87 @@
+"""Compare decode cost and size of stored client settings formats.
+
+Each format is measured as its backend stores it, from the stored bytes to
+the settings dict handed to the client:
+
+* tinydb-legacy   - a db.json row holding ``json.dumps(settings)`` as a string
+                    (older releases): the row is parsed, then the string again
+* tinydb          - a db.json row holding the settings object: one parse
+* text            - the SQLite column / Redis value ``encode_settings(settings)``
+* text-compressed - the same with ``encode_settings(settings, compress=True)``
+
+Usage: python scripts/bench_settings_codec.py [--number N]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import timeit
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from aiograpi import Client  # noqa: E402
+
+from storages import decode_settings, encode_settings  # noqa: E402
+
+
+def realistic_settings() -> dict:
+    """Settings of a logged-in client with the cookies Instagram usually sets
+    """
+    settings = Client().get_settings()
+    user_id = "1234567890"
+    sessionid = f"{user_id}%3A{uuid.uuid4().hex[:14]}%3A12%3AAYd{uuid.uuid4().hex}"
+    settings["authorization_data"] = {
+        "ds_user_id": user_id,
+        "sessionid": sessionid,
+        "should_use_header_over_cookies": True,
+    }
+    settings["cookies"] = {
+        "csrftoken": uuid.uuid4().hex,
+        "ds_user_id": user_id,
+        "ig_did": str(uuid.uuid4()).upper(),
+        "mid": "ZxZ1AAABAAGd" + uuid.uuid4().hex[:16],
+        "rur": f'"LDC\\054{user_id}\\0541760000000:01f7{uuid.uuid4().hex}{uuid.uuid4().hex[:8]}"',
+        "sessionid": sessionid,
+        "shbid": f'"1234\\054{user_id}\\0541760000000:01f7{uuid.uuid4().hex}"',
+        "shbts": f'"1729000000\\054{user_id}\\0541760000000:01f7{uuid.uuid4().hex}"',
+    }
+    settings["ig_u_rur"] = settings["cookies"]["rur"]
+    settings["ig_www_claim"] = "hmac.AR" + uuid.uuid4().hex * 2
+    settings["mid"] = settings["cookies"]["mid"]
+    return settings
+
+
+def bench(number: int) -> None:
+    settings = realistic_settings()
+    formats = {
+        "tinydb-legacy": (json.dumps({"sessionid": "sid", "settings": json.dumps(settings)}), read_tinydb_row),
+        "tinydb": (json.dumps({"sessionid": "sid", "settings": settings}), read_tinydb_row),
+        "text": (encode_settings(settings), decode_settings),
+        "text-compressed": (encode_settings(settings, compress=True), decode_settings),
+    }
+    baseline = None
+    for name, (stored, read) in formats.items():
+        assert read(stored) == settings
+        seconds = timeit.timeit(lambda: read(stored), number=number)
+        per_call = seconds / number * 1e6
+        baseline = baseline or per_call
+        print(f"{name:15} stored={len(stored):5d}B decode={per_call:7.2f}us ({per_call / baseline:.2f}x tinydb-legacy)")
+
+
+def read_tinydb_row(row: str) -> dict:
+    return decode_settings(json.loads(row)["settings"])
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args(argv)
+    bench(args.number)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,99 @@
+"""Measure event-loop lag while sessions are persisted concurrently.
+
+Compares calling the blocking backend methods directly on the loop (how
+storage worked before it moved to a worker thread) against awaiting
+``ClientStorage.set``.  A probe task sleeps in short steps and records how
+late it wakes up; a responsive loop keeps that overshoot near zero.
+
+Usage: python scripts/bench_storage_loop_lag.py [--sessions N] [--backend tinydb|sqlite]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from storages import ClientCache, ClientStorage  # noqa: E402
+
+PROBE_INTERVAL = 0.001
+
+
+class BenchClient:
+    def __init__(self, sessionid: str = ""):
+        self.sessionid = sessionid
+
+    def get_settings(self) -> dict:
+        return {
+            "authorization_data": {"sessionid": self.sessionid},
+            "cookies": {f"cookie{i}": "x" * 64 for i in range(20)},
+        }
+
+
+async def probe(stop: asyncio.Event, lags: list[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - started - PROBE_INTERVAL))
+
+
+async def run(storage: ClientStorage, sessions: int, blocking: bool) -> dict[str, float]:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    prober = asyncio.create_task(probe(stop, lags))
+    await asyncio.sleep(0)
+
+    async def write(i: int) -> None:
+        cl = BenchClient(f"sid{i}")
+        if blocking:
+            storage.backend._save(cl.sessionid, json.dumps(cl.get_settings()))
+        else:
+            await storage.set(cl)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(write(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await prober
+    lags = lags or [0.0]
+    return {
+        "elapsed_s": elapsed,
+        "max_lag_ms": max(lags) * 1000,
+        "p50_lag_ms": statistics.median(lags) * 1000,
+        "probes": len(lags),
+    }
+
+
+async def bench(sessions: int, backend: str) -> None:
+    suffix = ".sqlite3" if backend == "sqlite" else ".json"
+    for label, blocking in (("blocking on loop", True), ("executor (await)", False)):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = ClientStorage(
+                db_path=Path(tmp) / f"db{suffix}", client_factory=BenchClient, cache=ClientCache(max_size=0),
+            )
+            result = await run(storage, sessions, blocking)
+            await storage.close()
+        print(
+            f"{label:18} elapsed={result['elapsed_s']:.3f}s "
+            f"max_lag={result['max_lag_ms']:.1f}ms p50_lag={result['p50_lag_ms']:.2f}ms "
+            f"probes={result['probes']}"
+        )
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--backend", choices=("tinydb", "sqlite"), default="tinydb")
+    args = parser.parse_args(argv)
+    asyncio.run(bench(args.sessions, args.backend))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -1,43 +1,2024 @@
+import asyncio
+import base64
+import copy
+import hashlib
 import json
 import os
+import random
+import re
+import sqlite3
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+from typing import Any, Optional, Union
 from urllib import parse
 
-from aiograpi import Client
+import httpx
+from aiograpi import Client, httpx_ext
+from aiograpi.exceptions import (
+    ChallengeError,
+    ChallengeRequired,
+    CheckpointRequired,
+    ClientConnectionError,
+    ClientIncompleteReadError,
+    ClientLoginRequired,
+    ClientRequestTimeout,
+    ClientThrottledError,
+    ConsentRequired,
+    FeedbackRequired,
+    LoginRequired,
+    PleaseWaitFewMinutes,
+    ProxyAddressIsBlocked,
+    RateLimitError,
+    ReloginAttemptExceeded,
+    SentryBlock,
+)
 from tinydb import Query, TinyDB
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
+
+# aiograpi `last_json["message"]` values that mean the session must be re-checked
+SESSION_ERROR_MESSAGES = frozenset({"login_required", "challenge_required", "checkpoint_required"})
+
+# Session health as recorded by SessionHealthMonitor
+HEALTHY = "healthy"
+EXPIRED = "expired"
+CHALLENGED = "challenged"
+
+
+def normalize_sessionid(sessionid: str) -> str:
+    return parse.unquote(sessionid.strip(" \""))
+
+
+def settings_digest(settings: Union[str, dict]) -> bytes:
+    if not isinstance(settings, str):
+        settings = json.dumps(settings, separators=(",", ":"))
+    return hashlib.blake2b(settings.encode(), digest_size=16).digest()
+
+
+# Marks settings stored as zlib-compressed compact JSON in base64 text
+COMPRESSED_PREFIX = "z:"
+
+
+def encode_settings(settings: dict, compress: bool = False) -> str:
+    """Serialize client settings for storage
+
+    Settings are compact JSON; with `compress` the whole document (cookies,
+    device and uuid blobs included) is zlib-compressed and base64-encoded
+    so the result stays plain text that no store needs to escape.
+    """
+    raw = json.dumps(settings, separators=(",", ":"))
+    if not compress:
+        return raw
+    return COMPRESSED_PREFIX + base64.b64encode(zlib.compress(raw.encode())).decode()
+
+
+def decode_settings(stored: Union[str, dict]) -> dict:
+    """Parse settings written by encode_settings or by older releases (plain json.dumps)
+
+    Backends that store documents (TinyDB) hand settings back already parsed.
+    """
+    if not isinstance(stored, str):
+        return stored
+    if stored.startswith(COMPRESSED_PREFIX):
+        return json.loads(zlib.decompress(base64.b64decode(stored[len(COMPRESSED_PREFIX):])))
+    return json.loads(stored)
+
+
+@dataclass
+class CachedClient:
+    client: Any
+    used_at: float
+    validated_at: Optional[float] = None
+
+
+class ClientCache:
+    """In-process LRU cache of hydrated clients with idle TTL eviction
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 900.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, CachedClient]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a warm client and mark it as recently used
+        """
+        entry = self.entry(key)
+        return entry.client if entry else None
+
+    def entry(self, key: str) -> Optional[CachedClient]:
+        """Get a cache entry and mark it as recently used
+        """
+        entry = self._entries.get(key)
+        now = self.clock()
+        if entry is not None and self._expired(entry, now):
+            del self._entries[key]
+            self.evictions += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        entry.used_at = now
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def peek(self, key: str) -> Optional[CachedClient]:
+        """Get a cache entry without touching LRU order or counters
+        """
+        return self._entries.get(key)
+
+    def put(self, key: str, client: Any, validated_at: Optional[float] = None) -> Optional[CachedClient]:
+        """Store a client, evicting idle and least recently used entries
+        """
+        if self.max_size <= 0:
+            return None
+        entry = CachedClient(client=client, used_at=self.clock(), validated_at=validated_at)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self.evict()
+        return entry
+
+    def pop(self, key: str) -> Optional[Any]:
+        entry = self._entries.pop(key, None)
+        return entry.client if entry else None
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def evict(self) -> int:
+        """Drop expired entries and trim the cache down to max_size
+        """
+        evicted = 0
+        now = self.clock()
+        # Entries are kept in LRU order, so expired ones are always at the front
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if not self._expired(entry, now):
+                break
+            del self._entries[key]
+            evicted += 1
+        while len(self._entries) > max(self.max_size, 0):
+            self._entries.popitem(last=False)
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _expired(self, entry: CachedClient, now: float) -> bool:
+        return bool(self.ttl) and now - entry.used_at > self.ttl
+
+
+class BlockingBackend:
+    """Base for backends built on blocking file or database I/O
+
+    Subclasses implement the underscored methods; the public coroutines run
+    them on one dedicated thread, so the event loop never waits on the disk
+    and the underlying store is never touched concurrently.
+    """
+
+    # Whether settings are stored as parsed dicts rather than encoded text
+    native_settings = False
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aiograpi-rest-storage")
+
+    async def load(self, key: str) -> Optional[str]:
+        return await self._run(self._load, key)
+
+    async def load_many(self, keys: list[str]) -> dict[str, str]:
+        return await self._run(self._load_many, list(keys))
+
+    async def save(self, key: str, settings: str) -> None:
+        await self._run(self._save, key, settings)
+
+    async def save_if(self, key: str, settings: str, expected: Optional[bytes]) -> bool:
+        """Save only if the stored settings still have digest `expected` (None saves unconditionally)
+        """
+        return await self._run(self._save_if, key, settings, expected)
+
+    async def delete(self, key: str) -> bool:
+        return await self._run(self._delete, key)
+
+    async def compact(self) -> dict[str, int]:
+        return await self._run(self._compact)
+
+    async def ping(self) -> None:
+        await self._run(self._ping)
+
+    async def changes(self, cursor: Any) -> tuple[Any, Optional[list[str]]]:
+        return await self._run(self._changes, cursor)
+
+    async def records(self, keys: Optional[list[str]] = None) -> list[dict[str, Any]]:
+        return await self._run(self._records, keys)
+
+    async def update_records(self, updates: dict[str, dict[str, Any]]) -> None:
+        if updates:
+            await self._run(self._update_records, dict(updates))
+
+    async def stale(self, idle_before: Optional[float], dead_before: Optional[float], limit: int) -> list[str]:
+        return await self._run(self._stale, idle_before, dead_before, limit)
+
+    async def delete_many(self, keys: list[str]) -> int:
+        return await self._run(self._delete_many, list(keys)) if keys else 0
+
+    async def recent(self, limit: int) -> list[dict[str, Any]]:
+        return await self._run(self._recent, limit)
+
+    async def close(self) -> None:
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+
+class TinyDBBackend(BlockingBackend):
+    """Session rows in a TinyDB JSON file (fine for small installs)
+
+    The parsed file stays in memory for the life of the backend and is only
+    re-read when another process changes it on disk. Settings are stored as
+    plain JSON objects inside the rows, so a load parses nothing; rows
+    written by older releases hold a JSON string and are still readable.
+    """
+
+    native_settings = True
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = str(path)
+        self._open()
+
+    def _load(self, key: str) -> Optional[Union[str, dict]]:
+        self._refresh()
+        rows = self.db.search(Query().sessionid == key)
+        return rows[0]['settings'] if rows else None
+
+    def _load_many(self, keys: list[str]) -> dict[str, Union[str, dict]]:
+        self._refresh()
+        return {row['sessionid']: row['settings'] for row in self.db.search(Query().sessionid.one_of(keys))}
+
+    def _save(self, key: str, settings: Union[str, dict]) -> None:
+        self._refresh()
+        # The in-memory table must not share nested objects with a live client
+        row = {'sessionid': key, 'settings': copy.deepcopy(settings), 'updated_at': time.time()}
+        self.db.upsert(row, Query().sessionid == key)
+        self._stat = self._file_stat()
+
+    def _save_if(self, key: str, settings: Union[str, dict], expected: Optional[bytes]) -> bool:
+        if expected is not None:
+            stored = self._load(key)
+            if stored is None or settings_digest(stored) != expected:
+                return False
+        self._save(key, settings)
+        return True
+
+    def _delete(self, key: str) -> bool:
+        self._refresh()
+        removed = self.db.remove(Query().sessionid == key)
+        self._stat = self._file_stat()
+        return bool(removed)
+
+    def _compact(self) -> dict[str, int]:
+        """Drop duplicate rows (newest wins) and atomically rewrite the file
+        """
+        self._refresh()
+        table = self.db.table(self.db.default_table_name)
+        rows = {}
+        for document in table.all():
+            # Documents come back in insertion order, so later rows replace older ones
+            rows[document.get('sessionid')] = document
+        before = len(table)
+        data = {
+            self.db.default_table_name: {
+                str(document.doc_id): dict(document) for document in rows.values()
+            },
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".db-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump(data, fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            self.db.close()
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        finally:
+            self._open()
+        return {"before": before, "after": len(rows), "removed": before - len(rows)}
+
+    def _ping(self) -> None:
+        self._refresh()
+        len(self.db)
+
+    def _records(self, keys: Optional[list[str]]) -> list[dict[str, Any]]:
+        self._refresh()
+        rows = self.db.all() if keys is None else self.db.search(Query().sessionid.one_of(keys))
+        return [
+            {"sessionid": row['sessionid'], **{name: row.get(name) for name in RECORD_FIELDS}}
+            for row in rows if 'sessionid' in row
+        ]
+
+    def _update_records(self, updates: dict[str, dict[str, Any]]) -> None:
+        self._refresh()
+        self.db.update_multiple([(fields, Query().sessionid == key) for key, fields in updates.items()])
+        self._stat = self._file_stat()
+
+    def _stale(self, idle_before: Optional[float], dead_before: Optional[float], limit: int) -> list[str]:
+        self._stamp_legacy_rows()
+        return stale_sessions(self._records(None), idle_before, dead_before, limit)
+
+    def _stamp_legacy_rows(self) -> None:
+        """Give rows written by older releases, which carry no timestamps, an `updated_at` of now
+
+        Otherwise they would count as idle since the epoch and the first
+        garbage collection would delete them without waiting out the TTL.
+        """
+        self._refresh()
+        row = Query()
+        if self.db.update({'updated_at': time.time()}, ~row.updated_at.exists() & ~row.last_used_at.exists()):
+            self._stat = self._file_stat()
+
+    def _recent(self, limit: int) -> list[dict[str, Any]]:
+        return recent_sessions(self._records(None), limit)
+
+    def _delete_many(self, keys: list[str]) -> int:
+        self._refresh()
+        removed = self.db.remove(Query().sessionid.one_of(keys))
+        self._stat = self._file_stat()
+        return len(removed)
+
+    def _changes(self, cursor: Any) -> tuple[Any, Optional[list[str]]]:
+        """The file is the only change marker, so any write means "check everything"
+        """
+        stat = self._file_stat()
+        if cursor is None or stat == cursor:
+            return stat, []
+        return stat, None
+
+    def _close(self) -> None:
+        self.db.close()
+
+    def _open(self) -> None:
+        storage = CachingMiddleware(JSONStorage)
+        # Write through on every change so other workers and restarts see it
+        storage.WRITE_CACHE_SIZE = 1
+        self.db = TinyDB(self.path, storage=storage)
+        self._stat = self._file_stat()
+
+    def _refresh(self) -> None:
+        if self._file_stat() != self._stat:
+            self.db.close()
+            self._open()
+
+    def _file_stat(self) -> Optional[tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+
+# Stay well below SQLite's bound-parameter limit
+SQLITE_BATCH_SIZE = 500
+
+# Per-session bookkeeping kept next to the settings (SQLite column types)
+RECORD_COLUMNS = {"status": "TEXT", "checked_at": "REAL", "last_used_at": "REAL", "validated_at": "REAL"}
+RECORD_FIELDS = ("updated_at",) + tuple(RECORD_COLUMNS)
+
+
+def stale_sessions(records: list[dict[str, Any]], idle_before: Optional[float], dead_before: Optional[float],
+                   limit: int) -> list[str]:
+    """Sessions idle since before `idle_before` or found dead before `dead_before`, oldest use first
+    """
+    def last_used(record):
+        return record.get("last_used_at") or record.get("updated_at") or 0
+
+    stale = [
+        record for record in records
+        if (idle_before is not None and last_used(record) < idle_before)
+        or (dead_before is not None and record.get("status") in (EXPIRED, CHALLENGED)
+            and (record.get("checked_at") or record.get("updated_at") or 0) < dead_before)
+    ]
+    stale.sort(key=last_used)
+    return [record["sessionid"] for record in stale[:limit]]
+
+
+def recent_sessions(records: list[dict[str, Any]], limit: int) -> list[dict[str, Any]]:
+    """The `limit` most recently used sessions not known to be dead, most recent first
+    """
+    alive = [record for record in records if record.get("status") not in (EXPIRED, CHALLENGED)]
+    alive.sort(key=lambda record: record.get("last_used_at") or record.get("updated_at") or 0, reverse=True)
+    return alive[:limit]
+
+
+class SQLiteBackend(BlockingBackend):
+    """Session rows in SQLite, indexed by sessionid and shared across workers through WAL
+    """
+
+    def __init__(self, path, migrate_from=None, change_log_size: int = 10000):
+        super().__init__()
+        self.path = str(path)
+        self.change_log_size = change_log_size
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "sessionid TEXT PRIMARY KEY, settings TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")}
+        for name, sql_type in RECORD_COLUMNS.items():
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE sessions ADD COLUMN {name} {sql_type}")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # Every write appends the sessionid to a change log other workers poll
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, sessionid TEXT NOT NULL)"
+        )
+        for event, row in (("INSERT", "new"), ("UPDATE OF settings", "new"), ("DELETE", "old")):
+            self.conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS sessions_{event.split()[0].lower()}_log AFTER {event} ON sessions "
+                f"BEGIN INSERT INTO changes (sessionid) VALUES ({row}.sessionid); END"
+            )
+        # Keep only the newest `change_log_size` log rows; pollers whose cursor
+        # falls behind the oldest kept row re-check every cached session
+        # (recreated in one transaction so concurrently starting workers don't collide)
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute("DROP TRIGGER IF EXISTS changes_trim")
+        self.conn.execute(
+            "CREATE TRIGGER changes_trim AFTER INSERT ON changes "
+            f"BEGIN DELETE FROM changes WHERE seq <= new.seq - {int(change_log_size)}; END"
+        )
+        self.conn.execute("COMMIT")
+        if migrate_from:
+            self.migrate_tinydb(migrate_from)
+
+    def migrate_tinydb(self, json_path) -> int:
+        """Import rows from a TinyDB db.json once, keeping the newest settings per session
+        """
+        json_path = os.path.abspath(str(json_path))
+        if not os.path.exists(json_path):
+            return 0
+        marker = self.conn.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone()
+        if marker:
+            return 0
+        source = TinyDB(json_path)
+        try:
+            # Later rows are newer inserts of the same session, so they win
+            rows = {row['sessionid']: row['settings'] for row in source.all() if 'sessionid' in row}
+        finally:
+            source.close()
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sessions (sessionid, settings, updated_at) VALUES (?, ?, ?)",
+                [
+                    # Current TinyDB rows hold settings objects, older ones JSON strings
+                    (key, settings if isinstance(settings, str) else encode_settings(settings), now)
+                    for key, settings in rows.items()
+                ],
+            )
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)", (json_path,))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def _load(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT settings FROM sessions WHERE sessionid = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _load_many(self, keys: list[str]) -> dict[str, str]:
+        found = {}
+        for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+            batch = keys[start:start + SQLITE_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            found.update(self.conn.execute(
+                f"SELECT sessionid, settings FROM sessions WHERE sessionid IN ({placeholders})", batch,
+            ).fetchall())
+        return found
+
+    def _save(self, key: str, settings: str) -> None:
+        self.conn.execute(
+            "INSERT INTO sessions (sessionid, settings, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(sessionid) DO UPDATE SET settings = excluded.settings, updated_at = excluded.updated_at",
+            (key, settings, time.time()),
+        )
+
+    def _save_if(self, key: str, settings: str, expected: Optional[bytes]) -> bool:
+        # The write lock is held from the check to the write, so no other worker can slip in between
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if expected is not None:
+                stored = self._load(key)
+                if stored is None or settings_digest(stored) != expected:
+                    self.conn.execute("ROLLBACK")
+                    return False
+            self._save(key, settings)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def _delete(self, key: str) -> bool:
+        return self.conn.execute("DELETE FROM sessions WHERE sessionid = ?", (key,)).rowcount > 0
+
+    def _compact(self) -> dict[str, int]:
+        """Reclaim free pages and fold the WAL back into the database file
+        """
+        count = self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        # Only the latest change per session matters to pollers
+        self.conn.execute("DELETE FROM changes WHERE seq NOT IN (SELECT MAX(seq) FROM changes GROUP BY sessionid)")
+        self.conn.execute("VACUUM")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        # The primary key already prevents duplicate sessions
+        return {"before": count, "after": count, "removed": 0}
+
+    def _ping(self) -> None:
+        self.conn.execute("SELECT 1").fetchone()
+
+    def _records(self, keys: Optional[list[str]]) -> list[dict[str, Any]]:
+        columns = ", ".join(("sessionid",) + RECORD_FIELDS)
+        if keys is None:
+            rows = self.conn.execute(f"SELECT {columns} FROM sessions").fetchall()
+        else:
+            rows = []
+            for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+                batch = keys[start:start + SQLITE_BATCH_SIZE]
+                placeholders = ", ".join("?" * len(batch))
+                rows.extend(self.conn.execute(
+                    f"SELECT {columns} FROM sessions WHERE sessionid IN ({placeholders})", batch,
+                ).fetchall())
+        return [dict(zip(("sessionid",) + RECORD_FIELDS, row)) for row in rows]
+
+    def _update_records(self, updates: dict[str, dict[str, Any]]) -> None:
+        # Group by the set of columns touched so each group is one executemany
+        groups: dict[tuple[str, ...], list[list[Any]]] = {}
+        for key, fields in updates.items():
+            names = tuple(name for name in fields if name in RECORD_COLUMNS)
+            if names:
+                groups.setdefault(names, []).append([fields[name] for name in names] + [key])
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for names, rows in groups.items():
+                assignments = ", ".join(f"{name} = ?" for name in names)
+                self.conn.executemany(f"UPDATE sessions SET {assignments} WHERE sessionid = ?", rows)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _stale(self, idle_before: Optional[float], dead_before: Optional[float], limit: int) -> list[str]:
+        rows = self.conn.execute(
+            "SELECT sessionid FROM sessions WHERE "
+            "(? IS NOT NULL AND COALESCE(last_used_at, updated_at) < ?) OR "
+            "(? IS NOT NULL AND status IN (?, ?) AND COALESCE(checked_at, updated_at) < ?) "
+            "ORDER BY COALESCE(last_used_at, updated_at) LIMIT ?",
+            (idle_before, idle_before, dead_before, EXPIRED, CHALLENGED, dead_before, limit),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _recent(self, limit: int) -> list[dict[str, Any]]:
+        columns = ("sessionid",) + RECORD_FIELDS
+        rows = self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM sessions WHERE status IS NULL OR status NOT IN (?, ?) "
+            "ORDER BY COALESCE(last_used_at, updated_at) DESC LIMIT ?",
+            (EXPIRED, CHALLENGED, limit),
+        ).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _delete_many(self, keys: list[str]) -> int:
+        deleted = 0
+        for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+            batch = keys[start:start + SQLITE_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            deleted += self.conn.execute(f"DELETE FROM sessions WHERE sessionid IN ({placeholders})", batch).rowcount
+        return deleted
+
+    def _changes(self, cursor: Any) -> tuple[Any, Optional[list[str]]]:
+        seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        if cursor is None or seq == cursor:
+            return seq, []
+        if seq < cursor:
+            # The database was replaced underneath us
+            return seq, None
+        oldest = self.conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+        if oldest is not None and cursor < oldest - 1:
+            # Rows after our cursor were trimmed, so changes may be missing
+            return seq, None
+        rows = self.conn.execute("SELECT DISTINCT sessionid FROM changes WHERE seq > ?", (cursor,)).fetchall()
+        return seq, [row[0] for row in rows]
+
+    def _close(self) -> None:
+        self.conn.close()
+
+
+class RedisBackend:
+    """Session settings in Redis (or anything speaking its protocol), shared by every worker and node
+
+    Each session is a string key; a sorted set indexes sessionids by last
+    write so the store can be listed and compacted without SCAN, and a capped
+    stream logs every write for cross-worker invalidation. Loads are kept in
+    a small local cache for `local_ttl` seconds so a burst of requests for
+    one session costs a single round trip.
+    """
+
+    native_settings = False
+
+    def __init__(self, url: str, prefix: str = "aiograpi-rest:", local_ttl: float = 2.0,
+                 local_size: int = 1024, batch_size: int = 500, stream_size: int = 10000,
+                 client=None, clock=time.monotonic):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as exc:
+                raise RuntimeError(
+                    "Redis storage requires the redis package: pip install 'aiograpi-rest[redis]'"
+                ) from exc
+            client = redis.from_url(url, decode_responses=True)
+        try:
+            from redis.exceptions import WatchError
+        except ImportError:
+            # Only reachable with an injected client; nothing raises WatchError then
+            WatchError = ()
+        self._watch_error = WatchError
+        self.url = url
+        self.client = client
+        self.prefix = prefix
+        self.index_key = f"{prefix}sessions"
+        self.changes_key = f"{prefix}changes"
+        self.records_key = f"{prefix}records"
+        self.stream_size = stream_size
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        self.batch_size = batch_size
+        self.clock = clock
+        # sessionid -> (expires_at, settings); misses are never cached so a
+        # login on another worker is visible immediately
+        self._local: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    def key(self, sessionid: str) -> str:
+        return f"{self.prefix}session:{sessionid}"
+
+    async def load(self, key: str) -> Optional[str]:
+        cached = self._local.get(key)
+        if cached is not None and cached[0] > self.clock():
+            return cached[1]
+        settings = await self.client.get(self.key(key))
+        self._remember(key, settings)
+        return settings
+
+    async def load_many(self, keys: list[str]) -> dict[str, str]:
+        """Fetch many sessions with pipelined MGETs (one round trip)
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        pipe = self.client.pipeline(transaction=False)
+        for start in range(0, len(keys), self.batch_size):
+            pipe.mget([self.key(key) for key in keys[start:start + self.batch_size]])
+        values = [value for batch in await pipe.execute() for value in batch]
+        found = {}
+        for key, settings in zip(keys, values):
+            self._remember(key, settings)
+            if settings is not None:
+                found[key] = settings
+        return found
+
+    async def save(self, key: str, settings: str) -> None:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(self.key(key), settings)
+        pipe.zadd(self.index_key, {key: time.time()})
+        self._log_change(pipe, key)
+        await pipe.execute()
+        self._remember(key, settings)
+
+    async def save_if(self, key: str, settings: str, expected: Optional[bytes]) -> bool:
+        """Save only if the stored settings still have digest `expected`, using WATCH/MULTI
+        """
+        if expected is None:
+            await self.save(key, settings)
+            return True
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self.key(key))
+                stored = await pipe.get(self.key(key))
+                if stored is None or settings_digest(stored) != expected:
+                    await pipe.unwatch()
+                    self._local.pop(key, None)
+                    return False
+                pipe.multi()
+                pipe.set(self.key(key), settings)
+                pipe.zadd(self.index_key, {key: time.time()})
+                self._log_change(pipe, key)
+                await pipe.execute()
+            except self._watch_error:
+                # Another worker wrote the session between WATCH and EXEC
+                self._local.pop(key, None)
+                return False
+        self._remember(key, settings)
+        return True
+
+    async def delete(self, key: str) -> bool:
+        self._local.pop(key, None)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self.key(key))
+        pipe.zrem(self.index_key, key)
+        pipe.hdel(self.records_key, key)
+        self._log_change(pipe, key)
+        deleted, *_ = await pipe.execute()
+        return deleted > 0
+
+    async def compact(self) -> dict[str, int]:
+        """Drop index entries whose session key expired or was removed outside the app
+        """
+        members = await self.client.zrange(self.index_key, 0, -1)
+        found = await self.load_many(members)
+        stale = [key for key in members if key not in found]
+        if stale:
+            await self.client.zrem(self.index_key, *stale)
+        return {"before": len(members), "after": len(found), "removed": len(stale)}
+
+    async def ping(self) -> None:
+        await self.client.ping()
+
+    async def records(self, keys: Optional[list[str]] = None) -> list[dict[str, Any]]:
+        pipe = self.client.pipeline(transaction=False)
+        if keys is None:
+            pipe.zrange(self.index_key, 0, -1, withscores=True)
+            pipe.hgetall(self.records_key)
+            indexed, stored = await pipe.execute()
+        else:
+            keys = list(keys)
+            if not keys:
+                return []
+            for key in keys:
+                pipe.zscore(self.index_key, key)
+            pipe.hmget(self.records_key, keys)
+            *scores, values = await pipe.execute()
+            indexed = [(key, score) for key, score in zip(keys, scores) if score is not None]
+            stored = dict(zip(keys, values))
+        return [
+            {
+                "sessionid": key,
+                **{name: None for name in RECORD_COLUMNS},
+                **json.loads(stored.get(key) or "{}"),
+                "updated_at": updated_at,
+            }
+            for key, updated_at in indexed
+        ]
+
+    async def update_records(self, updates: dict[str, dict[str, Any]]) -> None:
+        merged = {}
+        for record in await self.records(list(updates)):
+            key = record["sessionid"]
+            stored = {name: record[name] for name in RECORD_COLUMNS if record.get(name) is not None}
+            stored.update({name: value for name, value in updates[key].items() if name in RECORD_COLUMNS})
+            merged[key] = json.dumps(stored)
+        if merged:
+            await self.client.hset(self.records_key, mapping=merged)
+
+    async def stale(self, idle_before: Optional[float], dead_before: Optional[float], limit: int) -> list[str]:
+        return stale_sessions(await self.records(), idle_before, dead_before, limit)
+
+    async def recent(self, limit: int) -> list[dict[str, Any]]:
+        return recent_sessions(await self.records(), limit)
+
+    async def delete_many(self, keys: list[str]) -> int:
+        if not keys:
+            return 0
+        pipe = self.client.pipeline(transaction=True)
+        for key in keys:
+            self._local.pop(key, None)
+            pipe.delete(self.key(key))
+            self._log_change(pipe, key)
+        pipe.zrem(self.index_key, *keys)
+        pipe.hdel(self.records_key, *keys)
+        results = await pipe.execute()
+        return sum(results[:2 * len(keys):2])
+
+    async def changes(self, cursor: Optional[str]) -> tuple[str, Optional[list[str]]]:
+        """Sessions written since `cursor` (a stream id); None if the log was trimmed past it
+        """
+        if cursor is None:
+            last = await self.client.xrevrange(self.changes_key, "+", "-", count=1)
+            return (last[0][0] if last else "0-0"), []
+        entries = []
+        start = cursor
+        while True:
+            batch = await self.client.xrange(self.changes_key, f"({start}", "+", count=self.batch_size)
+            entries.extend(batch)
+            if len(batch) < self.batch_size:
+                break
+            start = batch[-1][0]
+        if not entries:
+            return cursor, []
+        keys = list(dict.fromkeys(fields["sessionid"] for _, fields in entries))
+        for key in keys:
+            self._local.pop(key, None)
+        if cursor != "0-0":
+            oldest = await self.client.xrange(self.changes_key, "-", "+", count=1)
+            if oldest and oldest[0][0] == entries[0][0]:
+                # Everything up to our cursor was trimmed, so changes may be missing
+                return entries[-1][0], None
+        return entries[-1][0], keys
+
+    async def close(self) -> None:
+        self._local.clear()
+        await self.client.aclose()
+
+    def _log_change(self, pipe, key: str) -> None:
+        pipe.xadd(self.changes_key, {"sessionid": key}, maxlen=self.stream_size, approximate=True)
+
+    def _remember(self, key: str, settings: Optional[str]) -> None:
+        if settings is None or self.local_ttl <= 0:
+            self._local.pop(key, None)
+            return
+        self._local[key] = (self.clock() + self.local_ttl, settings)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+REDIS_SCHEMES = ("redis://", "rediss://", "unix://")
+
+
+def create_backend(db_path=None, backend: Optional[str] = None):
+    """Build the configured session backend
+    """
+    db_path = str(db_path or os.getenv("AIOGRAPI_REST_DB_PATH", "./db.json"))
+    backend = (backend or os.getenv("AIOGRAPI_REST_STORAGE", "")).lower()
+    if not backend:
+        if db_path.startswith(REDIS_SCHEMES):
+            backend = "redis"
+        else:
+            backend = "sqlite" if db_path.endswith(SQLITE_SUFFIXES) else "tinydb"
+    if backend == "tinydb":
+        return TinyDBBackend(db_path)
+    if backend == "sqlite":
+        return SQLiteBackend(db_path, migrate_from=os.getenv("AIOGRAPI_REST_MIGRATE_FROM"))
+    if backend == "redis":
+        url = db_path if db_path.startswith(REDIS_SCHEMES) else os.getenv(
+            "AIOGRAPI_REST_REDIS_URL", "redis://localhost:6379/0",
+        )
+        return RedisBackend(
+            url,
+            prefix=os.getenv("AIOGRAPI_REST_REDIS_PREFIX", "aiograpi-rest:"),
+            local_ttl=float(os.getenv("AIOGRAPI_REST_REDIS_LOCAL_TTL", "2")),
+        )
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def session_status(error: Any) -> Optional[str]:
+    """Map an aiograpi exception or `last_json` message to a dead-session status
+    """
+    if isinstance(error, LoginRequired) or error == "login_required":
+        return EXPIRED
+    if isinstance(error, ChallengeError) or error in ("challenge_required", "checkpoint_required"):
+        return CHALLENGED
+    return None
+
+
+class SessionHealthMonitor:
+    """Background prober that keeps stored sessions' health up to date
+
+    Every stored session is probed with a cheap upstream call once per
+    `interval` seconds, at most `rate` probes a minute with jittered pauses,
+    and the outcome is recorded next to the session in the store. Sessions
+    found expired or challenged (here or by another worker) are refused by
+    ClientStorage.get without another upstream round trip.
+    """
+
+    def __init__(self, storage: "ClientStorage", interval: Optional[float] = None, rate: Optional[float] = None,
+                 jitter: float = 0.5, rng=random.random):
+        if interval is None:
+            interval = float(os.getenv("AIOGRAPI_REST_HEALTH_CHECK_INTERVAL", "0"))
+        if rate is None:
+            rate = float(os.getenv("AIOGRAPI_REST_HEALTH_CHECK_RATE", "30"))
+        self.storage = storage
+        self.interval = interval
+        self.rate = rate
+        self.jitter = jitter
+        self.rng = rng
+        # sessionid -> EXPIRED or CHALLENGED; healthy sessions are not kept
+        self.statuses: dict[str, str] = {}
+        self.probes = 0
+        self.probe_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0 and self.rate > 0
+
+    def check(self, key: str, cl: Any = None) -> None:
+        """Raise the matching aiograpi error if a session is known to be dead
+        """
+        if cl is not None and self.enabled:
+            status = session_status((getattr(cl, "last_json", None) or {}).get("message"))
+            if status is not None:
+                self.statuses[key] = status
+        status = self.statuses.get(key)
+        if status == EXPIRED:
+            raise LoginRequired("Session expired (found by health check), please relogin")
+        if status == CHALLENGED:
+            raise ChallengeRequired("Session requires a challenge to be resolved (found by health check)")
+
+    def forget(self, key: str) -> None:
+        self.statuses.pop(key, None)
+
+    def due(self, records: list[dict[str, Any]], now: float) -> list[str]:
+        """Sessions not probed within `interval`, least recently probed first
+        """
+        due = [
+            record for record in records
+            if record.get("checked_at") is None or now - record["checked_at"] >= self.interval
+        ]
+        due.sort(key=lambda record: record.get("checked_at") or 0)
+        return [record["sessionid"] for record in due]
+
+    async def probe(self, key: str) -> Optional[str]:
+        """Probe one session and record the outcome; None when the probe itself failed
+        """
+        entry = self.storage.cache.peek(key)
+        if entry is not None:
+            cl = entry.client
+        else:
+            stored = await self.storage.backend.load(key)
+            if stored is None:
+                self.forget(key)
+                return None
+            cl = self.storage.build(stored)
+        self.probes += 1
+        try:
+            await cl.account_info()
+            status = HEALTHY
+        except Exception as exc:
+            status = session_status(exc)
+            if status is None:
+                # Network trouble or rate limiting says nothing about the session
+                self.probe_errors += 1
+        fields = {"checked_at": self.storage.clock()}
+        if status is not None:
+            fields["status"] = status
+        if status == HEALTHY:
+            fields["validated_at"] = fields["checked_at"]
+        await self.storage.backend.update_records({key: fields})
+        if status == HEALTHY:
+            self.forget(key)
+        elif status is not None:
+            self.statuses[key] = status
+            self.storage.cache.pop(key)
+        return status
+
+    async def run_once(self) -> int:
+        """Refresh known statuses from the store and probe up to a minute's worth of due sessions
+        """
+        records = await self.storage.backend.records()
+        self.statuses = {
+            record["sessionid"]: record["status"] for record in records if record.get("status") in (EXPIRED, CHALLENGED)
+        }
+        due = self.due(records, self.storage.clock())[:max(1, int(self.rate))]
+        for index, key in enumerate(due):
+            if index:
+                await asyncio.sleep(self.pause())
+            await self.probe(key)
+        return len(due)
+
+    async def run(self) -> None:
+        """Probe sessions until cancelled
+        """
+        while True:
+            try:
+                probed = await self.run_once()
+            except Exception:
+                self.probe_errors += 1
+                probed = 0
+            await asyncio.sleep(self.pause() if probed else self.pause(min(self.interval, 60.0)))
+
+    def pause(self, base: Optional[float] = None) -> float:
+        """Seconds to wait before the next probe, spread by +/- `jitter`
+        """
+        if base is None:
+            base = 60.0 / self.rate
+        return base * (1 + self.jitter * (2 * self.rng() - 1))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "probes": self.probes,
+            "probe_errors": self.probe_errors,
+            "expired": sum(status == EXPIRED for status in self.statuses.values()),
+            "challenged": sum(status == CHALLENGED for status in self.statuses.values()),
+        }
+
+
+@dataclass
+class LoginFlight:
+    """One login attempt: `done` means `result` came from another caller or a recent login
+    """
+    result: Any = None
+    done: bool = False
+
+
+class LoginCoalescer:
+    """Collapse concurrent and repeated logins for the same account into one
+
+    Logins are keyed by username, proxy and a keyed digest of the password,
+    so a caller with the wrong password never receives someone else's
+    session. Callers arriving while a login is in flight wait for it and
+    share its result; successful results are reused for `reuse_window`
+    seconds.
+    """
+
+    def __init__(self, reuse_window: Optional[float] = None, clock=time.monotonic):
+        if reuse_window is None:
+            reuse_window = float(os.getenv("AIOGRAPI_REST_LOGIN_REUSE_WINDOW", "30"))
+        self.reuse_window = reuse_window
+        self.clock = clock
+        self._secret = os.urandom(32)
+        self._inflight: dict[bytes, asyncio.Future] = {}
+        self._recent: dict[bytes, tuple[float, Any]] = {}
+        self.coalesced = 0
+        self.reused = 0
+
+    def key(self, username: str, password: str, proxy: str = "") -> bytes:
+        payload = "\0".join((username.strip().lower(), proxy or "", password))
+        return hashlib.blake2b(payload.encode(), key=self._secret, digest_size=16).digest()
+
+    @asynccontextmanager
+    async def coalesce(self, key: bytes):
+        """Yield a LoginFlight; the caller logs in and sets `result` unless `done` is already set
+        """
+        now = self.clock()
+        recent = self._recent.get(key)
+        if recent is not None and recent[0] > now:
+            self.reused += 1
+            yield LoginFlight(result=recent[1], done=True)
+            return
+        leader = self._inflight.get(key)
+        if leader is not None:
+            self.coalesced += 1
+            yield LoginFlight(result=await asyncio.shield(leader), done=True)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        flight = LoginFlight()
+        try:
+            yield flight
+        except BaseException as exc:
+            error = exc if isinstance(exc, Exception) else RuntimeError("Login was cancelled, please retry")
+            future.set_exception(error)
+            future.exception()  # retrieved here so a login nobody waited on is not logged
+            raise
+        else:
+            future.set_result(flight.result)
+            if flight.result and self.reuse_window > 0:
+                self._remember(key, flight.result, now)
+        finally:
+            del self._inflight[key]
+
+    def _remember(self, key: bytes, result: Any, now: float) -> None:
+        for stale in [stale for stale, (expires, _) in self._recent.items() if expires <= now]:
+            del self._recent[stale]
+        self._recent[key] = (now + self.reuse_window, result)
+
+    def stats(self) -> dict[str, int]:
+        return {"inflight": len(self._inflight), "coalesced": self.coalesced, "reused": self.reused}
+
+
+class SharedTransport(httpx.AsyncBaseTransport):
+    """One pooled transport handed to many clients
+
+    Clients close their transport when they are closed; this wrapper ignores
+    that so the pool outlives them, and counts requests and the connections
+    opened for them.
+    """
+
+    def __init__(self, pool: "TransportPool", transport: httpx.AsyncHTTPTransport):
+        self.pool = pool
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        pool = self.pool
+        trace = request.extensions.get("trace")
+
+        async def count_connects(name, info):
+            if name.endswith("connect_tcp.started"):
+                pool.connections_opened += 1
+            if trace is not None:
+                result = trace(name, info)
+                if asyncio.iscoroutine(result):
+                    await result
+
+        request.extensions["trace"] = count_connects
+        pool.requests += 1
+        pool.active += 1
+        try:
+            return await self.transport.handle_async_request(request)
+        finally:
+            pool.active -= 1
+
+    def connections(self) -> list:
+        inner = getattr(self.transport, "_pool", None)
+        return list(getattr(inner, "connections", []))
+
+    async def aclose(self) -> None:
+        pass
+
+
+class TransportPool:
+    """Keep-alive connection pools shared by every client going through the same proxy
+
+    aiograpi gives each session its own httpx client, so connections, TLS
+    sessions and DNS lookups were never reused across sessions. Attached
+    clients keep their own cookies and headers but send requests through one
+    transport per (proxy, verify) pair. `max_connections=0` leaves clients
+    untouched.
+    """
+
+    def __init__(self, max_connections: Optional[int] = None, max_keepalive: Optional[int] = None,
+                 keepalive_expiry: Optional[float] = None):
+        if max_connections is None:
+            max_connections = int(os.getenv("AIOGRAPI_REST_UPSTREAM_MAX_CONNECTIONS", "100"))
+        if max_keepalive is None:
+            max_keepalive = int(os.getenv("AIOGRAPI_REST_UPSTREAM_MAX_KEEPALIVE", "20"))
+        if keepalive_expiry is None:
+            keepalive_expiry = float(os.getenv("AIOGRAPI_REST_UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(max_keepalive, max_connections),
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._transports: dict[tuple[str, bool], SharedTransport] = {}
+        self.requests = 0
+        self.connections_opened = 0
+        self.active = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limits.max_connections)
+
+    def transport(self, proxy: Optional[str] = None, verify: bool = True) -> SharedTransport:
+        key = (proxy or "", bool(verify))
+        shared = self._transports.get(key)
+        if shared is None:
+            shared = self._transports[key] = SharedTransport(self, httpx.AsyncHTTPTransport(
+                proxy=proxy or None, verify=verify, limits=self.limits))
+        return shared
+
+    def attach(self, cl: Client) -> Client:
+        """Route the client's private, public and graphql sessions through the shared pools
+        """
+        if self.enabled:
+            for name in ("private", "public", "graphql"):
+                session = getattr(cl, name, None)
+                # CurlSession and test doubles keep their own transport
+                if isinstance(session, httpx_ext.Session):
+                    self._attach_session(session)
+        return cl
+
+    def _attach_session(self, session: httpx_ext.Session) -> None:
+        def set_client():
+            session._client = httpx.AsyncClient(
+                transport=self.transport(session.proxy, session.verify), follow_redirects=True)
+
+        previous = session._client
+        # Session.proxy's setter rebuilds the client; keep later proxy changes pooled too
+        session._set_client = set_client
+        set_client()
+        if previous is not None:
+            session._client.cookies = previous.cookies
+
+    def stats(self) -> dict[str, Any]:
+        connections = [conn for shared in self._transports.values() for conn in shared.connections()]
+        idle = sum(1 for conn in connections if conn.is_idle())
+        reused = max(0, self.requests - self.connections_opened)
+        return {
+            "pools": len(self._transports),
+            "max_connections": self.limits.max_connections * len(self._transports),
+            "connections": len(connections),
+            "idle": idle,
+            "active": self.active,
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "reuse_ratio": reused / self.requests if self.requests else 0.0,
+        }
+
+    async def close(self) -> None:
+        transports, self._transports = self._transports, {}
+        for shared in transports.values():
+            with suppress(Exception):
+                await shared.transport.aclose()
+
+
+# Action classes the rate limiter budgets separately; everything else is a read
+READ = "read"
+LIKE = "like"
+FOLLOW = "follow"
+DM = "dm"
+ACTION_PATTERNS = (
+    (LIKE, re.compile(r"/(un)?like/?$")),
+    (FOLLOW, re.compile(r"^/?friendships/(create|destroy|remove_follower|block|unblock)/")),
+    (DM, re.compile(r"^/?direct_v2/threads/broadcast/")),
+)
+
+
+def action_class(endpoint: str) -> str:
+    for action, pattern in ACTION_PATTERNS:
+        if pattern.search(endpoint):
+            return action
+    return READ
+
+
+def parse_rate_limits(spec: str) -> dict[str, tuple[float, float]]:
+    """Parse `read=100/60,like=60/3600` into {action: (requests, seconds)}
+    """
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        action, _, budget = item.partition("=")
+        count, _, seconds = budget.partition("/")
+        limits[action.strip()] = (float(count), float(seconds or 1))
+    return limits
+
+
+class RateLimited(Exception):
+    """An upstream call would exceed its session or proxy budget for longer than the caller may wait
+    """
+
+    def __init__(self, action: str, retry_after: float):
+        super().__init__(f"Rate limit for {action} requests exceeded, retry in {retry_after:.1f}s")
+        self.action = action
+        self.retry_after = retry_after
+
+
+@dataclass
+class TokenBucket:
+    capacity: float
+    rate: float
+    tokens: float
+    updated: float
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """Token buckets per session and per proxy for each action class
+
+    Every upstream request takes a token from its session's bucket and its
+    proxy's bucket for the action class. Requests that would have to wait up
+    to `max_wait` seconds queue for their turn; longer waits raise
+    RateLimited, which the app turns into 429 with Retry-After.
+    """
+
+    def __init__(self, session_limits: Optional[dict[str, tuple[float, float]]] = None,
+                 proxy_limits: Optional[dict[str, tuple[float, float]]] = None,
+                 max_wait: Optional[float] = None, clock=time.monotonic, max_buckets: int = 10000):
+        if session_limits is None:
+            session_limits = parse_rate_limits(os.getenv(
+                "AIOGRAPI_REST_SESSION_RATE_LIMITS", "read=100/60,like=60/3600,follow=60/3600,dm=100/3600"))
+        if proxy_limits is None:
+            proxy_limits = parse_rate_limits(os.getenv("AIOGRAPI_REST_PROXY_RATE_LIMITS", ""))
+        if max_wait is None:
+            max_wait = float(os.getenv("AIOGRAPI_REST_RATE_LIMIT_MAX_WAIT", "10"))
+        self.limits = {"session": session_limits, "proxy": proxy_limits}
+        self.max_wait = max_wait
+        self.clock = clock
+        self.max_buckets = max_buckets
+        self._buckets: dict[tuple[str, str, str], TokenBucket] = {}
+        self.waiting = dict.fromkeys((READ, LIKE, FOLLOW, DM), 0)
+        self.queued = dict.fromkeys(self.waiting, 0)
+        self.rejected = dict.fromkeys(self.waiting, 0)
+
+    def _bucket(self, scope: str, key: Optional[str], action: str, now: float) -> Optional[TokenBucket]:
+        limit = self.limits[scope].get(action)
+        if not key or limit is None or limit[0] <= 0:
+            return None
+        bucket = self._buckets.get((scope, key, action))
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune(now)
+            count, seconds = limit
+            bucket = self._buckets[(scope, key, action)] = TokenBucket(count, count / seconds, count, now)
+        bucket.refill(now)
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        # Buckets that have refilled completely carry no state worth keeping
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._buckets[key]
+
+    async def acquire(self, action: str, session: Optional[str] = None, proxy: Optional[str] = None) -> None:
+        now = self.clock()
+        buckets = [bucket for bucket in (
+            self._bucket("session", session, action, now),
+            self._bucket("proxy", proxy, action, now),
+        ) if bucket is not None]
+        wait = max([(1 - bucket.tokens) / bucket.rate for bucket in buckets if bucket.tokens < 1], default=0.0)
+        if wait > self.max_wait:
+            self.rejected[action] = self.rejected.get(action, 0) + 1
+            raise RateLimited(action, wait)
+        # Reserve the token now so later callers queue behind this one
+        for bucket in buckets:
+            bucket.tokens -= 1
+        if wait <= 0:
+            return
+        self.queued[action] = self.queued.get(action, 0) + 1
+        self.waiting[action] = self.waiting.get(action, 0) + 1
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            self.waiting[action] -= 1
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {"waiting": dict(self.waiting), "queued": dict(self.queued), "rejected": dict(self.rejected)}
+
+
+# Upstream errors that count against a circuit: the network path (proxy) or the account (session).
+# Anything else, such as "user not found", proves both work.
+PROXY_FAILURES = (
+    ClientConnectionError, ClientRequestTimeout, ClientIncompleteReadError, ProxyAddressIsBlocked,
+    httpx.TransportError, TimeoutError,
+)
+SESSION_FAILURES = (
+    LoginRequired, ClientLoginRequired, ChallengeError, CheckpointRequired, ConsentRequired,
+    FeedbackRequired, PleaseWaitFewMinutes, RateLimitError, ClientThrottledError, SentryBlock,
+    ReloginAttemptExceeded,
+)
+
+
+def failure_scope(exc: BaseException) -> Optional[str]:
+    if isinstance(exc, PROXY_FAILURES):
+        return "proxy"
+    if isinstance(exc, SESSION_FAILURES):
+        return "session"
+    return None
+
+
+class CircuitOpen(Exception):
+    """Upstream calls for this session or proxy are failing; fail fast instead of waiting on them
+    """
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Circuit for this {scope} is open after repeated upstream failures, "
+                         f"retry in {retry_after:.1f}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+@dataclass
+class Circuit:
+    failures: int = 0
+    opened_at: Optional[float] = None
+    probing: bool = False
+
+
+class CircuitBreakers:
+    """Circuit breakers per session and per proxy
+
+    A circuit opens after `failures` consecutive upstream failures of its
+    kind and rejects calls with CircuitOpen for `cooldown` seconds. Then a
+    single half-open probe is let through: success closes the circuit, a
+    failure opens it again. Only failing paths are tracked, so healthy
+    sessions cost nothing. `failures=0` disables the breakers.
+    """
+
+    def __init__(self, failures: Optional[int] = None, cooldown: Optional[float] = None, clock=time.monotonic):
+        if failures is None:
+            failures = int(os.getenv("AIOGRAPI_REST_BREAKER_FAILURES", "5"))
+        if cooldown is None:
+            cooldown = float(os.getenv("AIOGRAPI_REST_BREAKER_COOLDOWN", "30"))
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self._circuits: dict[tuple[str, str], Circuit] = {}
+        self.opened = 0
+        self.rejected = 0
+
+    def enter(self, paths: list[tuple[str, str]]) -> None:
+        """Raise CircuitOpen if any path is open, otherwise claim the probe of half-open ones
+        """
+        if not self.failures:
+            return
+        now = self.clock()
+        probes = []
+        for path in paths:
+            circuit = self._circuits.get(path)
+            if circuit is None or circuit.opened_at is None:
+                continue
+            remaining = circuit.opened_at + self.cooldown - now
+            if remaining > 0 or circuit.probing:
+                self.rejected += 1
+                raise CircuitOpen(path[0], max(remaining, 1.0))
+            probes.append(circuit)
+        for circuit in probes:
+            circuit.probing = True
+
+    def success(self, path: tuple[str, str]) -> None:
+        self._circuits.pop(path, None)
+
+    def failure(self, path: tuple[str, str]) -> None:
+        if not self.failures:
+            return
+        circuit = self._circuits.setdefault(path, Circuit())
+        circuit.failures += 1
+        circuit.probing = False
+        if circuit.opened_at is not None or circuit.failures >= self.failures:
+            circuit.opened_at = self.clock()
+            self.opened += 1
+
+    def release(self, path: tuple[str, str]) -> None:
+        # A probe that ended without an answer (cancelled) lets the next caller probe
+        circuit = self._circuits.get(path)
+        if circuit is not None:
+            circuit.probing = False
+
+    def record(self, paths: list[tuple[str, str]], exc: Optional[BaseException] = None) -> None:
+        scope = failure_scope(exc) if isinstance(exc, Exception) else None
+        for path in paths:
+            if exc is not None and not isinstance(exc, Exception):
+                self.release(path)
+            elif path[0] == scope:
+                self.failure(path)
+            elif scope == "proxy":
+                # The account was never reached, so the session learned nothing
+                self.release(path)
+            else:
+                self.success(path)
+
+    def reset(self, scope: str, key: str) -> None:
+        self._circuits.pop((scope, key), None)
+
+    def stats(self) -> dict[str, int]:
+        open_circuits = [path for path, circuit in self._circuits.items() if circuit.opened_at is not None]
+        return {
+            "open_sessions": sum(1 for scope, _ in open_circuits if scope == "session"),
+            "open_proxies": sum(1 for scope, _ in open_circuits if scope == "proxy"),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
 
 
 class ClientStorage:
-    def __init__(self, db_path=None, client_factory=Client):
-        db_path = db_path or os.getenv("AIOGRAPI_REST_DB_PATH", "./db.json")
-        self.db = TinyDB(db_path)
+    """Session store plus the warm clients built from it
+
+    One instance lives for the whole app (see the lifespan in main.py) and
+    owns the backend connection and the client cache.
+    """
+
+    def __init__(self, db_path=None, client_factory=Client, cache: Optional[ClientCache] = None,
+                 validation_ttl: Optional[float] = None, clock=time.time, backend=None,
+                 flush_interval: Optional[float] = None, invalidation_interval: Optional[float] = None):
+        self.backend = backend if backend is not None else create_backend(db_path)
         self.client_factory = client_factory
+        if cache is None:
+            cache = ClientCache(
+                max_size=int(os.getenv("AIOGRAPI_REST_CLIENT_CACHE_SIZE", "1000")),
+                ttl=float(os.getenv("AIOGRAPI_REST_CLIENT_CACHE_TTL", "900")),
+            )
+        self.cache = cache
+        if validation_ttl is None:
+            validation_ttl = float(os.getenv("AIOGRAPI_REST_SESSION_VALIDATION_TTL", "300"))
+        self.validation_ttl = validation_ttl
+        self.clock = clock
+        self.compress_settings = os.getenv("AIOGRAPI_REST_SETTINGS_COMPRESSION", "") == "zlib"
+        # sessionid -> task hydrating/validating it, shared by concurrent lookups
+        self._inflight: dict[str, asyncio.Task] = {}
+        # sessionid -> generation, bumped whenever the session is replaced or
+        # dropped so a lookup started earlier does not cache its older client
+        self._generations: dict[str, int] = {}
+        self._generation = 0
+        self.coalesced_waits = 0
+        # Write-behind: clients handed out since the last flush, and the digest
+        # of the settings last written for each session
+        if flush_interval is None:
+            flush_interval = float(os.getenv("AIOGRAPI_REST_FLUSH_INTERVAL", "5"))
+        self.flush_interval = flush_interval
+        self._dirty: dict[str, Client] = {}
+        self._persisted: dict[str, bytes] = {}
+        self._flush_lock = asyncio.Lock()
+        self.flush_writes = 0
+        self.flush_errors = 0
+        self.flush_conflicts = 0
+        # Cross-worker invalidation: position in the backend change log
+        if invalidation_interval is None:
+            invalidation_interval = float(os.getenv("AIOGRAPI_REST_INVALIDATION_INTERVAL", "1"))
+        self.invalidation_interval = invalidation_interval
+        self._change_cursor = None
+        self.invalidations = 0
+        self.health = SessionHealthMonitor(self)
+        self.logins = LoginCoalescer()
+        self.transports = TransportPool()
+        self.limiter = RateLimiter()
+        self.breakers = CircuitBreakers()
+        # Applied to every client, new or hydrated: aiograpi's pause before
+        # each private request and its per-call HTTP read timeout
+        self.request_delay = float(os.getenv("AIOGRAPI_REST_REQUEST_DELAY", "0.1"))
+        self.read_timeout = float(os.getenv("AIOGRAPI_REST_UPSTREAM_READ_TIMEOUT", "25"))
+        # sessionid -> timestamps (last_used_at, validated_at) not yet stored
+        self._touched: dict[str, dict[str, float]] = {}
+        # sessionid -> last_used_at this worker last queued; newer uses are only
+        # written once the stored value is `last_used_resolution` seconds old
+        self._used_at: dict[str, float] = {}
+        self.last_used_resolution = float(os.getenv("AIOGRAPI_REST_LAST_USED_RESOLUTION", "300"))
+        # Garbage collection of idle and dead sessions; a TTL of 0 keeps them forever
+        self.idle_ttl = float(os.getenv("AIOGRAPI_REST_SESSION_IDLE_TTL", "0"))
+        self.dead_ttl = float(os.getenv("AIOGRAPI_REST_SESSION_DEAD_TTL", "0"))
+        self.gc_interval = float(os.getenv("AIOGRAPI_REST_GC_INTERVAL", "3600"))
+        self.gc_batch_size = int(os.getenv("AIOGRAPI_REST_GC_BATCH_SIZE", "500"))
+        self.gc_reclaimed = 0
+        self.warmup_stats = {"sessions": 0, "warmed": 0, "failed": 0}
 
     def client(self):
         """Get new client (helper)
         """
-        cl = self.client_factory()
-        cl.request_timeout = 0.1
-        return cl
+        return self._configure(self.client_factory())
+
+    def _configure(self, cl: Client) -> Client:
+        cl.request_timeout = self.request_delay
+        cl.read_timeout = self.read_timeout
+        self._guard(cl)
+        return self.transports.attach(cl)
+
+    def _guard(self, cl: Client) -> None:
+        """Send every private and public request of the client through the rate limiter and circuit breakers
+        """
+        for name in ("private_request", "public_request"):
+            request = getattr(cl, name, None)
+            if request is None:
+                continue
+
+            async def guarded(endpoint, *args, _request=request, **kwargs):
+                session = normalize_sessionid(cl.sessionid) if cl.sessionid else None
+                proxy = getattr(cl, "proxy", None) or ""
+                paths = [("proxy", proxy)] if session is None else [("session", session), ("proxy", proxy)]
+                await self.limiter.acquire(action_class(str(endpoint)), session, proxy or None)
+                self.breakers.enter(paths)
+                try:
+                    result = await _request(endpoint, *args, **kwargs)
+                except BaseException as exc:
+                    self.breakers.record(paths, exc)
+                    raise
+                self.breakers.record(paths)
+                return result
 
-    async def get(self, sessionid: str) -> Client:
+            setattr(cl, name, guarded)
+
+    async def get(self, sessionid: str, fail_fast: bool = True) -> Client:
         """Get client settings
+
+        With fail_fast, sessions the health monitor knows to be expired or
+        challenged raise immediately; relogin and challenge routes opt out.
         """
-        key = parse.unquote(sessionid.strip(" \""))
-        rows = self.db.search(Query().sessionid == key)
-        if not rows:
-            raise Exception('Session not found (e.g. after reload process), please relogin')
-        settings = json.loads(rows[0]['settings'])
-        cl = self.client_factory()
-        cl.set_settings(settings)
-        await cl.get_timeline_feed()
+        key = normalize_sessionid(sessionid)
+        entry = self.cache.entry(key)
+        if fail_fast:
+            self.health.check(key, entry.client if entry is not None else None)
+        else:
+            # Relogin and challenge resolution are how a session recovers
+            self.breakers.reset("session", key)
+        if entry is not None and not self._needs_validation(entry):
+            return self._track(key, entry.client)
+        # shield: a cancelled caller must not cancel the lookup others wait on
+        return self._track(key, await asyncio.shield(self._lookup(key, entry)))
+
+    def _lookup(self, key: str, entry: Optional[CachedClient], stored: Optional[str] = None,
+                validated_at: Optional[float] = None) -> asyncio.Task:
+        """The in-flight lookup of a session, started if there is none, so concurrent callers share it
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, entry, stored, validated_at))
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self._inflight[key] = task
+        else:
+            self.coalesced_waits += 1
+        return task
+
+    def _track(self, key: str, cl: Client) -> Client:
+        """Remember a handed-out client so the next flush persists its changes
+
+        Only the cached client is tracked; one superseded while its lookup
+        was in flight must never be written back.
+        """
+        entry = self.cache.peek(key)
+        if self.flush_interval > 0 and entry is not None and entry.client is cl:
+            self._dirty[key] = cl
+        now = self.clock()
+        if now - self._used_at.get(key, float("-inf")) >= self._used_resolution():
+            self._used_at[key] = now
+            self._touch(key, last_used_at=now)
         return cl
 
-    def set(self, cl: Client) -> bool:
+    def _used_resolution(self) -> float:
+        """How stale a stored last-used time may get before a use rewrites it
+
+        Every write changes the backend (on TinyDB, the whole file) and makes
+        other workers re-check their cache, so uses are recorded coarsely;
+        a tenth of the idle TTL keeps garbage collection accurate enough.
+        """
+        if self.idle_ttl > 0:
+            return min(self.last_used_resolution, self.idle_ttl / 10)
+        return self.last_used_resolution
+
+    def _touch(self, key: str, **fields: float) -> None:
+        """Queue session timestamps for the next flush
+        """
+        self._touched.setdefault(key, {}).update(fields)
+
+    async def _load(self, key: str, entry: Optional[CachedClient], stored: Optional[str] = None,
+                    validated_at: Optional[float] = None) -> Client:
+        """Hydrate (unless cached) and validate a session, then cache its client
+
+        With `validated_at` the session is trusted as validated then and no
+        upstream call is made.
+        """
+        generation = self._generations.get(key)
+        if generation is None:
+            generation = self._generations[key] = self._next_generation()
+        cl = await self._hydrate(key, stored, generation) if entry is None else entry.client
+        if self.health.enabled or validated_at is not None:
+            # Trusted as recently validated, or the health monitor validates in the background
+            if self._generations.get(key) == generation:
+                self.cache.put(key, cl, validated_at=validated_at or self.clock())
+            return cl
+        try:
+            await cl.get_timeline_feed()
+        except Exception:
+            if self._generations.get(key) == generation:
+                self.cache.pop(key)
+            raise
+        if self._generations.get(key) == generation:
+            self.cache.put(key, cl, validated_at=self.clock())
+            self._touch(key, validated_at=self.clock())
+        return cl
+
+    def _next_generation(self) -> int:
+        self._generation += 1
+        return self._generation
+
+    def _bump(self, key: str) -> None:
+        """Supersede lookups of a session that are in flight
+        """
+        self._generations[key] = self._next_generation()
+        # Later lookups must not join a lookup of the superseded settings
+        self._inflight.pop(key, None)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so abandoned failures are not logged
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "inflight": len(self._inflight),
+            "coalesced_waits": self.coalesced_waits,
+            "dirty": len(self._dirty),
+            "flush_writes": self.flush_writes,
+            "flush_errors": self.flush_errors,
+            "flush_conflicts": self.flush_conflicts,
+            "invalidations": self.invalidations,
+            "gc_reclaimed": self.gc_reclaimed,
+        }
+
+    async def set(self, cl: Client) -> bool:
         """Set client settings
         """
-        key = parse.unquote(cl.sessionid.strip(" \""))
-        self.db.insert({'sessionid': key, 'settings': json.dumps(cl.get_settings())})
+        key = normalize_sessionid(cl.sessionid)
+        settings = self._encode(cl)
+        await self.backend.save(key, settings)
+        self._bump(key)
+        self._persisted[key] = settings_digest(settings)
+        self._dirty.pop(key, None)
+        self.cache.put(key, cl, validated_at=self.clock())
+        self._used_at[key] = self.clock()
+        self._touch(key, last_used_at=self.clock(), validated_at=self.clock())
+        if key in self.health.statuses:
+            # Fresh settings (login, relogin, resolved challenge) revive the session
+            self.health.forget(key)
+            await self.backend.update_records({key: {"status": HEALTHY}})
         return True
 
-    def close(self):
-        pass
+    async def delete(self, sessionid: str) -> bool:
+        """Forget a session and drop its cached client
+        """
+        key = normalize_sessionid(sessionid)
+        self.cache.pop(key)
+        self._forget(key)
+        return await self.backend.delete(key)
+
+    def _forget(self, key: str) -> None:
+        self._bump(key)
+        self.cache.pop(key)
+        self._dirty.pop(key, None)
+        self._persisted.pop(key, None)
+        self._touched.pop(key, None)
+        self._used_at.pop(key, None)
+        self.health.forget(key)
+
+    async def flush(self) -> int:
+        """Persist settings of used clients that changed since their last write
+
+        Each session is written at most once per flush however many requests
+        used it, and the last-used/last-validated timestamps of every touched
+        session go out in one batch. Returns the number of sessions written.
+        """
+        async with self._flush_lock:
+            touched, self._touched = self._touched, {}
+            try:
+                await self.backend.update_records(touched)
+            except Exception:
+                for key, fields in touched.items():
+                    self._touched[key] = {**fields, **self._touched.get(key, {})}
+                raise
+            dirty, self._dirty = self._dirty, {}
+            written = 0
+            try:
+                while dirty:
+                    key, cl = next(iter(dirty.items()))
+                    settings = self._encode(cl)
+                    digest = settings_digest(settings)
+                    if self._persisted.get(key) != digest:
+                        # Compare-and-set against what this worker last read or wrote, so an
+                        # older client never overwrites settings saved by another worker
+                        if await self.backend.save_if(key, settings, self._persisted.get(key)):
+                            self._persisted[key] = digest
+                            written += 1
+                        else:
+                            self._discard_stale(key)
+                    del dirty[key]
+            finally:
+                # keep whatever was not written for the next attempt
+                for key, cl in dirty.items():
+                    self._dirty.setdefault(key, cl)
+                self.flush_writes += written
+            for key in [key for key in self._persisted if key not in self.cache and key not in self._dirty]:
+                del self._persisted[key]
+            for key in [key for key in self._used_at if key not in self.cache]:
+                del self._used_at[key]
+            # Generation numbers never repeat, so a lookup whose key was dropped here
+            # finds no match and stays superseded
+            for key in [key for key in self._generations if key not in self.cache and key not in self._inflight]:
+                del self._generations[key]
+            return written
+
+    def _encode(self, cl: Client) -> Union[str, dict]:
+        """Client settings in the form the backend stores them
+        """
+        settings = cl.get_settings()
+        if self.backend.native_settings:
+            return settings
+        return encode_settings(settings, self.compress_settings)
+
+    def _discard_stale(self, key: str) -> None:
+        """Drop a client whose session was rewritten elsewhere; the next lookup reloads it
+        """
+        self._bump(key)
+        self.cache.pop(key)
+        self._persisted.pop(key, None)
+        self.flush_conflicts += 1
+
+    async def warm_up(self, limit: int, concurrency: int = 8) -> dict[str, int]:
+        """Hydrate the `limit` most recently used sessions into the client cache
+
+        Settings come from the store in one multi-get. Sessions validated
+        within `validation_ttl` (or watched by the health monitor) are trusted
+        as stored; the rest are validated, at most `concurrency` at a time.
+        Each session goes through the same single-flight lookup as `get`, so
+        requests arriving meanwhile join it; sessions already cached are kept.
+        """
+        limit = min(limit, self.cache.max_size)
+        records = await self.backend.recent(limit) if limit > 0 else []
+        stored = await self.backend.load_many([record["sessionid"] for record in records])
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        now = self.clock()
+
+        async def warm(record: dict[str, Any]) -> None:
+            key = record["sessionid"]
+            validated_at = record.get("validated_at")
+            async with semaphore:
+                if self.cache.peek(key) is not None:
+                    return
+                if self.health.enabled or (validated_at and now - validated_at <= self.validation_ttl):
+                    trusted_at = validated_at or now
+                else:
+                    trusted_at = None
+                await asyncio.shield(self._lookup(key, None, stored[key], trusted_at))
+
+        records = [record for record in records if record["sessionid"] in stored]
+        results = await asyncio.gather(*(warm(record) for record in records), return_exceptions=True)
+        failed = sum(isinstance(result, Exception) for result in results)
+        self.warmup_stats = {"sessions": len(records), "warmed": len(records) - failed, "failed": failed}
+        return self.warmup_stats
+
+    @property
+    def gc_enabled(self) -> bool:
+        return self.idle_ttl > 0 or self.dead_ttl > 0
+
+    async def collect_garbage(self) -> dict[str, int]:
+        """Delete sessions idle past `idle_ttl` or dead past `dead_ttl`, `gc_batch_size` rows at a time
+        """
+        if not self.gc_enabled:
+            return {"reclaimed": 0, "batches": 0}
+        # Store this worker's recent use first so active sessions are not collected
+        await self.flush()
+        now = self.clock()
+        idle_before = now - self.idle_ttl if self.idle_ttl > 0 else None
+        dead_before = now - self.dead_ttl if self.dead_ttl > 0 else None
+        reclaimed = batches = 0
+        while True:
+            keys = await self.backend.stale(idle_before, dead_before, self.gc_batch_size)
+            if not keys:
+                break
+            deleted = await self.backend.delete_many(keys)
+            for key in keys:
+                self._forget(key)
+            reclaimed += deleted
+            batches += 1
+            if not deleted or len(keys) < self.gc_batch_size:
+                break
+            await asyncio.sleep(0)
+        self.gc_reclaimed += reclaimed
+        return {"reclaimed": reclaimed, "batches": batches}
+
+    async def run_gc(self) -> None:
+        """Collect garbage every `gc_interval` seconds until cancelled
+        """
+        while True:
+            await asyncio.sleep(self.gc_interval)
+            with suppress(Exception):
+                await self.collect_garbage()
+
+    async def sync_changes(self) -> int:
+        """Evict cached clients whose stored settings were changed by another worker
+
+        The first call only records the current position in the change log.
+        Sessions whose stored settings match what this worker last wrote or
+        read are kept. Returns the number of clients evicted.
+        """
+        cursor, keys = await self.backend.changes(self._change_cursor)
+        first = self._change_cursor is None
+        self._change_cursor = cursor
+        if first:
+            return 0
+        if keys is None:
+            keys = [key for key in self._persisted]
+        keys = [key for key in keys if self.cache.peek(key) is not None or key in self._dirty]
+        if not keys:
+            return 0
+        stored = await self.backend.load_many(keys)
+        evicted = 0
+        for key in keys:
+            current = settings_digest(stored[key]) if key in stored else None
+            if current != self._persisted.get(key):
+                self._bump(key)
+                self.cache.pop(key)
+                self._dirty.pop(key, None)
+                self._persisted.pop(key, None)
+                evicted += 1
+        self.invalidations += evicted
+        return evicted
+
+    async def run_invalidation_watcher(self) -> None:
+        """Poll the change log every `invalidation_interval` seconds until cancelled
+        """
+        while True:
+            await asyncio.sleep(self.invalidation_interval)
+            with suppress(Exception):
+                await self.sync_changes()
+
+    async def run_flusher(self) -> None:
+        """Flush every `flush_interval` seconds until cancelled
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                self.flush_errors += 1
+
+    def invalidate(self, sessionid: str) -> None:
+        """Force validation on the next lookup of a session
+        """
+        entry = self.cache.peek(normalize_sessionid(sessionid))
+        if entry is not None:
+            entry.validated_at = None
+
+    async def session_state(self, sessionid: str) -> dict[str, Any]:
+        """Describe how a session is currently validated
+        """
+        key = normalize_sessionid(sessionid)
+        entry = self.cache.peek(key)
+        records = await self.backend.records([key])
+        record = records[0] if records else {}
+        state = {
+            "sessionid": key,
+            "stored": bool(records),
+            "cached": entry is not None,
+            "health": self.health.statuses.get(key) or record.get("status"),
+            "checked_at": record.get("checked_at"),
+            "last_used_at": self._touched.get(key, {}).get("last_used_at") or record.get("last_used_at"),
+            "validated_at": None,
+            "last_upstream_at": None,
+            "valid_until": None,
+            "needs_validation": True,
+        }
+        if entry is not None:
+            last_ok = self._last_ok(entry)
+            state.update({
+                "validated_at": entry.validated_at,
+                "last_upstream_at": getattr(entry.client, "last_response_ts", 0) or None,
+                "valid_until": last_ok + self.validation_ttl if last_ok else None,
+                "needs_validation": self._needs_validation(entry),
+            })
+        return state
+
+    async def compact(self) -> dict[str, int]:
+        """Deduplicate stored sessions and rewrite the store
+        """
+        return await self.backend.compact()
+
+    async def ping(self) -> None:
+        """Raise if the backend is unusable
+        """
+        await self.backend.ping()
+
+    async def close(self):
+        try:
+            await self.flush()
+        finally:
+            await self.transports.close()
+            await self.backend.close()
+
+    async def _hydrate(self, key: str, stored: Optional[str] = None, generation: Optional[int] = None) -> Client:
+        if stored is None:
+            stored = await self.backend.load(key)
+        if stored is None:
+            raise Exception('Session not found (e.g. after reload process), please relogin')
+        cl = self.build(stored)
+        if generation is None or self._generations.get(key) == generation:
+            self._persisted[key] = settings_digest(stored)
+        return cl
+
+    def build(self, stored: str) -> Client:
+        """Create a client from stored settings without caching it
+        """
+        cl = self.client_factory()
+        cl.set_settings(decode_settings(stored))
+        return self._configure(cl)
+
+    def _last_ok(self, entry: CachedClient) -> float:
+        """Time of the last validation or upstream call that did not fail
+        """
+        last_ok = entry.validated_at or 0
+        last_json = getattr(entry.client, "last_json", None) or {}
+        if last_json.get("status") != "fail":
+            last_ok = max(last_ok, getattr(entry.client, "last_response_ts", 0) or 0)
+        return last_ok
+
+    def _needs_validation(self, entry: CachedClient) -> bool:
+        if self.health.enabled:
+            return False
+        if entry.validated_at is None:
+            return True
+        last_json = getattr(entry.client, "last_json", None) or {}
+        if last_json.get("message") in SESSION_ERROR_MESSAGES:
+            return True
+        last_ok = self._last_ok(entry)
+        return not last_ok or self.clock() - last_ok > self.validation_ttl
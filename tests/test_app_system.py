@@ -1,3 +1,4 @@
+import asyncio
 import tomllib
 from importlib.metadata import PackageNotFoundError
 from pathlib import Path
@@ -42,8 +43,15 @@ async def test_health_reports_liveness():
     assert response.json() == {"status": "ok"}
 
 
+@pytest.fixture
+async def lifespan(monkeypatch, tmp_path):
+    monkeypatch.setenv("AIOGRAPI_REST_DB_PATH", str(tmp_path / "db.json"))
+    async with app.router.lifespan_context(app):
+        yield app.state.clients
+
+
 @pytest.mark.asyncio
-async def test_ready_checks_storage_and_dependencies():
+async def test_ready_checks_storage_and_dependencies(lifespan):
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         response = await ac.get("/ready")
     assert response.status_code == 200
@@ -55,7 +63,7 @@ async def test_ready_checks_storage_and_dependencies():
 
 
 @pytest.mark.asyncio
-async def test_ready_returns_503_when_dependency_is_missing(monkeypatch):
+async def test_ready_returns_503_when_dependency_is_missing(monkeypatch, lifespan):
     def fake_version(name):
         if name == "aiograpi":
             raise PackageNotFoundError(name)
@@ -72,12 +80,11 @@ async def test_ready_returns_503_when_dependency_is_missing(monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_ready_returns_503_when_storage_fails(monkeypatch):
-    class BrokenStorage:
-        def __init__(self):
-            raise RuntimeError("storage unavailable")
+async def test_ready_returns_503_when_storage_fails(monkeypatch, lifespan):
+    async def broken_ping():
+        raise RuntimeError("storage unavailable")
 
-    monkeypatch.setattr(main, "ClientStorage", BrokenStorage)
+    monkeypatch.setattr(lifespan, "ping", broken_ping)
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         response = await ac.get("/ready")
     assert response.status_code == 503
@@ -88,7 +95,261 @@ async def test_ready_returns_503_when_storage_fails(monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_metrics_exports_prometheus_text():
+async def test_ready_waits_for_session_warm_up(monkeypatch, tmp_path):
+    release = asyncio.Event()
+    calls = []
+
+    async def fake_warm_up(self, limit, concurrency=8):
+        calls.append((limit, concurrency))
+        await release.wait()
+        self.warmup_stats = {"sessions": 2, "warmed": 2, "failed": 0}
+        return self.warmup_stats
+
+    monkeypatch.setenv("AIOGRAPI_REST_DB_PATH", str(tmp_path / "db.json"))
+    monkeypatch.setenv("AIOGRAPI_REST_WARMUP_SESSIONS", "50")
+    monkeypatch.setenv("AIOGRAPI_REST_WARMUP_CONCURRENCY", "4")
+    monkeypatch.setattr(main.ClientStorage, "warm_up", fake_warm_up)
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            warming = await ac.get("/ready")
+            health = await ac.get("/health")
+            release.set()
+            await app.state.warmup
+            ready = await ac.get("/ready")
+
+    assert calls == [(50, 4)]
+    assert warming.status_code == 503
+    assert warming.json()["checks"]["warmup"] == {"status": "error", "detail": "warming up sessions"}
+    assert health.status_code == 200
+    assert ready.status_code == 200
+    assert ready.json()["checks"]["warmup"] == {"status": "ok", "sessions": 2, "warmed": 2, "failed": 0}
+
+
+@pytest.mark.asyncio
+async def test_ready_returns_503_before_storage_is_initialized():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["checks"]["storage"] == {"status": "error", "detail": "storage is not initialized"}
+
+
+@pytest.mark.asyncio
+async def test_lifespan_reuses_one_storage_for_all_requests(monkeypatch, tmp_path):
+    monkeypatch.setenv("AIOGRAPI_REST_DB_PATH", str(tmp_path / "db.json"))
+    created = []
+    original = main.ClientStorage
+
+    def tracking_storage(*args, **kwargs):
+        storage = original(*args, **kwargs)
+        created.append(storage)
+        return storage
+
+    monkeypatch.setattr(main, "ClientStorage", tracking_storage)
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            await ac.get("/ready")
+            await ac.get("/ready")
+            await ac.get("/metrics")
+    assert len(created) == 1
+
+
+ADMIN = {"X-Admin-Token": "secret"}
+
+
+@pytest.fixture
+def admin_token(monkeypatch):
+    monkeypatch.setenv("AIOGRAPI_REST_ADMIN_TOKEN", "secret")
+
+
+@pytest.mark.asyncio
+async def test_maintenance_routes_are_disabled_without_admin_token(monkeypatch):
+    monkeypatch.delenv("AIOGRAPI_REST_ADMIN_TOKEN", raising=False)
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        compact = await ac.post("/maintenance/compact", headers=ADMIN)
+        gc = await ac.post("/maintenance/gc")
+    assert compact.status_code == gc.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_maintenance_routes_reject_wrong_admin_token(admin_token):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        missing = await ac.post("/maintenance/gc")
+        wrong = await ac.post("/maintenance/compact", headers={"X-Admin-Token": "guess"})
+    assert missing.status_code == wrong.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_startup_compaction_is_opt_in_and_failures_do_not_abort(monkeypatch, tmp_path):
+    monkeypatch.setenv("AIOGRAPI_REST_DB_PATH", str(tmp_path / "db.json"))
+    calls = []
+
+    async def broken_compact(self):
+        calls.append(self)
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(main.ClientStorage, "compact", broken_compact)
+    async with app.router.lifespan_context(app):
+        pass
+    assert calls == []
+    monkeypatch.setenv("AIOGRAPI_REST_COMPACT_ON_STARTUP", "1")
+    async with app.router.lifespan_context(app):
+        assert app.state.clients is not None
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_maintenance_compact_dedupes_stored_sessions(lifespan, admin_token):
+    for settings in ("{}", '{"x": 1}'):
+        lifespan.backend.db.insert({"sessionid": "sid", "settings": settings})
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post("/maintenance/compact", headers=ADMIN)
+    assert response.status_code == 200
+    assert response.json() == {"before": 2, "after": 1, "removed": 1}
+    assert await lifespan.backend.load("sid") == '{"x": 1}'
+
+
+@pytest.mark.asyncio
+async def test_maintenance_compact_requires_storage(admin_token):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post("/maintenance/compact", headers=ADMIN)
+    assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_maintenance_gc_reports_reclaimed_sessions(lifespan, monkeypatch, admin_token):
+    await lifespan.backend.save("old", "{}")
+    await lifespan.backend.update_records({"old": {"last_used_at": 1.0}})
+    await lifespan.backend.save("new", "{}")
+    monkeypatch.setattr(lifespan, "idle_ttl", 3600)
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post("/maintenance/gc", headers=ADMIN)
+        metrics = await ac.get("/metrics")
+    assert response.status_code == 200
+    assert response.json() == {"reclaimed": 1, "batches": 1}
+    assert "aiograpi_rest_session_gc_reclaimed_total 1" in metrics.text
+    assert await lifespan.backend.load("old") is None
+
+
+class SlowFeedClient:
+    def __init__(self):
+        self.cancelled = False
+
+    async def get_timeline_feed(self):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return {}
+
+
+class SlowFeedStorage:
+    def __init__(self):
+        self.client = SlowFeedClient()
+
+    async def get(self, sessionid, fail_fast=True):
+        return self.client
+
+
+def test_route_class_assigns_budgets_by_path():
+    assert main.route_class("/auth/login") == "login"
+    assert main.route_class("/photo/upload/by/url") == "upload"
+    assert main.route_class("/video/download") == "upload"
+    assert main.route_class("/user/info") == "lookup"
+    assert main.route_class("/user/followers") == "list"
+    assert main.route_class("/hashtag/medias/recent") == "list"
+    assert main.LIST_PATHS <= set(main.app.openapi()["paths"])
+    assert main.route_class("/metrics") is None
+    assert main.route_class("/maintenance/gc") is None
+
+
+@pytest.mark.asyncio
+async def test_deadline_header_cancels_upstream_call_with_504(lifespan):
+    from dependencies import get_clients
+
+    storage = SlowFeedStorage()
+    app.dependency_overrides[get_clients] = lambda: storage
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.get(
+                "/auth/timeline/feed", headers={"X-Session-ID": "sid", "X-Request-Timeout": "0.05"})
+            metrics = await ac.get("/metrics")
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Request exceeded its 0.05s lookup deadline", "exc_type": "DeadlineExceeded"}
+    assert storage.client.cancelled
+    assert 'aiograpi_rest_deadline_exceeded_total{route_class="lookup"} 1' in metrics.text
+
+
+class RateLimitedFeedStorage:
+    class client:
+        @staticmethod
+        async def get_timeline_feed():
+            from storages import RateLimited
+
+            raise RateLimited("read", 12.3)
+
+    async def get(self, sessionid, fail_fast=True):
+        return self.client
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_requests_get_429_with_retry_after():
+    from dependencies import get_clients
+
+    app.dependency_overrides[get_clients] = lambda: RateLimitedFeedStorage()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.get("/auth/timeline/feed", headers={"X-Session-ID": "sid"})
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "13"
+    assert response.json()["exc_type"] == "RateLimited"
+    assert response.json()["action"] == "read"
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_answers_503_with_retry_after():
+    from dependencies import get_clients
+    from storages import CircuitOpen
+
+    class OpenCircuitStorage:
+        class client:
+            @staticmethod
+            async def get_timeline_feed():
+                raise CircuitOpen("proxy", 4.2)
+
+        async def get(self, sessionid, fail_fast=True):
+            return self.client
+
+    app.dependency_overrides[get_clients] = lambda: OpenCircuitStorage()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.get("/auth/timeline/feed", headers={"X-Session-ID": "sid"})
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert response.json()["exc_type"] == "CircuitOpen"
+    assert response.json()["scope"] == "proxy"
+
+
+def test_request_deadline_header_only_shortens_budget():
+    from starlette.datastructures import Headers
+
+    deadlines = main.RequestDeadlines({"lookup": 30.0, "upload": 0.0})
+    assert deadlines.budget("lookup", Headers({})) == 30.0
+    assert deadlines.budget("lookup", Headers({"x-request-timeout": "2.5"})) == 2.5
+    assert deadlines.budget("lookup", Headers({"x-request-timeout": "90"})) == 30.0
+    assert deadlines.budget("lookup", Headers({"x-request-timeout": "soon"})) == 30.0
+    assert deadlines.budget("upload", Headers({})) is None
+    assert deadlines.budget("upload", Headers({"x-request-timeout": "5"})) == 5.0
+
+
+@pytest.mark.asyncio
+async def test_metrics_exports_prometheus_text(lifespan):
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         response = await ac.get("/metrics")
     assert response.status_code == 200
@@ -98,6 +359,22 @@ async def test_metrics_exports_prometheus_text():
     assert f'aiograpi_rest_info{{version="{project_version()}"' in body
     assert "aiograpi_rest_uptime_seconds " in body
     assert 'aiograpi_rest_dependency_info{name="aiograpi"' in body
+    assert "aiograpi_rest_client_cache_size " in body
+    assert "aiograpi_rest_client_cache_hits_total " in body
+    assert "aiograpi_rest_client_cache_misses_total " in body
+    assert "aiograpi_rest_client_cache_evictions_total " in body
+    assert "aiograpi_rest_session_coalesced_waits_total 0" in body
+    assert "aiograpi_rest_upload_fetches_total 0" in body
+    assert "aiograpi_rest_upstream_requests_total 0" in body
+    assert 'aiograpi_rest_upstream_connections{state="idle"} 0' in body
+    assert "aiograpi_rest_upstream_connection_reuse_ratio 0.0000" in body
+    assert 'aiograpi_rest_rate_limit_queue_depth{action="like"} 0' in body
+    assert 'aiograpi_rest_circuits_open{scope="proxy"} 0' in body
+    assert "aiograpi_rest_response_cache_hit_ratio 0.0000" in body
+    assert "aiograpi_rest_response_cache_bytes 0" in body
+    assert "aiograpi_rest_response_cache_refreshing 0" in body
+    assert "aiograpi_rest_not_found_cache_entries 0" in body
+    assert "aiograpi_rest_user_index_entries 0" in body
 
 
 @pytest.mark.asyncio
@@ -197,11 +474,14 @@ async def test_openapi_uses_sessionid_authorize_button_for_protected_routes():
         "/health",
         "/ready",
         "/metrics",
+        "/maintenance/compact",
+        "/maintenance/gc",
         "/build",
         "/deps",
         "/media/id",
         "/media/pk",
         "/media/pk/from/code",
+        "/media/pk/batch",
         "/media/pk/from/url",
         "/story/pk/from/url",
     }
@@ -231,6 +511,7 @@ async def test_openapi_uses_rest_http_methods():
         "/auth/login": {"post"},
         "/auth/login/by/sessionid": {"post"},
         "/auth/relogin": {"patch"},
+        "/auth/session": {"get"},
         "/auth/settings": {"get", "patch"},
         "/auth/timeline/feed": {"get"},
         "/auth/totp": {"delete"},
@@ -264,6 +545,8 @@ async def test_openapi_uses_rest_http_methods():
         "/location/medias/recent": {"get"},
         "/location/medias/top": {"get"},
         "/location/search": {"get"},
+        "/maintenance/compact": {"post"},
+        "/maintenance/gc": {"post"},
         "/metrics": {"get"},
         "/media": {"delete", "patch"},
         "/media/archive": {"delete", "post"},
@@ -280,6 +563,7 @@ async def test_openapi_uses_rest_http_methods():
         "/media/pin": {"delete", "post"},
         "/media/pk": {"get"},
         "/media/pk/from/code": {"get"},
+        "/media/pk/batch": {"post"},
         "/media/pk/from/url": {"get"},
         "/media/save": {"delete", "post"},
         "/media/seen": {"patch"},
@@ -1,3 +1,4 @@
+import asyncio
 import json
 
 import pytest
@@ -5,6 +6,7 @@ from httpx import ASGITransport, AsyncClient
 
 from dependencies import get_clients
 from main import app
+from storages import LoginCoalescer
 
 
 class FakeClient:
@@ -55,17 +57,22 @@ class FakeStorage:
     def __init__(self):
         self.created = FakeClient()
         self.saved = []
+        self.logins = LoginCoalescer()
 
     def client(self):
         return self.created
 
-    async def get(self, sessionid):
+    async def get(self, sessionid, fail_fast=True):
+        self.fail_fast = fail_fast
         return self.created
 
-    def set(self, client):
+    async def set(self, client):
         self.saved.append(client)
         return True
 
+    async def session_state(self, sessionid):
+        return {"sessionid": sessionid, "cached": True, "needs_validation": False}
+
     def close(self):
         pass
 
@@ -190,6 +197,8 @@ async def test_relogin_awaits_aiograpi(fake_storage):
     assert response.status_code == 200
     assert response.json() is True
     assert ("relogin",) in fake_storage.created.calls
+    assert fake_storage.fail_fast is False
+    assert fake_storage.saved == [fake_storage.created]
 
 
 @pytest.mark.asyncio
@@ -223,6 +232,15 @@ async def test_settings_set_with_existing_sessionid_reuses_client(fake_storage):
     assert fake_storage.created.settings == {"x": 2}
 
 
+@pytest.mark.asyncio
+async def test_session_state_reports_validation_state(fake_storage):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/auth/session", headers={"X-Session-ID": "sid"})
+
+    assert response.status_code == 200
+    assert response.json() == {"sessionid": "sid", "cached": True, "needs_validation": False}
+
+
 @pytest.mark.asyncio
 async def test_timeline_feed_awaits_aiograpi(fake_storage):
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
@@ -230,3 +248,57 @@ async def test_timeline_feed_awaits_aiograpi(fake_storage):
 
     assert response.status_code == 200
     assert response.json() == {"feed": []}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_logins_for_same_account_share_one_upstream_login(fake_storage):
+    release = asyncio.Event()
+
+    async def slow_login(username, password, verification_code=""):
+        fake_storage.created.calls.append(("login", username, password))
+        await release.wait()
+        return True
+
+    fake_storage.created.login = slow_login
+    form = {"username": "User", "password": "p", "proxy": "http://proxy"}
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        pending = [asyncio.create_task(ac.post("/auth/login", data=form)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        release.set()
+        responses = await asyncio.gather(*pending)
+        # A retry right after the login reuses the fresh session
+        retry = await ac.post("/auth/login", data={**form, "username": "user"})
+
+    assert [response.json() for response in responses] == ["sid"] * 5
+    assert retry.json() == "sid"
+    assert fake_storage.created.calls == [("login", "User", "p")]
+    assert fake_storage.saved == [fake_storage.created]
+    assert fake_storage.logins.stats() == {"inflight": 0, "coalesced": 4, "reused": 1}
+
+
+@pytest.mark.asyncio
+async def test_login_coalescing_is_scoped_to_password_and_proxy(fake_storage):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        await ac.post("/auth/login", data={"username": "u", "password": "p"})
+        await ac.post("/auth/login", data={"username": "u", "password": "wrong"})
+        await ac.post("/auth/login", data={"username": "u", "password": "p", "proxy": "http://other"})
+
+    assert len(fake_storage.created.calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_login_is_not_reused(fake_storage):
+    results = iter([False, True])
+
+    async def flaky_login(username, password, verification_code=""):
+        fake_storage.created.calls.append(("login",))
+        return next(results)
+
+    fake_storage.created.login = flaky_login
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        first = await ac.post("/auth/login", data={"username": "u", "password": "p"})
+        second = await ac.post("/auth/login", data={"username": "u", "password": "p"})
+
+    assert first.json() is False
+    assert second.json() == "sid"
+    assert len(fake_storage.created.calls) == 2
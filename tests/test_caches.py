@@ -0,0 +1,341 @@
+import asyncio
+
+import pytest
+from aiograpi.exceptions import HashtagNotFound, MediaNotFound, UserNotFound
+from aiograpi.types import Media, UserShort
+from httpx import ASGITransport, AsyncClient
+
+from caches import (
+    NotFound,
+    NotFoundCache,
+    ResponseCache,
+    UserIndex,
+    iter_users,
+    parse_route_settings,
+    response_size,
+)
+from dependencies import get_clients, get_responses, get_user_index
+from main import app
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    def __init__(self, value=None):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.value if self.value is not None else {"call": self.calls}
+
+
+def test_parse_route_settings():
+    assert parse_route_settings("user_info=60, media_info=0,,bad") == {"user_info": 60.0, "media_info": 0.0}
+
+
+async def test_response_cache_serves_fresh_entries_until_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(max_bytes=1024, ttls={"user_info": 10}, scope="session", clock=clock, stale={})
+    loader = Loader()
+    assert await cache.fetch("user_info", {"user_id": "1"}, "sid", loader) == {"call": 1}
+    assert await cache.fetch("user_info", {"user_id": " 1 "}, "sid", loader) == {"call": 1}
+    clock.now = 11
+    assert await cache.fetch("user_info", {"user_id": "1"}, "sid", loader) == {"call": 2}
+    assert await cache.fetch("user_info", {"user_id": "1"}, "sid", loader, refresh=True) == {"call": 3}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 3, 1)
+    assert stats["hit_ratio"] == 0.25
+    assert stats["bytes"] == response_size({"call": 3})
+
+
+async def test_response_cache_scopes_entries_per_session_unless_shared():
+    loader = Loader()
+    per_session = ResponseCache(max_bytes=1024, ttls={"hashtag_info": 10}, scope="session")
+    await per_session.fetch("hashtag_info", {"name": "Python"}, "a", loader)
+    await per_session.fetch("hashtag_info", {"name": "python"}, "b", loader)
+    assert loader.calls == 2
+
+    shared = ResponseCache(max_bytes=1024, ttls={"hashtag_info": 10}, scope="shared")
+    await shared.fetch("hashtag_info", {"name": "Python"}, "a", loader)
+    await shared.fetch("hashtag_info", {"name": "python"}, "b", loader)
+    assert loader.calls == 3
+
+
+async def test_response_cache_evicts_least_recently_used_under_memory_cap():
+    size = response_size({"call": 1})
+    cache = ResponseCache(max_bytes=size * 2, ttls={"media_info": 10})
+    loader = Loader()
+    await cache.fetch("media_info", {"pk": 1}, "sid", loader)
+    await cache.fetch("media_info", {"pk": 2}, "sid", loader)
+    await cache.fetch("media_info", {"pk": 1}, "sid", loader)
+    await cache.fetch("media_info", {"pk": 3}, "sid", loader)
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= size * 2
+    await cache.fetch("media_info", {"pk": 1}, "sid", loader)
+    assert loader.calls == 3
+    await cache.fetch("media_info", {"pk": 2}, "sid", loader)
+    assert loader.calls == 4
+
+
+async def test_response_cache_skips_uncached_routes_and_oversized_values():
+    cache = ResponseCache(max_bytes=10, ttls={"user_info": 10, "media_info": 0})
+    loader = Loader()
+    await cache.fetch("media_info", {"pk": 1}, "sid", loader)
+    await cache.fetch("media_info", {"pk": 1}, "sid", loader)
+    big = Loader({"payload": "x" * 100})
+    await cache.fetch("user_info", {"user_id": 1}, "sid", big)
+    await cache.fetch("user_info", {"user_id": 1}, "sid", big)
+    assert (loader.calls, big.calls) == (2, 2)
+    assert len(cache) == 0
+
+
+class SlowLoader(Loader):
+    def __init__(self, fail=False):
+        super().__init__()
+        self.fail = fail
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return {"call": self.calls}
+
+
+async def test_response_cache_serves_stale_entries_while_one_refresh_runs():
+    clock = FakeClock()
+    cache = ResponseCache(max_bytes=1024, ttls={"user_info": 10}, stale={"user_info": 20}, clock=clock)
+    assert await cache.fetch("user_info", {"user_id": "1"}, "sid", Loader()) == {"call": 1}
+    clock.now = 15
+    refresh = SlowLoader()
+    assert await cache.fetch("user_info", {"user_id": "1"}, "sid", refresh) == {"call": 1}
+    assert await cache.fetch("user_info", {"user_id": "1"}, "sid", refresh) == {"call": 1}
+    await asyncio.sleep(0)
+    assert refresh.calls == 1
+    assert cache.stats()["refreshing"] == 1
+    refresh.release.set()
+    await asyncio.sleep(0)
+    assert await cache.fetch("user_info", {"user_id": "1"}, "sid", refresh) == {"call": 1}
+    stats = cache.stats()
+    assert (stats["hits"], stats["stale_hits"], stats["refreshes"], stats["refreshing"]) == (1, 2, 1, 0)
+    clock.now = 100
+    assert await cache.fetch("user_info", {"user_id": "1"}, "sid", Loader({"fresh": True})) == {"fresh": True}
+
+
+async def test_response_cache_caps_refreshes_and_keeps_stale_entry_on_errors():
+    clock = FakeClock()
+    cache = ResponseCache(max_bytes=1024, ttls={"media_info": 10}, stale={"media_info": 20}, clock=clock,
+                          max_refreshes=1)
+    await cache.fetch("media_info", {"pk": 1}, "sid", Loader())
+    await cache.fetch("media_info", {"pk": 2}, "sid", Loader())
+    clock.now = 15
+    failing = SlowLoader(fail=True)
+    other = SlowLoader()
+    assert await cache.fetch("media_info", {"pk": 1}, "sid", failing) == {"call": 1}
+    assert await cache.fetch("media_info", {"pk": 2}, "sid", other) == {"call": 1}
+    await asyncio.sleep(0)
+    assert (failing.calls, other.calls) == (1, 0)
+    failing.release.set()
+    await asyncio.sleep(0)
+    assert cache.stats()["refresh_errors"] == 1
+    assert await cache.fetch("media_info", {"pk": 1}, "sid", Loader()) == {"call": 1}
+    await cache.close()
+    assert cache.stats()["refreshing"] == 0
+
+
+class Missing(Loader):
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        raise self.error
+
+
+async def test_not_found_answers_are_cached_for_their_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(max_bytes=1024, ttls={}, clock=clock,
+                          not_found=NotFoundCache(max_entries=10, ttls={"user_id_from_username": 60}, clock=clock))
+    loader = Missing(UserNotFound("gone"))
+    with pytest.raises(NotFound) as first:
+        await cache.fetch("user_id_from_username", {"username": "Ghost"}, "sid", loader)
+    with pytest.raises(NotFound) as second:
+        await cache.fetch("user_id_from_username", {"username": "ghost"}, "sid", loader)
+    assert (first.value.exc_type, first.value.cached) == ("UserNotFound", False)
+    assert (second.value.exc_type, second.value.cached, str(second.value)) == ("UserNotFound", True, "gone")
+    assert loader.calls == 1
+    clock.now = 61
+    with pytest.raises(NotFound):
+        await cache.fetch("user_id_from_username", {"username": "ghost"}, "sid", loader)
+    assert loader.calls == 2
+    assert cache.not_found.stats()["hits"] == 1
+
+
+async def test_not_found_cache_is_capped_and_skipped_by_refresh():
+    cache = ResponseCache(max_bytes=1024, ttls={"media_info": 10},
+                          not_found=NotFoundCache(max_entries=1, ttls={"media_info": 60}))
+    for pk in (1, 2):
+        with pytest.raises(NotFound):
+            await cache.fetch("media_info", {"pk": pk}, "sid", Missing(MediaNotFound("deleted")))
+    assert cache.not_found.stats()["evictions"] == 1
+    assert len(cache.not_found) == 1
+    assert await cache.fetch("media_info", {"pk": 2}, "sid", Loader(), refresh=True) == {"call": 1}
+    assert len(cache.not_found) == 0
+
+
+async def test_stale_refresh_that_finds_nothing_drops_the_entry():
+    clock = FakeClock()
+    cache = ResponseCache(max_bytes=1024, ttls={"media_info": 10}, stale={"media_info": 20}, clock=clock,
+                          not_found=NotFoundCache(max_entries=10, ttls={"media_info": 60}, clock=clock))
+    await cache.fetch("media_info", {"pk": 1}, "sid", Loader())
+    clock.now = 15
+    assert await cache.fetch("media_info", {"pk": 1}, "sid", Missing(MediaNotFound("deleted"))) == {"call": 1}
+    await asyncio.sleep(0)
+    assert len(cache) == 0
+    with pytest.raises(NotFound):
+        await cache.fetch("media_info", {"pk": 1}, "sid", Loader())
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    async def hashtag_info(self, name):
+        self.calls.append(("hashtag_info", name))
+        if name == "banned":
+            raise HashtagNotFound("Hashtag not found")
+        return {"id": "1", "name": name, "media_count": 1}
+
+
+class FakeStorage:
+    def __init__(self):
+        self.client = FakeClient()
+
+    async def get(self, sessionid, fail_fast=True):
+        return self.client
+
+
+@pytest.mark.asyncio
+async def test_lookup_route_reads_through_response_cache():
+    storage = FakeStorage()
+    cache = ResponseCache(max_bytes=1024, ttls={"hashtag_info": 60})
+    app.dependency_overrides[get_clients] = lambda: storage
+    app.dependency_overrides[get_responses] = lambda: cache
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            first = await ac.get("/hashtag/info", params={"name": "python"}, headers={"X-Session-ID": "sid"})
+            second = await ac.get("/hashtag/info", params={"name": "Python"}, headers={"X-Session-ID": "sid"})
+    finally:
+        app.dependency_overrides.clear()
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert storage.client.calls == [("hashtag_info", "python")]
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lookup_route_answers_cached_not_found_with_404():
+    storage = FakeStorage()
+    cache = ResponseCache(max_bytes=1024, ttls={}, not_found=NotFoundCache(max_entries=10, ttls={"hashtag_info": 60}))
+    app.dependency_overrides[get_clients] = lambda: storage
+    app.dependency_overrides[get_responses] = lambda: cache
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            first = await ac.get("/hashtag/info", params={"name": "banned"}, headers={"X-Session-ID": "sid"})
+            second = await ac.get("/hashtag/info", params={"name": "banned"}, headers={"X-Session-ID": "sid"})
+    finally:
+        app.dependency_overrides.clear()
+    assert first.status_code == second.status_code == 404
+    assert first.json() == {"detail": "Hashtag not found", "exc_type": "HashtagNotFound", "cached": False}
+    assert second.json()["cached"] is True
+    assert storage.client.calls == [("hashtag_info", "banned")]
+
+
+def test_iter_users_finds_nested_users():
+    owner = UserShort(pk="1", username="owner")
+    media = Media.model_construct(pk="10", user=owner, usertags=[])
+    followers = {"2": UserShort(pk="2", username="fan")}
+    assert [user.pk for user in iter_users([media, followers, None, "text"])] == ["1", "2"]
+
+
+async def test_user_index_answers_both_directions_and_persists(tmp_path):
+    path = str(tmp_path / "users.db")
+    index = UserIndex(path=path, max_entries=10, max_age=60)
+    index.observe([UserShort(pk="1", username="Alice"), UserShort(pk="2", username=None)])
+    assert await index.user_id(" alice ") == "1"
+    assert await index.username(1) == "alice"
+    assert await index.username(2) is None
+    await index.close()
+
+    reopened = UserIndex(path=path, max_entries=10, max_age=60)
+    assert len(reopened) == 0
+    assert await reopened.user_id("alice") == "1"
+    assert len(reopened) == 1
+    stats = reopened.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 0)
+    await reopened.close()
+
+
+async def test_user_index_follows_renames_and_expires_old_mappings(tmp_path):
+    clock = FakeClock()
+    clock.now = 1000.0
+    index = UserIndex(path=str(tmp_path / "users.db"), max_entries=2, max_age=60, clock=clock)
+    index.record(1, "alice")
+    clock.now += 400
+    index.record(1, "alice_new")
+    index.record(2, "alice")
+    assert await index.user_id("alice") == "2"
+    assert await index.username(1) == "alice_new"
+    assert await index.user_id("alice_new", max_age=1000) == "1"
+    clock.now += 120
+    assert await index.user_id("alice") is None
+    assert await index.user_id("alice", max_age=600) == "2"
+    index.record(3, "carol")
+    assert len(index) == 2
+    await index.close()
+
+
+class FakeUserClient:
+    def __init__(self):
+        self.calls = []
+
+    async def user_followers(self, user_id, amount=0):
+        self.calls.append("user_followers")
+        return {"5": UserShort(pk="5", username="follower")}
+
+    async def user_id_from_username(self, username):
+        self.calls.append("user_id_from_username")
+        return "7"
+
+
+@pytest.mark.asyncio
+async def test_routes_feed_the_username_index(tmp_path):
+    storage = FakeStorage()
+    storage.client = FakeUserClient()
+    index = UserIndex(path=str(tmp_path / "users.db"), max_entries=10)
+    app.dependency_overrides[get_clients] = lambda: storage
+    app.dependency_overrides[get_user_index] = lambda: index
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            headers = {"X-Session-ID": "sid"}
+            followers = await ac.get("/user/followers", params={"user_id": "1"}, headers=headers)
+            by_index = await ac.get("/user/id/from/username", params={"username": "Follower"}, headers=headers)
+            upstream = await ac.get("/user/id/from/username", params={"username": "other"}, headers=headers)
+            cached = await ac.get("/user/username/from/id", params={"user_id": 7}, headers=headers)
+    finally:
+        app.dependency_overrides.clear()
+        await index.close()
+    assert followers.status_code == 200
+    assert by_index.json() == 5
+    assert upstream.json() == 7
+    assert cached.json() == "other"
+    assert storage.client.calls == ["user_followers", "user_id_from_username"]
@@ -362,9 +362,12 @@ class FakeStorage:
     def __init__(self):
         self.client = FakeExpandedClient()
 
-    async def get(self, sessionid):
+    async def get(self, sessionid, fail_fast=True):
         return self.client
 
+    async def set(self, client):
+        return True
+
     def close(self):
         pass
 
@@ -1,11 +1,13 @@
 from pathlib import Path
 
 import pytest
+from aiograpi import Client
 from httpx import ASGITransport, AsyncClient
 
 import routers.media as media_router
 import routers.story as story_router
 from dependencies import get_clients
+from helpers import pk_to_shortcode, shortcode_to_pk
 from main import app
 
 
@@ -175,6 +177,67 @@ async def test_media_pk_uses_aiograpi_helper():
     assert response.json() == "2110901750722920960"
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("media_id", ["abc", "123_456_789", ""])
+async def test_media_pk_rejects_malformed_media_ids(media_id):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/media/pk", params={"media_id": media_id})
+    assert response.status_code == 422
+    assert "media_id must look like" in response.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_media_pk_from_code_rejects_malformed_codes():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/media/pk/from/code", params={"code": "B1Lb!VPlwIA"})
+    assert response.status_code == 422
+    assert response.json()["detail"]
+
+
+@pytest.mark.parametrize("code", ["B1LbfVPlwIA", "B-fKL9qpeab", "CCQQsCXjOaBfS3I2PpqsNkxElV9DXj61vzo5xs0"])
+def test_shortcode_conversions_match_aiograpi_client(code):
+    pk = shortcode_to_pk(code)
+    assert pk == Client().media_pk_from_code(code)
+    assert pk_to_shortcode(pk) == code[:11]
+    with pytest.raises(ValueError):
+        shortcode_to_pk("B1Lb!")
+
+
+@pytest.mark.asyncio
+async def test_media_pk_batch_converts_codes_ids_and_pks():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post("/media/pk/batch", json={
+            "codes": ["B1LbfVPlwIA", "bad!", "B1LbfVPlwIA"],
+            "media_ids": ["2278584739065882267_1903424587", "2278584739065882267"],
+        })
+    assert response.status_code == 200
+    assert response.json() == {
+        "codes": ["2110901750722920960", None, "2110901750722920960"],
+        "media_ids": ["2278584739065882267", "2278584739065882267"],
+        "pks": [],
+    }
+
+
+@pytest.mark.asyncio
+async def test_media_pk_batch_accepts_more_values_than_a_form_allows():
+    pks = [str(2110901750722920960 + n) for n in range(1500)]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post("/media/pk/batch", json={"pks": pks})
+    assert response.status_code == 200
+    codes = response.json()["pks"]
+    assert len(codes) == 1500
+    assert codes[0] == "B1LbfVPlwIA"
+    assert [shortcode_to_pk(code) for code in codes] == pks
+
+
+@pytest.mark.asyncio
+async def test_media_pk_batch_rejects_oversized_batches(monkeypatch):
+    monkeypatch.setattr(media_router, "MEDIA_BATCH_MAX_ITEMS", 1)
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post("/media/pk/batch", json={"codes": ["B1LbfVPlwIA", "B-fKL9qpeab"]})
+    assert response.status_code == 413
+
+
 @pytest.mark.asyncio
 async def test_media_pk_from_url_uses_aiograpi_helper():
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
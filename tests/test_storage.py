@@ -1,8 +1,19 @@
+import asyncio
 import json
+import time
 
 import pytest
 
-from storages import ClientStorage
+from storages import (
+    ClientCache,
+    ClientStorage,
+    RedisBackend,
+    SQLiteBackend,
+    TinyDBBackend,
+    create_backend,
+    decode_settings,
+    encode_settings,
+)
 
 
 class FakeClient:
@@ -26,7 +37,7 @@ class FakeClient:
 @pytest.mark.asyncio
 async def test_get_restores_settings_and_validates_timeline(tmp_path, monkeypatch):
     storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient)
-    storage.db.insert({"sessionid": "sid", "settings": json.dumps({"x": 1})})
+    storage.backend.db.insert({"sessionid": "sid", "settings": json.dumps({"x": 1})})
 
     client = await storage.get("sid")
 
@@ -34,12 +45,13 @@ async def test_get_restores_settings_and_validates_timeline(tmp_path, monkeypatc
     assert client.timeline_called is True
 
 
-def test_set_persists_client_settings(tmp_path):
+@pytest.mark.asyncio
+async def test_set_persists_client_settings(tmp_path):
     storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient)
-    assert storage.set(FakeClient()) is True
-    row = storage.db.all()[0]
+    assert await storage.set(FakeClient()) is True
+    row = storage.backend.db.all()[0]
     assert row["sessionid"] == "sid"
-    assert json.loads(row["settings"]) == {"authorization_data": {"sessionid": "sid"}}
+    assert row["settings"] == {"authorization_data": {"sessionid": "sid"}}
 
 
 def test_storage_path_can_come_from_environment(tmp_path, monkeypatch):
@@ -47,7 +59,7 @@ def test_storage_path_can_come_from_environment(tmp_path, monkeypatch):
     monkeypatch.setenv("AIOGRAPI_REST_DB_PATH", str(db_path))
 
     storage = ClientStorage(client_factory=FakeClient)
-    storage.db.insert({"sessionid": "sid", "settings": "{}"})
+    storage.backend.db.insert({"sessionid": "sid", "settings": "{}"})
 
     assert db_path.exists()
 
@@ -66,22 +78,1562 @@ def test_client_factory_produces_configured_client(tmp_path):
     assert cl.request_timeout == 0.1
 
 
-def test_close_is_a_no_op(tmp_path):
+@pytest.mark.asyncio
+async def test_close_flushes_tinydb_file(tmp_path):
     storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient)
-    assert storage.close() is None
+    await storage.set(FakeClient())
+    assert await storage.close() is None
+
+    reopened = TinyDBBackend(tmp_path / "db.json")
+    assert await reopened.load("sid") == {"authorization_data": {"sessionid": "sid"}}
+    await reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_tinydb_backend_sees_writes_from_other_processes(tmp_path):
+    backend = TinyDBBackend(tmp_path / "db.json")
+    assert await backend.load("sid") is None
+
+    other = TinyDBBackend(tmp_path / "db.json")
+    await other.save("sid", "{}")
+    await other.close()
 
+    assert await backend.load("sid") == "{}"
+    await backend.close()
 
-def test_get_clients_dependency_yields_storage(monkeypatch, tmp_path):
+
+@pytest.mark.asyncio
+async def test_get_clients_dependency_returns_app_storage(monkeypatch, tmp_path):
     import storages
     from dependencies import get_clients
+    from main import app
 
-    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AIOGRAPI_REST_DB_PATH", str(tmp_path / "db.json"))
     monkeypatch.setattr(storages, "Client", FakeClient)
 
-    gen = get_clients()
-    storage = next(gen)
-    try:
+    async with app.router.lifespan_context(app):
+        storage = app.state.clients
+        request = type("FakeRequest", (), {"app": app})()
         assert isinstance(storage, storages.ClientStorage)
+        assert get_clients(request) is storage
+    assert app.state.clients is None
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_get_reuses_cached_client_without_rehydrating(tmp_path):
+    cache = ClientCache()
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient, cache=cache)
+    storage.backend.db.insert({"sessionid": "sid", "settings": json.dumps({"x": 1})})
+
+    first = await storage.get("sid")
+    storage.backend.db.truncate()
+    second = await storage.get(" \"sid\"")
+
+    assert second is first
+    assert cache.stats() == {"size": 1, "max_size": 1000, "hits": 1, "misses": 1, "evictions": 0}
+
+
+@pytest.mark.asyncio
+async def test_get_drops_cached_client_when_validation_fails(tmp_path):
+    class ExpiredClient(FakeClient):
+        async def get_timeline_feed(self):
+            raise RuntimeError("login_required")
+
+    cache = ClientCache()
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=ExpiredClient, cache=cache)
+    storage.backend.db.insert({"sessionid": "sid", "settings": "{}"})
+
+    with pytest.raises(RuntimeError, match="login_required"):
+        await storage.get("sid")
+    assert "sid" not in cache
+
+
+@pytest.mark.asyncio
+async def test_set_warms_client_cache(tmp_path):
+    cache = ClientCache()
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient, cache=cache)
+    cl = FakeClient()
+
+    await storage.set(cl)
+
+    assert cache.get("sid") is cl
+
+
+def test_client_cache_evicts_least_recently_used_entries():
+    cache = ClientCache(max_size=2)
+    cache.put("a", "client-a")
+    cache.put("b", "client-b")
+    assert cache.get("a") == "client-a"
+
+    cache.put("c", "client-c")
+
+    assert "b" not in cache
+    assert cache.get("a") == "client-a"
+    assert cache.get("c") == "client-c"
+    assert cache.evictions == 1
+
+
+def test_client_cache_expires_idle_entries():
+    clock = FakeClock()
+    cache = ClientCache(ttl=10, clock=clock)
+    cache.put("a", "client-a")
+    cache.put("b", "client-b")
+
+    clock.now = 5
+    assert cache.get("b") == "client-b"
+    clock.now = 12
+
+    assert cache.evict() == 1
+    assert "a" not in cache
+    assert cache.get("b") == "client-b"
+    clock.now = 30
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_client_cache_can_be_disabled():
+    cache = ClientCache(max_size=0)
+    cache.put("a", "client-a")
+    assert len(cache) == 0
+    assert cache.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_get_skips_validation_within_trust_window(tmp_path):
+    clock = FakeClock()
+    clock.now = 1000.0
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=FakeClient, cache=ClientCache(), validation_ttl=60, clock=clock,
+    )
+    storage.backend.db.insert({"sessionid": "sid", "settings": "{}"})
+
+    client = await storage.get("sid")
+    client.timeline_called = False
+    clock.now = 1050.0
+    await storage.get("sid")
+    assert client.timeline_called is False
+
+    clock.now = 1061.0
+    await storage.get("sid")
+    assert client.timeline_called is True
+
+
+@pytest.mark.asyncio
+async def test_successful_upstream_calls_extend_trust_window(tmp_path):
+    clock = FakeClock()
+    clock.now = 1000.0
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=FakeClient, cache=ClientCache(), validation_ttl=60, clock=clock,
+    )
+    storage.backend.db.insert({"sessionid": "sid", "settings": "{}"})
+
+    client = await storage.get("sid")
+    client.timeline_called = False
+    client.last_response_ts = 1040.0
+    client.last_json = {"status": "ok"}
+    clock.now = 1090.0
+    await storage.get("sid")
+
+    assert client.timeline_called is False
+    assert (await storage.session_state("sid"))["valid_until"] == 1100.0
+
+
+@pytest.mark.asyncio
+async def test_login_required_response_forces_revalidation(tmp_path):
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=FakeClient, cache=ClientCache(), validation_ttl=60,
+    )
+    storage.backend.db.insert({"sessionid": "sid", "settings": "{}"})
+
+    client = await storage.get("sid")
+    client.timeline_called = False
+    client.last_json = {"status": "fail", "message": "login_required"}
+    assert (await storage.session_state("sid"))["needs_validation"] is True
+
+    await storage.get("sid")
+    assert client.timeline_called is True
+
+
+@pytest.mark.asyncio
+async def test_invalidate_forces_revalidation(tmp_path):
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=FakeClient, cache=ClientCache(), validation_ttl=60,
+    )
+    storage.backend.db.insert({"sessionid": "sid", "settings": "{}"})
+    client = await storage.get("sid")
+    client.timeline_called = False
+
+    storage.invalidate("sid")
+    await storage.get("sid")
+
+    assert client.timeline_called is True
+
+
+@pytest.mark.asyncio
+async def test_session_state_for_unknown_session(tmp_path):
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient, cache=ClientCache())
+    assert await storage.session_state("missing") == {
+        "sessionid": "missing",
+        "stored": False,
+        "cached": False,
+        "health": None,
+        "checked_at": None,
+        "last_used_at": None,
+        "validated_at": None,
+        "last_upstream_at": None,
+        "valid_until": None,
+        "needs_validation": True,
+    }
+
+
+@pytest.mark.asyncio
+async def test_backend_is_chosen_from_db_path_suffix(tmp_path):
+    tinydb = create_backend(tmp_path / "db.json")
+    sqlite = create_backend(tmp_path / "sessions.sqlite3")
+    try:
+        assert isinstance(tinydb, TinyDBBackend)
+        assert isinstance(sqlite, SQLiteBackend)
+    finally:
+        await tinydb.close()
+        await sqlite.close()
+
+
+@pytest.mark.asyncio
+async def test_backend_can_be_forced_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("AIOGRAPI_REST_STORAGE", "sqlite")
+    backend = create_backend(tmp_path / "sessions")
+    try:
+        assert isinstance(backend, SQLiteBackend)
     finally:
-        with pytest.raises(StopIteration):
-            next(gen)
+        await backend.close()
+
+    monkeypatch.setenv("AIOGRAPI_REST_STORAGE", "mongo")
+    with pytest.raises(ValueError, match="Unknown storage backend"):
+        create_backend(tmp_path / "sessions")
+
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_round_trips_sessions(tmp_path):
+    storage = ClientStorage(db_path=tmp_path / "db.sqlite3", client_factory=FakeClient, cache=ClientCache())
+    await storage.set(FakeClient())
+    storage.cache.clear()
+
+    client = await storage.get("sid")
+
+    assert client.settings == {"authorization_data": {"sessionid": "sid"}}
+    assert storage.backend.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_upserts_by_primary_key(tmp_path):
+    backend = SQLiteBackend(tmp_path / "db.sqlite3")
+    await backend.save("sid", "{}")
+    await backend.save("sid", '{"x": 1}')
+
+    assert backend.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 1
+    assert await backend.load("sid") == '{"x": 1}'
+    assert await backend.load("missing") is None
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_migrates_tinydb_file_once(tmp_path):
+    source = TinyDBBackend(tmp_path / "db.json")
+    await source.save("a", '{"v": 1}')
+    await source.save("a", '{"v": 2}')
+    await source.save("b", '{"v": 3}')
+    await source.save("c", {"v": 5})
+    await source.close()
+
+    backend = SQLiteBackend(tmp_path / "db.sqlite3", migrate_from=tmp_path / "db.json")
+    assert await backend.load("a") == '{"v": 2}'
+    assert await backend.load("b") == '{"v": 3}'
+    assert await backend.load("c") == '{"v":5}'
+    await backend.save("a", '{"v": 4}')
+
+    assert backend.migrate_tinydb(tmp_path / "db.json") == 0
+    assert await backend.load("a") == '{"v": 4}'
+    assert backend.migrate_tinydb(tmp_path / "missing.json") == 0
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_tinydb_set_upserts_existing_session(tmp_path):
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient, cache=ClientCache())
+    client = FakeClient()
+    await storage.set(client)
+    client.sessionid = "sid"
+    client.get_settings = lambda: {"fresh": True}
+    await storage.set(client)
+
+    rows = storage.backend.db.all()
+    assert len(rows) == 1
+    assert rows[0]["settings"] == {"fresh": True}
+
+
+@pytest.mark.asyncio
+async def test_tinydb_compact_keeps_newest_row_per_session(tmp_path):
+    backend = TinyDBBackend(tmp_path / "db.json")
+    backend.db.insert({"sessionid": "a", "settings": "old"})
+    backend.db.insert({"sessionid": "b", "settings": "only"})
+    backend.db.insert({"sessionid": "a", "settings": "new"})
+
+    assert await backend.compact() == {"before": 3, "after": 2, "removed": 1}
+    assert await backend.load("a") == "new"
+    assert await backend.load("b") == "only"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["db.json"]
+    await backend.close()
+
+    reopened = TinyDBBackend(tmp_path / "db.json")
+    assert len(reopened.db) == 2
+    await reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_compact_reports_live_rows(tmp_path):
+    backend = SQLiteBackend(tmp_path / "db.sqlite3")
+    await backend.save("a", "{}")
+    assert await backend.compact() == {"before": 1, "after": 1, "removed": 0}
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_backend_io_runs_off_the_event_loop_thread(tmp_path):
+    import threading
+
+    threads = []
+
+    class RecordingBackend(TinyDBBackend):
+        def _save(self, key, settings):
+            threads.append(threading.current_thread().name)
+            super()._save(key, settings)
+
+    backend = RecordingBackend(tmp_path / "db.json")
+    await backend.save("sid", "{}")
+    assert await backend.delete("sid") is True
+    assert await backend.delete("sid") is False
+    await backend.close()
+
+    assert threads[0].startswith("aiograpi-rest-storage")
+    assert threads[0] != threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_share_one_hydration(tmp_path):
+    calls = {"load": 0, "timeline": 0}
+    release = asyncio.Event()
+
+    class SlowClient(FakeClient):
+        async def get_timeline_feed(self):
+            calls["timeline"] += 1
+            await release.wait()
+            return {"ok": True}
+
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=SlowClient, cache=ClientCache())
+    await storage.backend.save("sid", "{}")
+    load = storage.backend.load
+
+    async def counting_load(key):
+        calls["load"] += 1
+        return await load(key)
+
+    storage.backend.load = counting_load
+    lookups = [asyncio.create_task(storage.get("sid")) for _ in range(30)]
+    await asyncio.sleep(0.05)
+    assert storage.stats()["inflight"] == 1
+    assert storage.stats()["coalesced_waits"] == 29
+    release.set()
+    clients = await asyncio.gather(*lookups)
+
+    assert all(cl is clients[0] for cl in clients)
+    assert calls == {"load": 1, "timeline": 1}
+    assert storage.stats()["inflight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_share_hydration_failure(tmp_path):
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient, cache=ClientCache())
+    results = await asyncio.gather(*(storage.get("missing") for _ in range(3)), return_exceptions=True)
+
+    assert all("Session not found" in str(result) for result in results)
+    assert storage.stats()["inflight"] == 0
+    assert storage.stats()["coalesced_waits"] == 2
+    with pytest.raises(Exception, match="Session not found"):
+        await storage.get("missing")
+
+
+@pytest.mark.asyncio
+async def test_cancelled_lookup_does_not_cancel_shared_hydration(tmp_path):
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient, cache=ClientCache())
+    await storage.backend.save("sid", "{}")
+
+    first = asyncio.create_task(storage.get("sid"))
+    second = asyncio.create_task(storage.get("sid"))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert isinstance(await second, FakeClient)
+    assert first.cancelled()
+
+
+class MutableClient(FakeClient):
+    def set_settings(self, settings):
+        self.settings = dict(settings)
+        return True
+
+    def get_settings(self):
+        return self.settings
+
+
+@pytest.mark.asyncio
+async def test_set_during_inflight_lookup_is_not_reverted(tmp_path):
+    release = asyncio.Event()
+
+    class SlowClient(MutableClient):
+        async def get_timeline_feed(self):
+            await release.wait()
+            return {"ok": True}
+
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=SlowClient, cache=ClientCache(),
+        validation_ttl=0, flush_interval=5,
+    )
+    await storage.backend.save("sid", encode_settings({"v": "old"}))
+    lookup = asyncio.ensure_future(storage.get("sid"))
+    await asyncio.sleep(0.05)
+
+    fresh = SlowClient()
+    fresh.settings = {"v": "new"}
+    await storage.set(fresh)
+    release.set()
+    stale = await lookup
+    assert stale.settings == {"v": "old"}
+
+    await storage.flush()
+    assert storage.cache.peek("sid").client is fresh
+    assert decode_settings(await storage.backend.load("sid")) == {"v": "new"}
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_each_changed_session_once(tmp_path):
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=MutableClient, cache=ClientCache(), flush_interval=5,
+    )
+    await storage.backend.save("hot", encode_settings({"n": 0}))
+    await storage.backend.save("idle", encode_settings({"n": 0}))
+    saves = []
+    save_if = storage.backend.save_if
+
+    async def counting_save(key, settings, expected):
+        saves.append(key)
+        return await save_if(key, settings, expected)
+
+    storage.backend.save_if = counting_save
+    for n in range(1, 20):
+        cl = await storage.get("hot")
+        cl.settings["n"] = n
+    await storage.get("idle")
+
+    assert storage.stats()["dirty"] == 2
+    assert await storage.flush() == 1
+    assert saves == ["hot"]
+    assert decode_settings(await storage.backend.load("hot")) == {"n": 19}
+    assert await storage.flush() == 0
+    assert storage.stats()["flush_writes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_flush_keeps_sessions_dirty_when_backend_fails(tmp_path):
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=MutableClient, cache=ClientCache(), flush_interval=5,
+    )
+    await storage.backend.save("sid", "{}")
+    cl = await storage.get("sid")
+    cl.settings["cookie"] = "fresh"
+    save_if = storage.backend.save_if
+
+    async def broken_save(key, settings, expected):
+        raise RuntimeError("disk full")
+
+    storage.backend.save_if = broken_save
+    with pytest.raises(RuntimeError, match="disk full"):
+        await storage.flush()
+    assert storage.stats()["dirty"] == 1
+
+    storage.backend.save_if = save_if
+    await storage.close()
+    reopened = TinyDBBackend(tmp_path / "db.json")
+    assert decode_settings(await reopened.load("sid")) == {"cookie": "fresh"}
+    await reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_deleted_session_is_not_written_back(tmp_path):
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=MutableClient, cache=ClientCache(), flush_interval=5,
+    )
+    await storage.backend.save("sid", "{}")
+    cl = await storage.get("sid")
+    cl.settings["x"] = 1
+    await storage.delete("sid")
+
+    assert await storage.flush() == 0
+    assert await storage.backend.load("sid") is None
+
+
+@pytest.mark.asyncio
+async def test_write_behind_can_be_disabled(tmp_path):
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=MutableClient, cache=ClientCache(), flush_interval=0,
+    )
+    await storage.backend.save("sid", "{}")
+    cl = await storage.get("sid")
+    cl.settings["x"] = 1
+
+    assert storage.stats()["dirty"] == 0
+    assert await storage.flush() == 0
+
+
+@pytest.mark.asyncio
+async def test_lifespan_flushes_used_sessions_periodically_and_on_shutdown(monkeypatch, tmp_path):
+    from main import app
+
+    monkeypatch.setenv("AIOGRAPI_REST_DB_PATH", str(tmp_path / "db.json"))
+    monkeypatch.setenv("AIOGRAPI_REST_FLUSH_INTERVAL", "0.01")
+
+    async with app.router.lifespan_context(app):
+        storage = app.state.clients
+        storage.client_factory = MutableClient
+        await storage.backend.save("sid", "{}")
+        cl = await storage.get("sid")
+        cl.settings["n"] = 1
+        for _ in range(100):
+            if storage.stats()["flush_writes"]:
+                break
+            await asyncio.sleep(0.01)
+        assert decode_settings(await storage.backend.load("sid")) == {"n": 1}
+        cl = await storage.get("sid")
+        cl.settings["n"] = 2
+
+    reopened = TinyDBBackend(tmp_path / "db.json")
+    assert decode_settings(await reopened.load("sid")) == {"n": 2}
+    await reopened.close()
+
+
+class FakeRedis:
+    """In-process stand-in for the redis.asyncio commands RedisBackend uses"""
+
+    def __init__(self):
+        self.strings = {}
+        self.zsets = {}
+        self.stream = []
+        self.hashes = {}
+        self.calls = []
+        self.closed = False
+
+    async def get(self, key):
+        self.calls.append("get")
+        return self.strings.get(key)
+
+    async def zrange(self, key, start, end):
+        self.calls.append("zrange")
+        members = sorted(self.zsets.get(key, {}).items(), key=lambda item: item[1])
+        return [member for member, _ in members]
+
+    async def zrem(self, key, *members):
+        self.calls.append("zrem")
+        zset = self.zsets.get(key, {})
+        return sum(zset.pop(member, None) is not None for member in members)
+
+    async def xrange(self, key, start, end, count=None):
+        self.calls.append("xrange")
+        if start == "-":
+            entries = self.stream
+        else:
+            after = int(start.lstrip("(").split("-")[0])
+            entries = [entry for entry in self.stream if int(entry[0].split("-")[0]) > after]
+        return entries[:count]
+
+    async def xrevrange(self, key, end, start, count=None):
+        return list(reversed(self.stream))[:count]
+
+    async def zscore(self, key, member):
+        return self.zsets.get(key, {}).get(member)
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        self.hashes.setdefault(key, {}).update(mapping or {field: value})
+
+    async def ping(self):
+        return True
+
+    async def aclose(self):
+        self.closed = True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+        self.watching = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.commands = []
+
+    async def watch(self, *keys):
+        self.watching = True
+
+    async def unwatch(self):
+        self.watching = False
+
+    def multi(self):
+        self.watching = False
+
+    def get(self, key):
+        # After WATCH, redis-py pipelines run commands immediately
+        assert self.watching
+        return self.redis.get(key)
+
+    def mget(self, keys):
+        self.commands.append(lambda: [self.redis.strings.get(key) for key in keys])
+
+    def set(self, key, value):
+        self.commands.append(lambda: self.redis.strings.__setitem__(key, value) or True)
+
+    def zadd(self, key, mapping):
+        self.commands.append(lambda: self.redis.zsets.setdefault(key, {}).update(mapping) or len(mapping))
+
+    def delete(self, key):
+        self.commands.append(lambda: int(self.redis.strings.pop(key, None) is not None))
+
+    def zrange(self, key, start, end, withscores=False):
+        items = sorted(self.redis.zsets.get(key, {}).items(), key=lambda item: item[1])
+        self.commands.append(lambda: items if withscores else [member for member, _ in items])
+
+    def zscore(self, key, member):
+        self.commands.append(lambda: self.redis.zsets.get(key, {}).get(member))
+
+    def hgetall(self, key):
+        self.commands.append(lambda: dict(self.redis.hashes.get(key, {})))
+
+    def hmget(self, key, fields):
+        self.commands.append(lambda: [self.redis.hashes.get(key, {}).get(field) for field in fields])
+
+    def hdel(self, key, *fields):
+        hashes = self.redis.hashes.get(key, {})
+        self.commands.append(lambda: sum(hashes.pop(field, None) is not None for field in fields))
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        def add():
+            self.redis.stream.append((f"{len(self.redis.stream) + 1}-0", dict(fields)))
+            return self.redis.stream[-1][0]
+        self.commands.append(add)
+
+    def zrem(self, key, *members):
+        zset = self.redis.zsets.setdefault(key, {})
+        self.commands.append(lambda: sum(zset.pop(member, None) is not None for member in members))
+
+    async def execute(self):
+        self.redis.calls.append(f"pipeline:{len(self.commands)}")
+        return [command() for command in self.commands]
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_round_trips_and_indexes_sessions():
+    redis = FakeRedis()
+    backend = RedisBackend("redis://test", client=redis)
+
+    await backend.save("sid", "{}")
+    assert redis.strings == {"aiograpi-rest:session:sid": "{}"}
+    assert list(redis.zsets["aiograpi-rest:sessions"]) == ["sid"]
+    assert await backend.load("sid") == "{}"
+    assert await backend.delete("sid") is True
+    assert await backend.delete("sid") is False
+    assert await backend.load("sid") is None
+    assert redis.zsets["aiograpi-rest:sessions"] == {}
+    await backend.close()
+    assert redis.closed is True
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_serves_repeat_loads_from_short_local_cache():
+    clock = FakeClock()
+    redis = FakeRedis()
+    redis.strings["aiograpi-rest:session:sid"] = "v1"
+    backend = RedisBackend("redis://test", client=redis, local_ttl=2, clock=clock)
+
+    assert await backend.load("sid") == "v1"
+    redis.strings["aiograpi-rest:session:sid"] = "v2"
+    assert await backend.load("sid") == "v1"
+    assert redis.calls == ["get"]
+
+    clock.now = 3
+    assert await backend.load("sid") == "v2"
+    assert await backend.load("missing") is None
+    redis.strings["aiograpi-rest:session:missing"] = "new"
+    assert await backend.load("missing") == "new"
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_load_many_uses_one_pipelined_round_trip():
+    redis = FakeRedis()
+    backend = RedisBackend("redis://test", client=redis, batch_size=2, local_ttl=0)
+    for key in ("a", "b", "c"):
+        redis.strings[f"aiograpi-rest:session:{key}"] = key.upper()
+
+    assert await backend.load_many(["a", "b", "missing", "c"]) == {"a": "A", "b": "B", "c": "C"}
+    assert redis.calls == ["pipeline:2"]
+    assert await backend.load_many([]) == {}
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_compact_drops_index_entries_without_sessions():
+    redis = FakeRedis()
+    backend = RedisBackend("redis://test", client=redis, local_ttl=0)
+    await backend.save("a", "{}")
+    await backend.save("b", "{}")
+    del redis.strings["aiograpi-rest:session:b"]
+
+    assert await backend.compact() == {"before": 2, "after": 1, "removed": 1}
+    assert list(redis.zsets["aiograpi-rest:sessions"]) == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_workers_share_sessions_through_redis():
+    redis = FakeRedis()
+    first, second = (
+        ClientStorage(client_factory=FakeClient, cache=ClientCache(), backend=RedisBackend("redis://", client=redis))
+        for _ in range(2)
+    )
+
+    await first.set(FakeClient())
+    client = await second.get("sid")
+
+    assert client.settings == {"authorization_data": {"sessionid": "sid"}}
+
+
+@pytest.mark.asyncio
+async def test_blocking_backends_load_many(tmp_path):
+    for backend in (TinyDBBackend(tmp_path / "db.json"), SQLiteBackend(tmp_path / "db.sqlite3")):
+        await backend.save("a", "A")
+        await backend.save("b", "B")
+        assert await backend.load_many(["a", "b", "missing"]) == {"a": "A", "b": "B"}
+        assert await backend.load_many([]) == {}
+        await backend.close()
+
+
+def test_redis_backend_is_chosen_from_url(monkeypatch):
+    pytest.importorskip("redis")
+    backend = create_backend("redis://localhost:6379/3")
+    assert isinstance(backend, RedisBackend)
+    assert backend.url == "redis://localhost:6379/3"
+
+    monkeypatch.setenv("AIOGRAPI_REST_REDIS_URL", "redis://cache:6379/1")
+    monkeypatch.setenv("AIOGRAPI_REST_REDIS_PREFIX", "app:")
+    backend = create_backend("./db.json", backend="redis")
+    assert backend.url == "redis://cache:6379/1"
+    assert backend.index_key == "app:sessions"
+
+
+async def _two_workers(backend_factory):
+    workers = [
+        ClientStorage(client_factory=MutableClient, cache=ClientCache(), backend=backend_factory(), flush_interval=0)
+        for _ in range(2)
+    ]
+    for worker in workers:
+        assert await worker.sync_changes() == 0
+    return workers
+
+
+@pytest.mark.parametrize("name", ["db.json", "db.sqlite3"])
+@pytest.mark.asyncio
+async def test_other_workers_evict_clients_changed_elsewhere(tmp_path, name):
+    first, second = await _two_workers(lambda: create_backend(tmp_path / name))
+    cl = MutableClient()
+    cl.settings = {"authorization_data": {"sessionid": "sid"}, "v": 1}
+    await first.set(cl)
+    stale = await second.get("sid")
+
+    assert await first.sync_changes() == 0
+    assert await second.sync_changes() == 0
+    cl.settings = {**cl.settings, "v": 2}
+    await first.set(cl)
+
+    assert await first.sync_changes() == 0
+    assert await second.sync_changes() == 1
+    fresh = await second.get("sid")
+    assert fresh is not stale
+    assert fresh.settings["v"] == 2
+    assert second.stats()["invalidations"] == 1
+
+    await first.delete("sid")
+    assert await second.sync_changes() == 1
+    assert "sid" not in second.cache
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.parametrize("name", ["db.json", "db.sqlite3", "redis"])
+@pytest.mark.asyncio
+async def test_flush_does_not_overwrite_settings_saved_by_another_worker(tmp_path, name):
+    redis = FakeRedis()
+
+    def backend():
+        return RedisBackend("redis://", client=redis) if name == "redis" else create_backend(tmp_path / name)
+
+    first, second = (
+        ClientStorage(client_factory=MutableClient, cache=ClientCache(), backend=backend(), flush_interval=5)
+        for _ in range(2)
+    )
+    for worker in (first, second):
+        await worker.sync_changes()
+    cl = MutableClient()
+    cl.settings = {"authorization_data": {"sessionid": "sid"}, "v": 1}
+    await first.set(cl)
+    dirty = await first.get("sid")
+    dirty.settings = {**dirty.settings, "cookie": "old"}
+
+    relogged = MutableClient()
+    relogged.settings = {"authorization_data": {"sessionid": "sid"}, "v": 2}
+    await second.set(relogged)
+
+    assert await first.flush() == 0
+    assert first.stats()["flush_conflicts"] == 1
+    assert "sid" not in first.cache
+    assert decode_settings(await first.backend.load("sid"))["v"] == 2
+    assert await second.sync_changes() == 0
+    assert second.cache.peek("sid").client is relogged
+    assert (await first.get("sid")).settings["v"] == 2
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_change_log_invalidates_other_workers():
+    redis = FakeRedis()
+    first, second = await _two_workers(lambda: RedisBackend("redis://", client=redis))
+    cl = MutableClient()
+    cl.settings = {"authorization_data": {"sessionid": "sid"}, "v": 1}
+    await first.set(cl)
+    await second.get("sid")
+    await second.sync_changes()
+
+    cl.settings = {**cl.settings, "v": 2}
+    await first.set(cl)
+    assert await second.sync_changes() == 1
+    assert (await second.get("sid")).settings["v"] == 2
+
+    cl.settings = {**cl.settings, "v": 3}
+    await first.set(cl)
+    # The stream was trimmed past the worker's cursor, so every cached session is re-checked
+    del redis.stream[:-1]
+    calls = len(redis.calls)
+    assert await second.sync_changes() == 1
+    assert "pipeline:1" in redis.calls[calls:]
+
+
+@pytest.mark.asyncio
+async def test_sync_changes_without_writes_is_a_single_cheap_read(tmp_path):
+    backend = SQLiteBackend(tmp_path / "db.sqlite3")
+    cursor, keys = await backend.changes(None)
+    assert keys == []
+    assert await backend.changes(cursor) == (cursor, [])
+
+    await backend.save("a", "{}")
+    await backend.save("a", '{"x": 1}')
+    await backend.save("b", "{}")
+    cursor, keys = await backend.changes(cursor)
+    assert sorted(keys) == ["a", "b"]
+    await backend.compact()
+    assert backend.conn.execute("SELECT COUNT(*) FROM changes").fetchone()[0] == 2
+    assert await backend.changes(cursor) == (cursor, [])
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_change_log_is_trimmed_while_running(tmp_path):
+    backend = SQLiteBackend(tmp_path / "db.sqlite3", change_log_size=3)
+    cursor, _ = await backend.changes(None)
+    await backend.save("a", "{}")
+    cursor, keys = await backend.changes(cursor)
+    assert keys == ["a"]
+
+    for n in range(5):
+        await backend.save(f"s{n}", "{}")
+    assert backend.conn.execute("SELECT COUNT(*) FROM changes").fetchone()[0] == 3
+    # The writes right after our cursor were trimmed, so everything must be re-checked
+    cursor, keys = await backend.changes(cursor)
+    assert keys is None
+    await backend.save("b", "{}")
+    assert await backend.changes(cursor) == (cursor + 1, ["b"])
+    await backend.close()
+
+
+class ProbedClient(FakeClient):
+    outcomes = {}
+
+    def set_settings(self, settings):
+        self.settings = settings
+        self.sessionid = settings.get("sid", "sid")
+        return True
+
+    async def account_info(self):
+        outcome = self.outcomes.get(self.sessionid)
+        if outcome is not None:
+            raise outcome
+        return {"username": self.sessionid}
+
+
+async def _monitored_storage(tmp_path, outcomes, clock=None):
+    from aiograpi.exceptions import ChallengeRequired, LoginRequired
+
+    ProbedClient.outcomes = {
+        key: {"expired": LoginRequired("login_required"), "challenged": ChallengeRequired("challenge"),
+              "network": ConnectionError("reset")}[outcome]
+        for key, outcome in outcomes.items()
+    }
+    storage = ClientStorage(
+        db_path=tmp_path / "db.sqlite3", client_factory=ProbedClient, cache=ClientCache(),
+        clock=clock or FakeClock(), flush_interval=0,
+    )
+    storage.health.interval = 3600
+    storage.health.rate = 60_000
+    for key in ("alive", *outcomes):
+        await storage.backend.save(key, json.dumps({"sid": key}))
+    return storage
+
+
+@pytest.mark.asyncio
+async def test_health_monitor_records_probe_outcomes(tmp_path):
+    storage = await _monitored_storage(tmp_path, {"dead": "expired", "stuck": "challenged", "flaky": "network"})
+    storage.clock.now = 5000.0
+
+    assert await storage.health.run_once() == 4
+    records = {record["sessionid"]: record for record in await storage.backend.records()}
+
+    assert {key: record["status"] for key, record in records.items()} == {
+        "alive": "healthy", "dead": "expired", "stuck": "challenged", "flaky": None,
+    }
+    assert all(record["checked_at"] == 5000.0 for record in records.values())
+    assert storage.health.stats() == {"probes": 4, "probe_errors": 1, "expired": 1, "challenged": 1}
+    # Nothing is due again until the interval passes
+    assert await storage.health.run_once() == 0
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_requests_fail_fast_on_known_dead_sessions(tmp_path):
+    from aiograpi.exceptions import ChallengeRequired, LoginRequired
+
+    storage = await _monitored_storage(tmp_path, {"dead": "expired", "stuck": "challenged"})
+    await storage.health.run_once()
+    ProbedClient.outcomes = {}
+
+    with pytest.raises(LoginRequired, match="health check"):
+        await storage.get("dead")
+    with pytest.raises(ChallengeRequired):
+        await storage.get("stuck")
+    alive = await storage.get("alive")
+    assert alive.timeline_called is False
+    assert (await storage.get("stuck", fail_fast=False)).sessionid == "stuck"
+
+    state = await storage.session_state("dead")
+    assert state["health"] == "expired"
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_saving_fresh_settings_revives_dead_session(tmp_path):
+    storage = await _monitored_storage(tmp_path, {"dead": "expired"})
+    await storage.health.run_once()
+
+    cl = ProbedClient()
+    cl.set_settings({"sid": "dead"})
+    cl.get_settings = lambda: {"sid": "dead", "fresh": True}
+    await storage.set(cl)
+
+    assert await storage.get("dead") is cl
+    assert (await storage.backend.records(["dead"]))[0]["status"] == "healthy"
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_health_monitor_learns_statuses_recorded_by_other_workers(tmp_path):
+    from aiograpi.exceptions import LoginRequired
+
+    storage = await _monitored_storage(tmp_path, {})
+    await storage.backend.update_records({"alive": {"status": "expired", "checked_at": 0.0}})
+    storage.clock.now = 1.0
+
+    assert await storage.health.run_once() == 0
+    with pytest.raises(LoginRequired):
+        await storage.get("alive")
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_health_monitor_paces_probes_with_jitter(tmp_path, monkeypatch):
+    storage = await _monitored_storage(tmp_path, {"b": "network", "c": "network"})
+    storage.health.rate = 2
+    storage.health.rng = lambda: 1.0
+    pauses = []
+
+    async def fake_sleep(delay):
+        pauses.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    storage.clock.now = 10_000.0
+    # At most one minute's worth of probes per pass, least recently checked first
+    await storage.backend.update_records({"alive": {"checked_at": 1.0}})
+    assert await storage.health.run_once() == 2
+    assert pauses == [45.0]
+    assert storage.health.pause(10) == 15.0
+    storage.health.rng = lambda: 0.0
+    assert storage.health.pause() == 15.0
+    await storage.close()
+
+
+@pytest.mark.parametrize("name", ["db.json", "db.sqlite3", "redis"])
+@pytest.mark.asyncio
+async def test_flush_stores_last_used_and_validated_timestamps(tmp_path, name):
+    clock = FakeClock()
+    backend = RedisBackend("redis://", client=FakeRedis()) if name == "redis" else create_backend(tmp_path / name)
+    storage = ClientStorage(client_factory=FakeClient, cache=ClientCache(), clock=clock, backend=backend)
+    await backend.save("sid", "{}")
+
+    clock.now = 100.0
+    await storage.get("sid")
+    clock.now = 150.0
+    await storage.get("sid")
+    assert (await backend.records(["sid"]))[0]["last_used_at"] is None
+    assert (await storage.session_state("sid"))["last_used_at"] == 100.0
+
+    await storage.flush()
+    record = (await backend.records(["sid"]))[0]
+    assert record["last_used_at"] == 100.0
+    assert record["validated_at"] == 100.0
+
+    # Uses within the resolution are not written back; later ones are
+    clock.now = 100.0 + storage.last_used_resolution
+    await storage.get("sid")
+    assert (await storage.session_state("sid"))["last_used_at"] == clock.now
+    await storage.flush()
+    assert (await backend.records(["sid"]))[0]["last_used_at"] == clock.now
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_repeated_lookups_do_not_rewrite_the_tinydb_file(tmp_path):
+    clock = FakeClock()
+    clock.now = 1_000.0
+    backend = create_backend(tmp_path / "db.json")
+    storage = ClientStorage(client_factory=FakeClient, cache=ClientCache(), clock=clock, backend=backend)
+    storage.idle_ttl = 600
+    await storage.backend.save("sid", "{}")
+    await storage.get("sid")
+    await storage.flush()
+    stat = (tmp_path / "db.json").stat().st_mtime_ns
+
+    for _ in range(10):
+        clock.now += 5
+        await storage.get("sid")
+        await storage.flush()
+    assert (tmp_path / "db.json").stat().st_mtime_ns == stat
+    # A tenth of the idle TTL later the use is recorded
+    clock.now = 1_060.0
+    await storage.get("sid")
+    await storage.flush()
+    assert (await storage.backend.records(["sid"]))[0]["last_used_at"] == 1_060.0
+    await storage.close()
+
+
+@pytest.mark.parametrize("name", ["db.json", "db.sqlite3", "redis"])
+@pytest.mark.asyncio
+async def test_gc_reclaims_idle_and_dead_sessions_in_batches(tmp_path, name):
+    clock = FakeClock()
+    clock.now = 10_000.0
+    backend = RedisBackend("redis://", client=FakeRedis()) if name == "redis" else create_backend(tmp_path / name)
+    storage = ClientStorage(client_factory=FakeClient, cache=ClientCache(), clock=clock, backend=backend)
+    storage.idle_ttl = 1000
+    storage.dead_ttl = 100
+    storage.gc_batch_size = 2
+    for key in ("idle1", "idle2", "idle3", "dead", "fresh"):
+        await backend.save(key, "{}")
+    await backend.update_records({
+        "idle1": {"last_used_at": 1.0},
+        "idle2": {"last_used_at": 2.0},
+        "idle3": {"last_used_at": 3.0},
+        "dead": {"last_used_at": 9_800.0, "status": "expired", "checked_at": 9_850.0},
+        "fresh": {"last_used_at": 9_999.0, "status": "expired", "checked_at": 9_990.0},
+    })
+    storage.cache.put("idle1", FakeClient())
+
+    assert await storage.collect_garbage() == {"reclaimed": 4, "batches": 2}
+    assert sorted(record["sessionid"] for record in await backend.records()) == ["fresh"]
+    assert "idle1" not in storage.cache
+    assert storage.stats()["gc_reclaimed"] == 4
+    assert await storage.collect_garbage() == {"reclaimed": 0, "batches": 0}
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_gc_waits_out_the_idle_ttl_for_rows_without_timestamps(tmp_path):
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient, cache=ClientCache())
+    storage.idle_ttl = 86400
+    # Rows written by older releases carry neither updated_at nor last_used_at
+    storage.backend.db.insert({"sessionid": "old", "settings": "{}"})
+
+    assert await storage.collect_garbage() == {"reclaimed": 0, "batches": 0}
+    record = (await storage.backend.records(["old"]))[0]
+    assert record["updated_at"] == pytest.approx(time.time(), abs=60)
+
+    storage.clock = lambda: time.time() + 86400 + 60
+    assert await storage.collect_garbage() == {"reclaimed": 1, "batches": 1}
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_gc_keeps_sessions_used_since_the_last_flush(tmp_path):
+    clock = FakeClock()
+    storage = ClientStorage(
+        db_path=tmp_path / "db.sqlite3", client_factory=FakeClient, cache=ClientCache(), clock=clock,
+    )
+    storage.idle_ttl = 1000
+    await storage.backend.save("sid", "{}")
+    await storage.backend.update_records({"sid": {"last_used_at": 1.0}})
+    clock.now = 5000.0
+    await storage.get("sid")
+
+    assert await storage.collect_garbage() == {"reclaimed": 0, "batches": 0}
+    assert await storage.backend.load("sid") is not None
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_gc_is_disabled_by_default(tmp_path):
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient)
+    assert storage.gc_enabled is False
+    assert await storage.collect_garbage() == {"reclaimed": 0, "batches": 0}
+    await storage.close()
+
+
+@pytest.mark.parametrize("name", ["db.json", "db.sqlite3", "redis"])
+@pytest.mark.asyncio
+async def test_warm_up_hydrates_most_recently_used_sessions(tmp_path, name):
+    clock = FakeClock()
+    clock.now = 10_000.0
+    backend = RedisBackend("redis://", client=FakeRedis()) if name == "redis" else create_backend(tmp_path / name)
+    storage = ClientStorage(
+        client_factory=FakeClient, cache=ClientCache(), clock=clock, backend=backend, validation_ttl=300,
+    )
+    for key in ("oldest", "old", "recent", "trusted", "dead"):
+        await backend.save(key, "{}")
+    await backend.update_records({
+        "oldest": {"last_used_at": 1.0},
+        "old": {"last_used_at": 2.0},
+        "recent": {"last_used_at": 9_000.0, "validated_at": 100.0},
+        "trusted": {"last_used_at": 9_990.0, "validated_at": 9_900.0},
+        "dead": {"last_used_at": 9_999.0, "status": "expired"},
+    })
+
+    assert await storage.warm_up(3) == {"sessions": 3, "warmed": 3, "failed": 0}
+
+    assert sorted(storage.cache._entries) == ["old", "recent", "trusted"]
+    assert storage.cache.peek("trusted").client.timeline_called is False
+    assert storage.cache.peek("trusted").validated_at == 9_900.0
+    assert storage.cache.peek("recent").client.timeline_called is True
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_requests_during_warm_up_join_its_lookup(tmp_path):
+    release = asyncio.Event()
+    validations = []
+
+    class SlowClient(FakeClient):
+        async def get_timeline_feed(self):
+            validations.append(self)
+            await release.wait()
+            return {"ok": True}
+
+    storage = ClientStorage(
+        db_path=tmp_path / "db.sqlite3", client_factory=SlowClient, cache=ClientCache(), validation_ttl=300,
+    )
+    await storage.backend.save("sid", "{}")
+    await storage.backend.update_records({"sid": {"last_used_at": time.time()}})
+    warm_up = asyncio.ensure_future(storage.warm_up(10))
+    await asyncio.sleep(0.05)
+    lookup = asyncio.ensure_future(storage.get("sid"))
+    await asyncio.sleep(0.05)
+    release.set()
+
+    assert await warm_up == {"sessions": 1, "warmed": 1, "failed": 0}
+    assert await lookup is storage.cache.peek("sid").client
+    assert len(validations) == 1
+    assert storage.stats()["coalesced_waits"] == 1
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_warm_up_bounds_concurrency_and_counts_failures(tmp_path):
+    active = {"now": 0, "max": 0}
+
+    class SlowClient(FakeClient):
+        def set_settings(self, settings):
+            self.settings = settings
+
+        async def get_timeline_feed(self):
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+            await asyncio.sleep(0.01)
+            active["now"] -= 1
+            if self.settings.get("broken"):
+                raise RuntimeError("login_required")
+            return {}
+
+    storage = ClientStorage(db_path=tmp_path / "db.sqlite3", client_factory=SlowClient, cache=ClientCache(max_size=8))
+    for index in range(10):
+        await storage.backend.save(f"s{index}", json.dumps({"broken": index == 9}))
+    await storage.backend.update_records({"s9": {"last_used_at": 1e12}})
+
+    assert await storage.warm_up(100, concurrency=3) == {"sessions": 8, "warmed": 7, "failed": 1}
+    assert active["max"] == 3
+    assert len(storage.cache) == 7
+    assert "s9" not in storage.cache
+    await storage.close()
+
+
+def test_settings_codec_round_trips_and_reads_legacy_rows():
+    settings = {"cookies": {"sessionid": "sid", "csrftoken": "x" * 32}, "device_settings": {"manufacturer": "OnePlus"}}
+
+    compact = encode_settings(settings)
+    compressed = encode_settings(settings, compress=True)
+
+    assert compact == json.dumps(settings, separators=(",", ":"))
+    assert compressed.startswith("z:")
+    assert json.dumps({"settings": compressed}) == '{"settings": "%s"}' % compressed
+    for stored in (compact, compressed, json.dumps(settings)):
+        assert decode_settings(stored) == settings
+
+
+@pytest.mark.asyncio
+async def test_tinydb_stores_settings_as_json_objects(tmp_path):
+    storage = ClientStorage(
+        db_path=tmp_path / "db.json", client_factory=MutableClient, cache=ClientCache(), flush_interval=5,
+    )
+    # Rows written by older releases hold the settings as a JSON string
+    storage.backend.db.insert({"sessionid": "sid", "settings": json.dumps({"n": 0})})
+    cl = await storage.get("sid")
+    cl.settings["n"] = 1
+    assert await storage.flush() == 1
+
+    row = json.loads((tmp_path / "db.json").read_text())["_default"]["1"]
+    assert row["settings"] == {"n": 1}
+    cl.settings["n"] = 2
+    assert (await storage.backend.load("sid")) == {"n": 1}
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_settings_compression_can_be_enabled(tmp_path, monkeypatch):
+    monkeypatch.setenv("AIOGRAPI_REST_SETTINGS_COMPRESSION", "zlib")
+    storage = ClientStorage(db_path=tmp_path / "db.sqlite3", client_factory=MutableClient, cache=ClientCache())
+    cl = MutableClient()
+    cl.settings = {"authorization_data": {"sessionid": "sid"}, "cookies": {"a": "b" * 200}}
+    await storage.set(cl)
+    storage.cache.clear()
+
+    stored = await storage.backend.load("sid")
+    assert stored.startswith("z:")
+    assert len(stored) < len(encode_settings(cl.settings))
+    assert (await storage.get("sid")).settings == cl.settings
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_login_coalescer_shares_failures_and_expires_reuse():
+    from storages import LoginCoalescer
+
+    clock = FakeClock()
+    logins = LoginCoalescer(reuse_window=30, clock=clock)
+    key = logins.key("u", "p", "")
+    release = asyncio.Event()
+
+    async def leader():
+        async with logins.coalesce(key) as flight:
+            assert flight.done is False
+            await release.wait()
+            raise RuntimeError("bad password")
+
+    async def follower():
+        async with logins.coalesce(key) as flight:
+            return flight
+
+    first = asyncio.create_task(leader())
+    await asyncio.sleep(0)
+    second = asyncio.create_task(follower())
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(first, second, return_exceptions=True)
+    assert [str(result) for result in results] == ["bad password", "bad password"]
+
+    async with logins.coalesce(key) as flight:
+        flight.result = "sid"
+    async with logins.coalesce(key) as flight:
+        assert (flight.done, flight.result) == (True, "sid")
+    clock.now = 31
+    async with logins.coalesce(key) as flight:
+        assert flight.done is False
+    assert logins.key("U ", "p", "") == key
+    assert logins.key("u", "p2", "") != key
+
+
+async def test_transport_pool_shares_transports_per_proxy_and_keeps_cookies(tmp_path):
+    from aiograpi import Client
+
+    storage = ClientStorage(tmp_path / "db.json", flush_interval=0)
+    first = Client()
+    first.private.set_cookies({"sessionid": "one"})
+    storage.transports.attach(first)
+    second = storage.client()
+    assert first.private.cookies_dict() == {"sessionid": "one"}
+    assert first.private._client._transport is second.private._client._transport
+    assert first.public._client._transport is first.private._client._transport
+
+    second.set_proxy("http://127.0.0.1:8080")
+    assert second.private._client._transport is not first.private._client._transport
+    assert second.private._client._transport is storage.transports.transport("http://127.0.0.1:8080")
+
+    # Closing one client must not tear down the pool the others use
+    await first.private._close()
+    assert storage.transports.stats()["pools"] == 2
+    await storage.close()
+    assert storage.transports.stats()["pools"] == 0
+
+
+async def test_transport_pool_counts_requests_and_connection_reuse():
+    import httpx
+
+    from storages import SharedTransport, TransportPool
+
+    class FakeTransport(httpx.AsyncBaseTransport):
+        def __init__(self):
+            self.connected = False
+
+        async def handle_async_request(self, request):
+            if not self.connected:
+                self.connected = True
+                await request.extensions["trace"]("connection.connect_tcp.started", {})
+            return httpx.Response(200, content=b"ok")
+
+    pool = TransportPool(max_connections=10)
+    pool._transports[("", True)] = SharedTransport(pool, FakeTransport())
+    async with httpx.AsyncClient(transport=pool.transport()) as client:
+        for _ in range(4):
+            assert (await client.get("https://i.instagram.com/")).status_code == 200
+    stats = pool.stats()
+    assert stats["requests"] == 4
+    assert stats["connections_opened"] == 1
+    assert stats["reuse_ratio"] == 0.75
+
+
+def test_transport_pool_disabled_leaves_clients_alone():
+    from aiograpi import Client
+
+    from storages import TransportPool
+
+    cl = Client()
+    original = cl.private._client
+    TransportPool(max_connections=0).attach(cl)
+    assert cl.private._client is original
+    # Test doubles without httpx sessions are skipped
+    assert TransportPool().attach(FakeClient()).sessionid == "sid"
+
+
+def test_action_class_separates_likes_follows_and_dms():
+    from storages import action_class
+
+    assert action_class("media/123_4/like/") == "like"
+    assert action_class("media/123_4/unlike/") == "like"
+    assert action_class("friendships/create/42/") == "follow"
+    assert action_class("friendships/42/followers/") == "read"
+    assert action_class("direct_v2/threads/broadcast/text/") == "dm"
+    assert action_class("direct_v2/inbox/") == "read"
+    assert action_class("https://www.instagram.com/api/v1/users/web_profile_info/") == "read"
+
+
+def test_parse_rate_limits():
+    from storages import parse_rate_limits
+
+    assert parse_rate_limits("read=100/60, like=5/3600,") == {"read": (100.0, 60.0), "like": (5.0, 3600.0)}
+    assert parse_rate_limits("") == {}
+
+
+async def test_rate_limiter_queues_short_waits_and_rejects_long_ones():
+    from storages import RateLimited, RateLimiter
+
+    limiter = RateLimiter(session_limits={"read": (1, 0.05), "like": (1, 3600)}, proxy_limits={}, max_wait=1)
+    await limiter.acquire("read", "sid")
+    started = time.monotonic()
+    await limiter.acquire("read", "sid")
+    assert time.monotonic() - started >= 0.04
+    assert limiter.stats()["queued"]["read"] == 1
+    assert limiter.stats()["waiting"]["read"] == 0
+    # Other sessions and other action classes have their own buckets
+    await limiter.acquire("read", "other")
+    await limiter.acquire("like", "sid")
+    with pytest.raises(RateLimited) as exc_info:
+        await limiter.acquire("like", "sid")
+    assert exc_info.value.retry_after > 3000
+    assert limiter.stats()["rejected"]["like"] == 1
+
+
+async def test_rate_limiter_proxy_budget_spans_sessions():
+    from storages import RateLimited, RateLimiter
+
+    limiter = RateLimiter(session_limits={}, proxy_limits={"follow": (2, 3600)}, max_wait=0)
+    await limiter.acquire("follow", "a", "http://proxy:1")
+    await limiter.acquire("follow", "b", "http://proxy:1")
+    await limiter.acquire("follow", "c", "http://proxy:2")
+    with pytest.raises(RateLimited):
+        await limiter.acquire("follow", "d", "http://proxy:1")
+    # Requests without a proxy are only limited per session
+    await limiter.acquire("follow", "d")
+
+
+async def test_storage_guards_upstream_requests_of_its_clients(tmp_path):
+    from storages import RateLimited, RateLimiter
+
+    class RequestingClient(FakeClient):
+        def __init__(self):
+            super().__init__()
+            self.endpoints = []
+
+        async def private_request(self, endpoint, data=None, **kwargs):
+            self.endpoints.append(endpoint)
+            return {"status": "ok"}
+
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=RequestingClient, flush_interval=0)
+    storage.limiter = RateLimiter(session_limits={"like": (1, 3600)}, proxy_limits={}, max_wait=0)
+    await storage.set(storage.client())
+    cl = await storage.get("sid")
+    assert await cl.private_request("media/1_2/like/") == {"status": "ok"}
+    await cl.private_request("users/1/info/")
+    with pytest.raises(RateLimited):
+        await cl.private_request("media/3_4/like/")
+    assert cl.endpoints == ["media/1_2/like/", "users/1/info/"]
+    # Clients hydrated from storage are guarded too
+    storage.cache.clear()
+    with pytest.raises(RateLimited):
+        await (await storage.get("sid")).private_request("media/5_6/like/")
+
+
+async def test_circuit_breaker_opens_fails_fast_and_closes_after_probe(tmp_path):
+    from aiograpi.exceptions import ClientConnectionError, UserNotFound
+
+    from storages import CircuitBreakers, CircuitOpen
+
+    clock = FakeClock()
+
+    class FlakyClient(FakeClient):
+        def __init__(self):
+            super().__init__()
+            self.proxy = "http://proxy:1"
+            self.calls = 0
+            self.error = ClientConnectionError("proxy down")
+
+        async def private_request(self, endpoint, *args, **kwargs):
+            self.calls += 1
+            if self.error is not None:
+                raise self.error
+            return {"status": "ok"}
+
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FlakyClient, flush_interval=0)
+    storage.breakers = CircuitBreakers(failures=2, cooldown=30, clock=clock)
+    cl = storage.client()
+    for _ in range(2):
+        with pytest.raises(ClientConnectionError):
+            await cl.private_request("users/1/info/")
+    with pytest.raises(CircuitOpen) as exc_info:
+        await cl.private_request("users/1/info/")
+    assert exc_info.value.scope == "proxy"
+    assert cl.calls == 2
+    # Another session behind the same proxy fails fast too
+    other = storage.client()
+    other.sessionid = "other"
+    with pytest.raises(CircuitOpen):
+        await other.private_request("users/1/info/")
+
+    clock.now += 31
+    cl.error = UserNotFound("gone")
+    with pytest.raises(UserNotFound):
+        await cl.private_request("users/1/info/")
+    cl.error = None
+    assert await cl.private_request("users/1/info/") == {"status": "ok"}
+    assert storage.breakers.stats() == {"open_sessions": 0, "open_proxies": 0, "opened": 1, "rejected": 2}
+
+
+async def test_circuit_breaker_half_open_probe_failure_reopens_session_circuit():
+    from aiograpi.exceptions import LoginRequired
+
+    from storages import CircuitBreakers, CircuitOpen
+
+    clock = FakeClock()
+    breakers = CircuitBreakers(failures=1, cooldown=10, clock=clock)
+    paths = [("session", "sid"), ("proxy", "")]
+    breakers.enter(paths)
+    breakers.record(paths, LoginRequired("expired"))
+    assert breakers.stats()["open_sessions"] == 1
+    assert breakers.stats()["open_proxies"] == 0
+    clock.now += 11
+    breakers.enter(paths)
+    # Only one probe at a time while half-open
+    with pytest.raises(CircuitOpen):
+        breakers.enter(paths)
+    breakers.record(paths, LoginRequired("still expired"))
+    with pytest.raises(CircuitOpen) as exc_info:
+        breakers.enter(paths)
+    assert exc_info.value.retry_after == 10
+    assert breakers.stats()["opened"] == 2
+    # A cancelled probe hands the probe to the next caller
+    clock.now += 11
+    breakers.enter(paths)
+    breakers.record(paths, asyncio.CancelledError())
+    breakers.enter(paths)
+    breakers.reset("session", "sid")
+    assert breakers.stats()["open_sessions"] == 0
+
+
+async def test_recovery_lookups_reset_the_session_circuit(tmp_path):
+    from aiograpi.exceptions import LoginRequired
+
+    from storages import CircuitBreakers
+
+    storage = ClientStorage(db_path=tmp_path / "db.json", client_factory=FakeClient, flush_interval=0)
+    storage.breakers = CircuitBreakers(failures=1, cooldown=60)
+    await storage.set(FakeClient())
+    storage.breakers.record([("session", "sid")], LoginRequired("expired"))
+    assert storage.breakers.stats()["open_sessions"] == 1
+    await storage.get("sid")
+    assert storage.breakers.stats()["open_sessions"] == 1
+    await storage.get("sid", fail_fast=False)
+    assert storage.breakers.stats()["open_sessions"] == 0
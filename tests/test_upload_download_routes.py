@@ -2,6 +2,7 @@ import json
 import types
 from pathlib import Path
 
+import httpx
 import pytest
 from httpx import ASGITransport, AsyncClient
 
@@ -11,7 +12,7 @@ import routers.igtv as igtv_router
 import routers.photo as photo_router
 import routers.story as story_router
 import routers.video as video_router
-from dependencies import get_clients
+from dependencies import get_clients, get_fetcher
 from main import app
 
 
@@ -146,20 +147,15 @@ def storage():
 
 
 @pytest.fixture
-def fake_requests(monkeypatch):
-    """Replace requests.get with a fake that returns a small byte payload."""
-    class FakeResponse:
-        def __init__(self, content):
-            self.content = content
+async def fake_fetcher():
+    """Serve every upload URL from a mock transport with a small byte payload."""
+    def handler(request):
+        return httpx.Response(200, content=b"fake-bytes")
 
-    def fake_get(url, *args, **kwargs):
-        return FakeResponse(b"fake-bytes")
-
-    monkeypatch.setattr(photo_router, "requests", types.SimpleNamespace(get=fake_get))
-    monkeypatch.setattr(video_router, "requests", types.SimpleNamespace(get=fake_get))
-    monkeypatch.setattr(clip_router, "requests", types.SimpleNamespace(get=fake_get))
-    monkeypatch.setattr(igtv_router, "requests", types.SimpleNamespace(get=fake_get))
-    monkeypatch.setattr(story_router, "requests", types.SimpleNamespace(get=fake_get))
+    fetcher = helpers.UrlFetcher(transport=httpx.MockTransport(handler))
+    app.dependency_overrides[get_fetcher] = lambda: fetcher
+    yield fetcher
+    await fetcher.close()
 
 
 @pytest.fixture
@@ -246,7 +242,7 @@ async def test_photo_upload_uses_helper(storage):
 
 
 @pytest.mark.asyncio
-async def test_photo_upload_by_url_uses_helper(storage, fake_requests):
+async def test_photo_upload_by_url_uses_helper(storage, fake_fetcher):
     usertag = json.dumps({"user": {"pk": 1, "username": "u", "full_name": "f"}, "x": 0.5, "y": 0.5})
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         response = await ac.post(
@@ -287,7 +283,7 @@ async def test_photo_upload_to_story_as_video(storage, fake_storybuilder):
 
 
 @pytest.mark.asyncio
-async def test_photo_upload_to_story_by_url_as_photo(storage, fake_requests):
+async def test_photo_upload_to_story_by_url_as_photo(storage, fake_fetcher):
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         response = await ac.post(
             "/story/upload/by/url",
@@ -302,7 +298,7 @@ async def test_photo_upload_to_story_by_url_as_photo(storage, fake_requests):
 
 
 @pytest.mark.asyncio
-async def test_photo_upload_to_story_by_url_as_video(storage, fake_requests, fake_storybuilder):
+async def test_photo_upload_to_story_by_url_as_video(storage, fake_fetcher, fake_storybuilder):
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         response = await ac.post(
             "/story/upload/by/url",
@@ -386,7 +382,7 @@ async def test_video_upload_with_and_without_thumbnail(storage):
 
 
 @pytest.mark.asyncio
-async def test_video_upload_by_url_with_and_without_thumbnail(storage, fake_requests):
+async def test_video_upload_by_url_with_and_without_thumbnail(storage, fake_fetcher):
     usertag = json.dumps({"user": {"pk": 1, "username": "u", "full_name": "f"}, "x": 0.5, "y": 0.5})
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         no_thumb = await ac.post(
@@ -424,7 +420,7 @@ async def test_story_upload_video(storage, fake_storybuilder):
 
 
 @pytest.mark.asyncio
-async def test_story_upload_video_by_url(storage, fake_requests, fake_storybuilder):
+async def test_story_upload_video_by_url(storage, fake_fetcher, fake_storybuilder):
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         response = await ac.post(
             "/story/upload/by/url",
@@ -497,7 +493,7 @@ async def test_clip_upload_with_and_without_thumbnail(storage):
 
 
 @pytest.mark.asyncio
-async def test_clip_upload_by_url_with_and_without_thumbnail(storage, fake_requests):
+async def test_clip_upload_by_url_with_and_without_thumbnail(storage, fake_fetcher):
     usertag = json.dumps({"user": {"pk": 1, "username": "u", "full_name": "f"}, "x": 0.5, "y": 0.5})
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         no_thumb = await ac.post(
@@ -579,7 +575,7 @@ async def test_igtv_upload_with_and_without_thumbnail(storage):
 
 
 @pytest.mark.asyncio
-async def test_igtv_upload_by_url_with_and_without_thumbnail(storage, fake_requests):
+async def test_igtv_upload_by_url_with_and_without_thumbnail(storage, fake_fetcher):
     usertag = json.dumps({"user": {"pk": 1, "username": "u", "full_name": "f"}, "x": 0.5, "y": 0.5})
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         no_thumb = await ac.post(
@@ -644,3 +640,86 @@ async def test_album_upload(storage):
         )
     assert response.status_code == 200
     assert any(call[0] == "album_upload" for call in storage.client.calls)
+
+
+@pytest.mark.asyncio
+async def test_url_fetcher_streams_body_into_spool_file():
+    def handler(request):
+        return httpx.Response(200, content=b"x" * 300_000)
+
+    fetcher = helpers.UrlFetcher(transport=httpx.MockTransport(handler), chunk_size=1024)
+    async with fetcher.fetch("https://example.com/a.mp4", suffix=".mp4") as path:
+        assert path.endswith(".mp4")
+        assert Path(path).read_bytes() == b"x" * 300_000
+    assert not Path(path).exists()
+    assert fetcher.stats() == {"fetches": 1, "fetched_bytes": 300_000, "rejected": 0, "errors": 0}
+    await fetcher.close()
+
+
+@pytest.mark.asyncio
+async def test_url_fetcher_writes_chunks_off_the_event_loop(monkeypatch):
+    opened = []
+    aiofiles_open = helpers.aiofiles.open
+
+    def recording_open(path, mode):
+        opened.append(mode)
+        return aiofiles_open(path, mode)
+
+    monkeypatch.setattr(helpers.aiofiles, "open", recording_open)
+    fetcher = helpers.UrlFetcher(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=b"abc")))
+    async with fetcher.fetch("https://example.com/a.jpg") as path:
+        assert Path(path).read_bytes() == b"abc"
+    assert opened == ["wb"]
+    await fetcher.close()
+
+
+@pytest.mark.asyncio
+async def test_url_fetcher_enforces_size_limit_while_streaming():
+    async def body():
+        yield b"x" * 600
+        yield b"x" * 600
+
+    def handler(request):
+        # No content-length: the limit must trip on the streamed bytes
+        return httpx.Response(200, content=body())
+
+    fetcher = helpers.UrlFetcher(max_bytes=1000, transport=httpx.MockTransport(handler))
+    with pytest.raises(helpers.HTTPException) as exc_info:
+        async with fetcher.fetch("https://example.com/a.jpg"):
+            pass
+    assert exc_info.value.status_code == 413
+    assert fetcher.stats()["rejected"] == 1
+    await fetcher.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("handler, status_code", [
+    (lambda request: httpx.Response(404), 502),
+    (lambda request: (_ for _ in ()).throw(httpx.ConnectError("refused")), 502),
+    (lambda request: (_ for _ in ()).throw(httpx.ReadTimeout("slow")), 504),
+])
+async def test_url_fetcher_maps_upstream_failures(handler, status_code):
+    fetcher = helpers.UrlFetcher(transport=httpx.MockTransport(handler))
+    with pytest.raises(helpers.HTTPException) as exc_info:
+        async with fetcher.fetch("https://example.com/a.jpg"):
+            pass
+    assert exc_info.value.status_code == status_code
+    assert fetcher.stats()["errors"] == 1
+    await fetcher.close()
+
+
+@pytest.mark.asyncio
+async def test_photo_upload_by_url_rejects_oversized_remote_file(storage):
+    def handler(request):
+        return httpx.Response(200, headers={"content-length": "5000"}, content=b"x" * 5000)
+
+    fetcher = helpers.UrlFetcher(max_bytes=1000, transport=httpx.MockTransport(handler))
+    app.dependency_overrides[get_fetcher] = lambda: fetcher
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post(
+            "/photo/upload/by/url",
+            data={"sessionid": "sid", "url": "https://example.com/photo.jpg", "caption": "hello"},
+        )
+    await fetcher.close()
+    assert response.status_code == 413
+    assert not any(call[0] == "photo_upload" for call in storage.client.calls)